@@ -0,0 +1,179 @@
+from models import Movie, Genre, Movie_rating, Movie_genre, Played_in, Actor, Year_count, Genre_count, Top_movie, Actor_score, Cube_cell
+from models import Movie_ranking
+from sqlalchemy import select, func, desc, delete, insert, cast, union_all, literal, Integer, Double, String
+from db_functions import bump_data_version, writing, execute_rows
+from metrics import measure_stage, step
+import numpy as np
+import pandas as pd
+
+# Number of movies kept in top_movies
+TOP_MOVIES = 100
+
+SUMMARY_TABLES = [Year_count.__table__, Genre_count.__table__, Top_movie.__table__, Actor_score.__table__, Cube_cell.__table__,
+                  Movie_ranking.__table__]
+
+# Dimensions of the cube, in the order of their bit in cube_cells.dims
+CUBE_DIMENSIONS = ['year', 'genre', 'is_adult', 'rating_bucket']
+
+# Width of the rating buckets : with 1, bucket 6 holds ratings from 6.0 to 6.9
+RATING_BUCKET = 1
+
+
+def movie_per_year_query():
+    """Number of movies for each start year, computed on the movies table."""
+    return (
+        select(Movie.start_year.label("year"), func.count(Movie.primary_title).label("movie_number"))
+        .where(Movie.start_year.is_not(None))
+        .group_by(Movie.start_year)
+    )
+
+
+def movie_per_genre_query():
+    """Number of movies for each genre, computed on the movie_genre table.
+    Names are taken with max (one name per group) rather than as bare columns, which only SQLite allows in a GROUP BY.
+    """
+    return (
+        select(Genre.id.label("id"), func.max(Genre.name).label("genre"), func.count(Movie_genre.c.movie).label("movie_number"))
+        .join(Movie_genre, Genre.id == Movie_genre.c.genre)
+        .group_by(Genre.id)
+    )
+
+
+def top_movies_query(limit = TOP_MOVIES):
+    """Movies with the best score (average rating times number of votes), ranked from 1. Read from ix_movie_ratings_score."""
+    return (
+        select(func.row_number().over(order_by = (desc(Movie_rating.score), desc(Movie_rating.tconst))).label("rank"),
+               Movie.primary_title.label("title"), Movie_rating.score.label("score"),
+               Movie_rating.average_rating.label("rating"), Movie_rating.num_votes.label("num_votes"))
+        .join(Movie, Movie_rating.tconst == Movie.tconst)
+        .order_by(desc(Movie_rating.score), desc(Movie_rating.tconst))
+        .limit(limit)
+    )
+
+
+def actor_scores_query(ratings = None):
+    """Scores of each actor over the rated movies they played in : the sum of the stored score of the movies, and averages.
+    IMDb ratings have one decimal, so score*10 is an integer : sums are done on integers, which are exact whatever the
+    order of the rows, so that SQLite and DuckDB (see analytics.py) give exactly the same values.
+    As in movie_per_genre_query, the name is the max of a single value so that DuckDB runs the query too.
+
+    Args:
+        ratings (sqlalchemy.sql.Subquery, optional): Rated movies to score the actors on, with the columns tconst,
+          average_rating, num_votes and score of movie_ratings (ie some rows of movie_rankings). Defaults to every movie rated.
+
+    Returns:
+        sqlalchemy.sql.Select: One row per actor
+    """
+    ratings = Movie_rating.__table__ if ratings is None else ratings
+    rating_tenths = cast(func.round(ratings.c.average_rating * 10), Integer)
+    score = cast(func.sum(cast(func.round(ratings.c.score * 10), Integer)), Double) / 10
+    movies = func.count(ratings.c.tconst)
+    return (
+        select(Played_in.c.actor.label("actor"), func.max(Actor.primary_name).label("name"), score.label("score"),
+               (score / movies).label("average_score"), (cast(func.sum(rating_tenths), Double) / 10 / movies).label("average_rating"),
+               func.avg(ratings.c.num_votes).label("num_votes"), func.count(Actor.primary_name).label("movie_number"))
+        .join(Played_in, Actor.nconst == Played_in.c.actor)
+        .join(ratings, Played_in.c.movie == ratings.c.tconst)
+        .group_by(Played_in.c.actor)
+    )
+
+
+def movie_rankings_query():
+    """Rows of movie_rankings : each rated movie once with a NULL genre, then once for each of its genres."""
+    columns = [Movie.is_adult, Movie.start_year, Movie_rating.score, Movie_rating.tconst, Movie.primary_title.label("title"),
+               Movie_rating.average_rating, Movie_rating.num_votes]
+    every_genre = (
+        select(cast(literal(None), String).label("genre"), *columns)
+        .join(Movie, Movie_rating.tconst == Movie.tconst)
+    )
+    by_genre = (
+        select(Genre.name.label("genre"), *columns)
+        .join(Movie, Movie_rating.tconst == Movie.tconst)
+        .join(Movie_genre, Movie_genre.c.movie == Movie_rating.tconst)
+        .join(Genre, Genre.id == Movie_genre.c.genre)
+    )
+    return union_all(every_genre, by_genre)
+
+
+def cube_cells(movies, genres):
+    """Cells of the cube for the 16 combinations of dimensions. Each combination is its own GROUP BY on the movies :
+    a movie has several genres, so cells without genre can't be summed from cells with genre.
+
+    Args:
+        movies (pd.DataFrame): One row per movie, with movie, year, is_adult, average_rating and num_votes
+          (NaN for movies without rating).
+        genres (pd.DataFrame): One row per pair movie-genre, with movie and genre (name).
+
+    Returns:
+        pd.DataFrame: Columns of cube_cells, without id
+    """
+    movies = movies.assign(year = movies['year'].astype('Int64'), is_adult = movies['is_adult'].astype('boolean'),
+                           rating_bucket = (np.floor(movies['average_rating'] / RATING_BUCKET) * RATING_BUCKET).astype('Int64'))
+    # Movies without genre are kept, with a NULL genre
+    with_genres = movies.merge(genres, on = 'movie', how = 'left')
+
+    cells = []
+    for dims in range(2 ** len(CUBE_DIMENSIONS)):
+        kept = [dimension for bit, dimension in enumerate(CUBE_DIMENSIONS) if dims >> bit & 1]
+        source = with_genres if 'genre' in kept else movies
+        # Without dimension, the whole table is one group
+        groups = source.groupby(kept, dropna = False) if kept else source.groupby(np.zeros(len(source)))
+        cell = groups.agg(movie_number = ('movie', 'size'), rated_number = ('average_rating', 'count'),
+                          rating_sum = ('average_rating', 'sum'), num_votes = ('num_votes', 'sum'))
+        cell = cell.reset_index() if kept else cell.reset_index(drop = True)
+        cells.append(cell.assign(dims = dims))
+
+    cells = pd.concat(cells, ignore_index = True)
+    cells['num_votes'] = cells['num_votes'].astype('int64')
+    return cells[['dims'] + CUBE_DIMENSIONS + ['movie_number', 'rated_number', 'rating_sum', 'num_votes']]
+
+
+def rebuild_cube(connection):
+    """Fill cube_cells from movies, movie_ratings and movie_genre, in the transaction of connection."""
+    with step('read cube'):
+        movies = pd.read_sql(
+            select(Movie.tconst.label("movie"), Movie.start_year.label("year"), Movie.is_adult,
+                   Movie_rating.average_rating, Movie_rating.num_votes)
+            .outerjoin(Movie_rating, Movie.tconst == Movie_rating.tconst), connection)
+        genres = pd.read_sql(select(Movie_genre.c.movie, Genre.name.label("genre")).join(Genre, Movie_genre.c.genre == Genre.id),
+                             connection)
+    with step('group cube'):
+        cells = cube_cells(movies, genres)
+    with step('insert cube'):
+        execute_rows(connection, f"INSERT INTO cube_cells ({', '.join(cells.columns)}) VALUES ({', '.join('?' * len(cells.columns))})",
+                     cells)
+
+
+@measure_stage('aggregates')
+def rebuild_aggregates(engine):
+    """Recompute every summary table read by the API from the base tables, in one transaction.
+    Must be called at the end of each load, refresh included : it also bumps the data version, so the API cache is invalidated.
+
+    Args:
+        engine (sqlalchemy.orm.engine): Engine to connect to database.
+    """
+    print("summary tables creation...")
+    with writing(engine) as connection:
+        # Indexes are built once the tables are filled rather than maintained row by row : movie_rankings has several rows
+        # per rated movie and four indexes, in an order unrelated to the one of the inserts
+        for table in SUMMARY_TABLES:
+            table.create(connection, checkfirst = True)
+            for index in table.indexes:
+                index.drop(connection, checkfirst = True)
+            connection.execute(delete(table))
+
+        for table, query in [(Year_count.__table__, movie_per_year_query()), (Genre_count.__table__, movie_per_genre_query()),
+                             (Top_movie.__table__, top_movies_query()), (Actor_score.__table__, actor_scores_query()),
+                             (Movie_ranking.__table__, movie_rankings_query())]:
+            columns = [column.name for column in query.selected_columns]
+            connection.execute(insert(table).from_select(columns, query))
+        rebuild_cube(connection)
+
+        with step('summary indexes'):
+            for table in SUMMARY_TABLES:
+                for index in table.indexes:
+                    index.create(connection)
+                # Statistics of the dropped indexes are gone, the planner needs them to choose between those of movie_rankings
+                connection.exec_driver_sql(f"ANALYZE {table.name}")
+
+        bump_data_version(connection)
@@ -0,0 +1,183 @@
+from models import Base
+from aggregates import SUMMARY_TABLES, movie_per_year_query, movie_per_genre_query, top_movies_query, actor_scores_query
+from sqlalchemy import Integer, Float, Boolean
+from sqlalchemy.dialects import sqlite
+from contextlib import closing, contextmanager
+import pandas as pd
+import threading
+import sqlite3
+import time
+import os
+
+try:
+    import duckdb
+except ImportError:  # The DuckDB backend is optional : without duckdb, the API only reads the SQLite file
+    duckdb = None
+
+# Engine of the dashboard endpoints : 'sqlite' reads the summary tables of the database, 'duckdb' computes them
+# on a columnar copy of the tables. Must be the same for the build (which writes the copy) and the API.
+BACKEND = os.environ.get('CINEMA_BACKEND', 'sqlite')
+
+# The copy is written next to the database, ie database.db.duckdb
+ANALYTICS_SUFFIX = '.duckdb'
+
+# Tables of models.py copied to DuckDB : the summary tables are views computing them on the fly
+BASE_TABLES = ['movies', 'movie_ratings', 'actors', 'genres', 'movie_genre', 'played_in']
+
+# Rows read from SQLite and appended to DuckDB at once
+EXPORT_ROWS = 500000
+
+# How often the API checks if a new copy was swapped in, in seconds
+ANALYTICS_CHECK_INTERVAL = 1
+
+# Queries of the summary tables, run as views by DuckDB
+SUMMARY_QUERIES = {
+    'year_counts': movie_per_year_query,
+    'genre_counts': movie_per_genre_query,
+    'top_movies': top_movies_query,
+    'actor_scores': actor_scores_query,
+}
+
+
+def analytics_path(database):
+    """Path of the DuckDB copy of a SQLite database."""
+    return database + ANALYTICS_SUFFIX
+
+
+def to_sql(query):
+    """SQL text of a SQLAlchemy query with its parameters inlined. The SQLite dialect gives SQL that DuckDB understands."""
+    return str(query.compile(dialect = sqlite.dialect(), compile_kwargs = {'literal_binds': True}))
+
+
+def duckdb_type(column):
+    """DuckDB type of a column of models.py. Floats are doubles, as in SQLite."""
+    if isinstance(column.type, Boolean):
+        return 'BOOLEAN'
+    if isinstance(column.type, Integer):
+        return 'BIGINT'
+    if isinstance(column.type, Float):
+        return 'DOUBLE'
+    return 'VARCHAR'
+
+
+def export_analytics(database, path = None, export_rows = EXPORT_ROWS):
+    """Copy the base tables of a SQLite database into a new DuckDB file, where the summary tables are views.
+    The file is written under a temporary name and renamed once complete.
+
+    Args:
+        database (str): Path of the SQLite file.
+        path (str, optional): Path of the DuckDB file. Defaults to analytics_path(database).
+        export_rows (int, optional): Rows copied at once. Defaults to EXPORT_ROWS.
+
+    Returns:
+        dict: Number of rows copied for each table
+    """
+    if duckdb is None:
+        raise ImportError("The duckdb backend needs duckdb to be installed")
+    path = path or analytics_path(database)
+    temp = path + '.tmp'
+    if os.path.exists(temp):
+        os.remove(temp)
+
+    counts = {}
+    with closing(sqlite3.connect(f"file:{database}?mode=ro", uri = True)) as source, closing(duckdb.connect(temp)) as target:
+        for name in BASE_TABLES:
+            table = Base.metadata.tables[name]
+            columns = [column.name for column in table.columns]
+            target.execute(f"CREATE TABLE {name} ({', '.join(f'{column.name} {duckdb_type(column)}' for column in table.columns)})")
+
+            counts[name] = 0
+            # Nullable types, so that a missing integer stays NULL instead of becoming a float NaN
+            for chunk in pd.read_sql(f"SELECT {', '.join(columns)} FROM {name}", source, chunksize = export_rows,
+                                     dtype_backend = 'numpy_nullable'):
+                target.register('chunk', chunk)
+                target.execute(f"INSERT INTO {name} SELECT {', '.join(columns)} FROM chunk")
+                target.unregister('chunk')
+                counts[name] += len(chunk)
+
+        for name, query in SUMMARY_QUERIES.items():
+            target.execute(f"CREATE VIEW {name} AS {to_sql(query())}")
+        target.execute("CHECKPOINT")
+
+    os.replace(temp, path)
+    return counts
+
+
+class Analytics:
+    """Read-only DuckDB copy of the database, running the queries of the dashboard endpoints.
+    Like app.Live_engine, it opens the new copy once a build or a refresh swapped one in. Queries running on the old
+    copy are counted, and its connection is closed when the last one finishes.
+    """
+
+    def __init__(self, path, interval = ANALYTICS_CHECK_INTERVAL):
+        if duckdb is None:
+            raise ImportError("The duckdb backend needs duckdb to be installed")
+        self.path = path
+        self.interval = interval
+        self.file = self.file_id()
+        self.connection = duckdb.connect(path, read_only = True)
+        # Number of running queries of each open connection
+        self.users = {self.connection: 0}
+        self.checked = time.monotonic()
+        self.lock = threading.Lock()
+
+    def file_id(self):
+        stat = os.stat(self.path)
+        return (stat.st_dev, stat.st_ino)
+
+    def current(self):
+        """Connection to the copy currently at path. The path is checked again at most once every interval."""
+        if time.monotonic() - self.checked > self.interval:
+            with self.lock:
+                if time.monotonic() - self.checked > self.interval:
+                    self.switch_if_swapped()
+                    self.checked = time.monotonic()
+        return self.connection
+
+    def switch_if_swapped(self):
+        """Open the copy at path if it is a new file. Called with the lock held."""
+        try:
+            file = self.file_id()
+        except FileNotFoundError:
+            # Keep serving the old copy rather than failing
+            return
+        if file == self.file:
+            return
+        old = self.connection
+        self.connection = duckdb.connect(self.path, read_only = True)
+        self.users[self.connection] = 0
+        self.file = file
+        # Without running query, the old copy is closed now, otherwise by the last of them (see using)
+        if self.users[old] == 0:
+            del self.users[old]
+            old.close()
+
+    @contextmanager
+    def using(self):
+        """Connection to the current copy, which is kept open until the block ends even if a new copy is swapped in."""
+        self.current()
+        with self.lock:
+            connection = self.connection
+            self.users[connection] += 1
+        try:
+            yield connection
+        finally:
+            with self.lock:
+                self.users[connection] -= 1
+                if connection is not self.connection and self.users[connection] == 0:
+                    del self.users[connection]
+                    connection.close()
+
+    def execute(self, query):
+        """Run a query of the summary tables, ie the statement of a dashboard endpoint.
+
+        Args:
+            query (sqlalchemy.sql.Select): Query to run.
+
+        Returns:
+            tuple: Names of the columns and list of rows
+        """
+        # Each thread needs its own cursor on the shared connection
+        with self.using() as connection, connection.cursor() as cursor:
+            cursor.execute(to_sql(query))
+            return [column[0] for column in cursor.description], cursor.fetchall()
@@ -1,87 +1,663 @@
-from fastapi import FastAPI, Depends
-from typing import Annotated, List
+from fastapi import FastAPI, Depends, Request, Response, Query, HTTPException
+from fastapi.responses import JSONResponse
+from typing import Annotated, List, Optional, Literal
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine, select, func, desc
-from models import Movie, Genre, Movie_rating, Movie_genre, Played_in, Actor
-from data_validation import Movie_per_year, Movie_per_genre, Rating_ranking, Actor_rating
-import requests
+from sqlalchemy import create_engine, select, func, desc, event, exists, tuple_, union_all
+from models import Movie, Genre, Movie_rating, Movie_genre, Played_in, Actor, Year_count, Genre_count, Top_movie, Actor_score, Cube_cell
+from models import Movie_ranking
+from models import render_id, parse_id
+from data_validation import Movie_per_year, Movie_per_genre, Rating_ranking, Actor_rating, Rating_page, Actor_page
+from data_validation import Rating_histogram, Runtime_per_decade, Vote_percentile, Genre_heatmap, Cube_slice
+from cache import Data_version, Cached_response, Response_cache, CACHE_MAX_AGE
+from profiling import Profiled_route, instrument_engine, profile_requests, render_metrics, slow_queries
+from analytics import BACKEND, Analytics, analytics_path
+from aggregates import CUBE_DIMENSIONS, actor_scores_query
+from column_store import Live_store, store_path, rating_histogram, runtime_by_decade, vote_percentiles, genre_heatmap
+import anyio
+import base64
+import json
+import threading
+import time
+import os
 
 
-path = 'sqlite:///database.db'
-connect_args = {"check_same_thread": False}
-engine = create_engine(path, connect_args=connect_args)
-Session = sessionmaker(engine)
+# Settings can be changed with environment variables, so that every uvicorn worker gets them
+DATABASE = os.environ.get('CINEMA_DATABASE', 'database.db')
+# Connections kept open by each worker, and maximum number of queries running at the same time in it
+POOL_SIZE = int(os.environ.get('CINEMA_POOL_SIZE', 8))
+
+# How often the API checks if a build or a refresh swapped a new file in place of the database, in seconds
+GENERATION_CHECK_INTERVAL = 1
+
+# PRAGMAs applied to each connection of the API. The API never writes, and the file is read through mmap.
+READ_PRAGMAS = {
+    'query_only': 'ON',
+    'mmap_size': 268435456,  # 256 MB
+    'cache_size': -65536,  # In KB when negative, so 64 MB
+    'temp_store': 'MEMORY',
+}
+
+
+def create_read_engine(database, pool_size = POOL_SIZE):
+    """Create a pool of read-only connections to the database, each one set up with READ_PRAGMAS.
+    Builds and refreshes write another file and swap it in (see shadow.py), so these connections are never blocked by them.
+
+    Args:
+        database (str): Path of the SQLite file.
+        pool_size (int, optional): Number of connections kept open. Defaults to POOL_SIZE.
+
+    Returns:
+        sqlalchemy.engine.Engine: Engine to connect to database.
+    """
+    engine = create_engine(f"sqlite:///file:{database}?mode=ro&uri=true", connect_args = {"check_same_thread": False},
+                           pool_size = pool_size, max_overflow = 0)
+
+    @event.listens_for(engine, 'connect')
+    def set_read_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in READ_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+        cursor.close()
+
+    return engine
+
+
+class Live_engine:
+    """Engine of the file currently served at the path of the database.
+    Builds and refreshes replace this file by a new one with an atomic rename (see shadow.publish) : once the path
+    points to another file, new requests get an engine on the new file, while the ones already running finish on the old one.
+    """
+
+    def __init__(self, database, interval = GENERATION_CHECK_INTERVAL):
+        self.database = database
+        self.interval = interval
+        self.generation = 0
+        self.file = self.file_id()
+        self.engine = self.create()
+        self.checked = time.monotonic()
+        self.lock = threading.Lock()
+
+    def file_id(self):
+        """Identity of the file at the path of the database, which changes when a new file is swapped in."""
+        stat = os.stat(self.database)
+        return (stat.st_dev, stat.st_ino)
+
+    def create(self):
+        engine = create_read_engine(self.database)
+        instrument_engine(engine)
+        return engine
+
+    def current(self):
+        """Engine of the served file. The path is checked again at most once every interval."""
+        if time.monotonic() - self.checked > self.interval:
+            with self.lock:
+                if time.monotonic() - self.checked > self.interval:
+                    self.switch_if_swapped()
+                    self.checked = time.monotonic()
+        return self.engine
+
+    def switch_if_swapped(self):
+        try:
+            file = self.file_id()
+        except FileNotFoundError:
+            # Keep serving the old file rather than failing
+            return
+        if file == self.file:
+            return
+        old = self.engine
+        self.engine = self.create()
+        self.file = file
+        self.generation += 1
+        # Idle connections are closed now. Those used by running requests are closed when they are given back.
+        old.dispose()
+
+    def connect(self):
+        return self.current().connect()
+
+
+engine = Live_engine(DATABASE)
+Session = sessionmaker()
+
+# Columnar copy of the database answering the dashboard endpoints when CINEMA_BACKEND is 'duckdb' (see analytics.py)
+analytics = Analytics(analytics_path(DATABASE)) if BACKEND == 'duckdb' else None
+
+# Columns of the movies memory-mapped from the file written with the database, for the /stats endpoints
+column_store = Live_store(store_path(DATABASE))
+
+# Queries are blocking : they run in worker threads, never more at once than connections in the pool
+db_limiter = anyio.CapacityLimiter(POOL_SIZE)
+
+# Formats of the dashboard endpoints : validated rows (default), JSON columns or Arrow IPC stream
+Format = Literal["rows", "columns", "arrow"]
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+# Dimensions of /cube, see aggregates.CUBE_DIMENSIONS
+Dimension = Literal["year", "genre", "is_adult", "rating_bucket"]
+
+# Number of rows in a page of the /v2 rankings, by default and at most
+PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
 
 app = FastAPI()
+# Endpoints and serialization of their responses are timed for the profiled requests
+app.router.route_class = Profiled_route
  
 def get_session():
-    with Session() as session:
+    with Session(bind = engine.current()) as session:
         yield session
 
 # In function args, this variable allows to open and close a session
 SessionDep = Annotated[Session, Depends(get_session)] 
 
-def get_data(url):
-    response = requests.get(url)
-    
-    if response.status_code == 200:
-        data = response.json()
-        print('Data collected')
-        return data
-    else:
-        print(f"Erreur {response.status_code}: {response.text}")
-        return None
 
+async def run_query(query):
+    """Run a blocking database call in a worker thread, so that the event loop keeps serving other requests.
 
-@app.get("/perYear")
-def movie_per_year(session: SessionDep)-> List[Movie_per_year]:
-    data = (
-        session.query(
-            Movie.start_year.label("year"), func.count(Movie.primary_title).label("movie_number"))
-            .group_by(Movie.start_year)
-            .having(Movie.start_year <= 2024)
+    Args:
+        query (callable): Function without argument running the query, ie data.all
+
+    Returns:
+        Result of query
+    """
+    return await anyio.to_thread.run_sync(query, limiter = db_limiter)
+
+# Responses of these endpoints only change when a loader runs : they are cached until the data version changes
+CACHED_PATHS = {"/perYear", "/perGenre", "/movieRating", "/actorRanking", "/dashboard", "/v2/perGenre", "/v2/movieRating", "/v2/actorRanking",
+                "/stats/ratingHistogram", "/stats/runtimeByDecade", "/stats/votePercentiles", "/stats/genreHeatmap", "/cube"}
+data_version = Data_version(engine)
+response_cache = Response_cache()
+
+
+@app.middleware("http")
+async def cache_responses(request: Request, call_next):
+    if request.method != "GET" or request.url.path not in CACHED_PATHS:
+        return await call_next(request)
+
+    # The version is read from the database only once in a while, and then in a worker thread
+    version = data_version.version if data_version.is_fresh() else await run_query(data_version.get)
+    key = (request.url.path, tuple(sorted(request.query_params.multi_items())), version)
+    entry = response_cache.get(key)
+    if entry is None:
+        response = await call_next(request)
+        if response.status_code != 200:
+            return response
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        entry = Cached_response(body, response.media_type or response.headers.get("content-type"), key[-1])
+        response_cache.put(key, entry)
+
+    headers = {"ETag": entry.etag, "Cache-Control": f"public, max-age={CACHE_MAX_AGE}"}
+    if entry.matches(request.headers.get("if-none-match")):
+        return Response(status_code = 304, headers = headers)
+    return Response(entry.body, media_type = entry.media_type, headers = headers)
+
+
+# Added last, so it runs first : cache hits are measured too
+app.middleware("http")(profile_requests(app))
+
+
+@app.get("/metrics")
+def metrics():
+    """Histograms of request, query and serialization times, in the Prometheus text format."""
+    return Response(render_metrics(), media_type = "text/plain; version=0.0.4")
+
+
+@app.get("/slowQueries")
+def slow_query_log():
+    """Last statements slower than CINEMA_SLOW_QUERY_MS, with their query plan."""
+    return list(slow_queries)
+
+
+@app.get("/cacheStats")
+def cache_stats():
+    return {**response_cache.stats(), "version": data_version.get(), "generation": engine.generation}
+
+
+@app.get("/version")
+async def version():
+    return {"version": await run_query(data_version.get)}
+
+
+# Queries of the dashboard endpoints. They read the summary tables built by aggregates.rebuild_aggregates
+# at the end of each load, so their cost doesn't depend on the size of the dataset
+def movie_per_year_query(session):
+    return (
+        session.query(Year_count.year, Year_count.movie_number)
+            .filter(Year_count.year <= 2024)
+            .order_by(Year_count.year)
+        )
+
+
+def movie_per_genre_query(session):
+    return (
+        session.query(Genre_count.genre, Genre_count.movie_number)
+            .filter(Genre_count.movie_number > 15000)
+            .order_by(Genre_count.id)
         )
-    return data.all()
+
+
+def rating_ranking_query(session):
+    return (
+    session.query(Top_movie.title, Top_movie.score, Top_movie.rating, Top_movie.num_votes)
+        .order_by(Top_movie.rank)
+        .limit(10)
+    )
+
+
+def actor_ranking_query(session):
+    return (
+    session.query(
+        Actor_score.name.label("actor"), Actor_score.score, Actor_score.average_rating, Actor_score.num_votes)
+        .filter(Actor_score.movie_number >= 4)
+        .order_by(desc(Actor_score.average_score), desc(Actor_score.actor))
+        .limit(10)
+    )
+
+
+def run_dashboard_query(data):
+    """Run a query of the summary tables, on SQLite or on the DuckDB copy depending on CINEMA_BACKEND.
+
+    Args:
+        data (sqlalchemy.orm.Query): Query to run.
+
+    Returns:
+        tuple: Names of the columns and list of rows
+    """
+    if analytics is not None:
+        return analytics.execute(data.statement)
+    return [column['name'] for column in data.column_descriptions], data.all()
+
+
+def to_rows(data):
+    """Run a query and return its rows, as SQLAlchemy rows or as dicts for the DuckDB backend."""
+    if analytics is None:
+        return data.all()
+    names, rows = run_dashboard_query(data)
+    return [dict(zip(names, row)) for row in rows]
+
+
+def to_columns(data):
+    """Run a query and return its result column by column (one list per field), without validating each row.
+
+    Args:
+        data (sqlalchemy.orm.Query): Query to run.
+
+    Returns:
+        dict: List of values of each column
+    """
+    names, rows = run_dashboard_query(data)
+    return {name: [row[i] for row in rows] for i, name in enumerate(names)}
+
+
+def arrow_stream(columns, dataset = None):
+    """Serialize columns in the Arrow IPC stream format. pyarrow is only needed for this format.
+
+    Args:
+        columns (dict): List of values of each column.
+        dataset (str, optional): Name of the dataset, stored in the metadata of the schema. Defaults to None.
+
+    Returns:
+        bytes: Arrow IPC stream
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise HTTPException(status_code = 501, detail = "Arrow format needs pyarrow to be installed")
+
+    table = pa.table(columns)
+    if dataset is not None:
+        table = table.replace_schema_metadata({'dataset': dataset})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def arrow_response(columns):
+    """Answer with columns in the Arrow IPC stream format (see arrow_stream)."""
+    return Response(arrow_stream(columns), media_type = ARROW_MEDIA_TYPE)
+
+
+async def respond(data, format):
+    """Answer a dashboard endpoint in the asked format.
+    'rows' gives a list of objects validated with data_validation models, 'columns' gives one JSON array per field
+    and 'arrow' an Arrow IPC stream : both skip the validation of each row.
+
+    Args:
+        data (sqlalchemy.orm.Query): Query of the endpoint.
+        format (str): 'rows', 'columns' or 'arrow'.
+    """
+    if format == "rows":
+        return await run_query(lambda: to_rows(data))
+
+    columns = await run_query(lambda: to_columns(data))
+    if format == "arrow":
+        return arrow_response(columns)
+    return JSONResponse(columns)
+
+
+@app.get("/perYear")
+async def movie_per_year(session: SessionDep, format: Format = "rows")-> List[Movie_per_year]:
+    return await respond(movie_per_year_query(session), format)
 
 
 @app.get("/perGenre")
-def movie_per_genre(session: SessionDep)-> List[Movie_per_genre]:
+async def movie_per_genre(session: SessionDep, format: Format = "rows")-> List[Movie_per_genre]:
+    return await respond(movie_per_genre_query(session), format)
+
+
+@app.get("/movieRating")
+async def rating_ranking(session: SessionDep, format: Format = "rows")-> List[Rating_ranking]:
+    return await respond(rating_ranking_query(session), format)
+
+
+@app.get("/actorRanking")
+async def actor_ranking(session: SessionDep, format: Format = "rows")-> List[Actor_rating]:
+    return await respond(actor_ranking_query(session), format)
+
+
+@app.get("/dashboard")
+async def dashboard(session: SessionDep, format: Literal["columns", "arrow"] = "columns"):
+    """Every dataset of the dashboard in one response, column by column.
+    With format=arrow, the body is one Arrow IPC stream per dataset, one after the other, each named by the dataset key
+    of the metadata of its schema : a reader opens streams on the body until its end (see dashboard_client.read_arrow).
+    """
+    queries = {
+        "perYear": movie_per_year_query(session),
+        "perGenre": movie_per_genre_query(session),
+        "movieRating": rating_ranking_query(session),
+        "actorRanking": actor_ranking_query(session),
+    }
+    data = await run_query(lambda: {name: to_columns(query) for name, query in queries.items()})
+    if format == "arrow":
+        return Response(b''.join(arrow_stream(columns, name) for name, columns in data.items()), media_type = ARROW_MEDIA_TYPE)
+    return JSONResponse(data)
+
+
+def encode_cursor(*values):
+    """Turn the sort key of the last row of a page into an opaque string, given back by the client to get the next page."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, size):
+    """Read the sort key stored in a cursor by encode_cursor.
+
+    Args:
+        cursor (str): Cursor given by the client.
+        size (int): Number of values expected in the cursor.
+
+    Returns:
+        list: Values of the sort key
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise HTTPException(status_code = 400, detail = "Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code = 400, detail = "Invalid cursor")
+    return values
+
+
+def cursor_id(value, prefix):
+    """Id as stored in the database from the IMDb id of a cursor. Cursors always hold IMDb ids, whatever models.INTEGER_IDS."""
+    try:
+        return parse_id(value, prefix)
+    except ValueError:
+        raise HTTPException(status_code = 400, detail = "Invalid cursor")
+
+
+# Rankings with filters and keyset pagination : the next page starts right after the sort key of the last row,
+# so any page is a seek in the ranking index followed by a short scan, whatever its depth (no OFFSET)
+@app.get("/v2/perGenre")
+async def movie_per_genre_filtered(session: SessionDep, year_from: Optional[int] = None, year_to: Optional[int] = None,
+                                   is_adult: Optional[bool] = None, min_movies: int = 0)-> List[Movie_per_genre]:
+    # Without filter on movies, the summary table already has the answer
+    if year_from is None and year_to is None and is_adult is None:
+        data = (
+            session.query(Genre_count.genre, Genre_count.movie_number)
+                .filter(Genre_count.movie_number >= min_movies)
+                .order_by(Genre_count.id)
+            )
+        return await run_query(data.all)
+
     data = (
-        session.query(
-            Genre.name.label("genre"), func.count(Movie_genre.c.movie).label("movie_number"))
+        session.query(Genre.name.label("genre"), func.count(Movie_genre.c.movie).label("movie_number"))
             .join(Movie_genre, Genre.id == Movie_genre.c.genre)
-            .group_by(Genre.id)
-            .having(func.count(Movie_genre.c.movie)>15000)
+            .join(Movie, Movie_genre.c.movie == Movie.tconst)
         )
+    if year_from is not None:
+        data = data.filter(Movie.start_year >= year_from)
+    if year_to is not None:
+        data = data.filter(Movie.start_year <= year_to)
+    if is_adult is not None:
+        data = data.filter(Movie.is_adult == is_adult)
+    data = data.group_by(Genre.id).having(func.count(Movie_genre.c.movie) >= min_movies).order_by(Genre.id)
 
-    return data.all()
+    return await run_query(data.all)
 
-@app.get("/movieRating")
-def rating_ranking(session: SessionDep)-> List[Rating_ranking]:
+
+def movie_ranking_filter(genre = None, is_adult = None, year = None):
+    """Conditions selecting the rows of movie_rankings matching the filters. They are equalities on the first columns of
+    one of its indexes, which is then in ranking order (see models.py) : the rows without genre stand for every genre.
+    """
+    conditions = [Movie_ranking.genre == genre if genre is not None else Movie_ranking.genre.is_(None)]
+    if is_adult is not None:
+        conditions.append(Movie_ranking.is_adult == is_adult)
+    if year is not None:
+        conditions.append(Movie_ranking.start_year == year)
+    return conditions
+
+
+def rating_page_query(session, genre = None, is_adult = None, year = None, min_votes = None, last = None, limit = PAGE_SIZE,
+                      year_from = None, year_to = None):
+    """Page of the movies ranked by score : a seek in the index of movie_rankings matching the filters, then a scan of
+    limit rows, or more with min_votes or a range of years, which are checked row by row.
+
+    Args:
+        session (sqlalchemy.orm.Session): Session of the request.
+        genre (str, optional): Name of the genre, None for every genre. Defaults to None.
+        is_adult (bool, optional): Adult movies only, or the others. Defaults to None (both).
+        year (int, optional): Start year of the movies. Defaults to None (every year).
+        min_votes (int, optional): Minimal number of votes. Defaults to None.
+        last (tuple, optional): Score and tconst of the last row of the previous page. Defaults to None (first page).
+        limit (int, optional): Number of rows. Defaults to PAGE_SIZE.
+        year_from, year_to (int, optional): Range of start years, checked row by row. Defaults to None.
+
+    Returns:
+        sqlalchemy.orm.Query: Rows with tconst, title, score, rating and num_votes
+    """
+    score = Movie_ranking.score
     data = (
     session.query(
-        Movie.primary_title.label("title"), (Movie_rating.num_votes*Movie_rating.average_rating).label('score'), 
-        Movie_rating.average_rating.label("rating"), Movie_rating.num_votes.label("num_votes") )
-        .join(Movie, Movie_rating.tconst == Movie.tconst)
-        .order_by(desc(Movie_rating.num_votes*Movie_rating.average_rating))
-        .limit(10)
+        Movie_ranking.tconst, Movie_ranking.title, score.label("score"), Movie_ranking.average_rating.label("rating"),
+        Movie_ranking.num_votes)
+        .filter(*movie_ranking_filter(genre, is_adult, year))
     )
+    # "+ 0" keeps SQLite from reading the range from ix_movie_rankings_year : it would have to sort the whole range
+    if year_from is not None:
+        data = data.filter(Movie_ranking.start_year + 0 >= year_from)
+    if year_to is not None:
+        data = data.filter(Movie_ranking.start_year + 0 <= year_to)
+    if min_votes is not None:
+        # Ratings are at least 1, so the score is at least the number of votes : the scan stops below min_votes
+        data = data.filter(Movie_ranking.num_votes >= min_votes, score >= min_votes)
+    if last is not None:
+        # The first condition is redundant but lets SQLite seek in the index
+        data = data.filter(score <= last[0], tuple_(score, Movie_ranking.tconst) < tuple_(*last))
+    return data.order_by(desc(score), desc(Movie_ranking.tconst)).limit(limit)
 
-    return data.all()
 
+def merged_rating_page_query(session, years, genre = None, is_adult = None, min_votes = None, last = None, limit = PAGE_SIZE):
+    """Page of the movies ranked by score over several start years. A range of years can't be followed by the ranking
+    order in an index : each year gives its own page (rating_page_query), and the pages are merged and cut to limit rows.
+    Only len(years) * limit rows are sorted, whatever the depth of the page.
+    """
+    pages = [rating_page_query(session, genre, is_adult, year, min_votes, last, limit).subquery() for year in years]
+    merged = union_all(*[select(page) for page in pages]).subquery()
+    return session.query(merged).order_by(desc(merged.c.score), desc(merged.c.tconst)).limit(limit)
+
+
+@app.get("/v2/movieRating")
+async def rating_page(session: SessionDep, year_from: Optional[int] = None, year_to: Optional[int] = None,
+                      genre: Optional[str] = None, min_votes: Optional[int] = None, is_adult: Optional[bool] = None,
+                      limit: Annotated[int, Query(ge = 1, le = MAX_PAGE_SIZE)] = PAGE_SIZE, cursor: Optional[str] = None)-> Rating_page:
+    last = None
+    if cursor is not None:
+        last_score, last_tconst = decode_cursor(cursor, 2)
+        last = (last_score, cursor_id(last_tconst, 'tt'))
+
+    # One more row tells if there is a next page
+    if year_from is None and year_to is None:
+        data = rating_page_query(session, genre, is_adult, None, min_votes, last, limit + 1)
+    else :
+        counts = await run_query(session.query(Year_count.year, Year_count.movie_number).all)
+        years = [year for year, movie_number in counts if (year_from is None or year >= year_from) and (year_to is None or year <= year_to)]
+        if not years:
+            return {"items": [], "next_cursor": None}
+        # With a share of the movies in the range, a scan of the ranking reads about limit / share rows to fill a page,
+        # and one page per year reads len(years) * limit rows : the cheapest of both is read, at most len(years) * limit rows
+        share = sum(movie_number for year, movie_number in counts if year in years) / sum(movie_number for year, movie_number in counts)
+        if len(years) * share < 1:
+            data = merged_rating_page_query(session, years, genre, is_adult, min_votes, last, limit + 1)
+        else :
+            data = rating_page_query(session, genre, is_adult, None, min_votes, last, limit + 1, year_from, year_to)
+
+    rows = await run_query(data.all)
+    next_cursor = encode_cursor(rows[limit - 1].score, render_id(rows[limit - 1].tconst, 'tt')) if len(rows) > limit else None
+
+    return {"items": rows[:limit], "next_cursor": next_cursor}
+
+
+def actor_page_query(session, year_from = None, year_to = None, genre = None, is_adult = None, min_movies = 4, min_votes = None,
+                     last = None, limit = PAGE_SIZE):
+    """Page of the actors ranked by average score over their rated movies.
+    Without filter on movies, scores are precomputed in actor_scores and the page is read from ix_actor_scores_ranking.
+    With filters, scores are computed over the movies matching them only, from the rows of movie_rankings selected through
+    one of its indexes : the whole filtered set is scored and sorted at each call, the same work for every page.
+
+    Args:
+        session (sqlalchemy.orm.Session): Session of the request.
+        year_from, year_to (int, optional): Range of start years of the movies. Defaults to None.
+        genre (str, optional): Name of the genre of the movies. Defaults to None.
+        is_adult (bool, optional): Adult movies only, or the others. Defaults to None (both).
+        min_movies (int, optional): Minimal number of rated movies of the actor. Defaults to 4.
+        min_votes (float, optional): Minimal average number of votes of these movies. Defaults to None.
+        last (tuple, optional): Average score and nconst of the last row of the previous page. Defaults to None (first page).
+        limit (int, optional): Number of rows. Defaults to PAGE_SIZE.
+
+    Returns:
+        sqlalchemy.orm.Query: Rows with nconst, actor, score, average_score, average_rating and num_votes
+    """
+    if year_from is None and year_to is None and genre is None and is_adult is None:
+        scores = Actor_score.__table__
+    else :
+        ratings = select(Movie_ranking.tconst, Movie_ranking.average_rating, Movie_ranking.num_votes, Movie_ranking.score).where(
+            *movie_ranking_filter(genre, is_adult))
+        if year_from is not None:
+            ratings = ratings.where(Movie_ranking.start_year >= year_from)
+        if year_to is not None:
+            ratings = ratings.where(Movie_ranking.start_year <= year_to)
+        scores = actor_scores_query(ratings.subquery()).subquery()
 
-@app.get("/actorRanking")
-def rating_ranking(session: SessionDep)-> List[Actor_rating]:
     data = (
     session.query(
-        Actor.primary_name.label("actor"), func.sum(Movie_rating.average_rating*Movie_rating.num_votes).label('score'),
-        func.avg(Movie_rating.average_rating).label("average_rating"), func.avg(Movie_rating.num_votes).label("num_votes"))
-        .join(Played_in, Actor.nconst == Played_in.c.actor)
-        .join(Movie_rating, Played_in.c.movie == Movie_rating.tconst)
-        .group_by(Played_in.c.actor)
-        .having(func.count(Actor.primary_name) >= 4)
-        .order_by(desc(func.avg(Movie_rating.average_rating*Movie_rating.num_votes)))
-        .limit(10)
+        scores.c.actor.label("nconst"), scores.c.name.label("actor"), scores.c.score, scores.c.average_score,
+        scores.c.average_rating, scores.c.num_votes)
+        .filter(scores.c.movie_number >= min_movies)
     )
+    if min_votes is not None:
+        data = data.filter(scores.c.num_votes >= min_votes)
+    if last is not None:
+        data = data.filter(tuple_(scores.c.average_score, scores.c.actor) < tuple_(*last))
+    return data.order_by(desc(scores.c.average_score), desc(scores.c.actor)).limit(limit)
+
+
+@app.get("/v2/actorRanking")
+async def actor_page(session: SessionDep, year_from: Optional[int] = None, year_to: Optional[int] = None,
+                     genre: Optional[str] = None, is_adult: Optional[bool] = None, min_movies: int = 4, min_votes: Optional[float] = None,
+                     limit: Annotated[int, Query(ge = 1, le = MAX_PAGE_SIZE)] = PAGE_SIZE, cursor: Optional[str] = None)-> Actor_page:
+    last = None
+    if cursor is not None:
+        last_score, last_actor = decode_cursor(cursor, 2)
+        last = (last_score, cursor_id(last_actor, 'nm'))
 
-    return data.all()
\ No newline at end of file
+    data = actor_page_query(session, year_from, year_to, genre, is_adult, min_movies, min_votes, last, limit + 1)
+    rows = await run_query(data.all)
+    next_cursor = encode_cursor(rows[limit - 1].average_score, render_id(rows[limit - 1].nconst, 'nm')) if len(rows) > limit else None
+
+    return {"items": rows[:limit], "next_cursor": next_cursor}
+
+
+# Distributions : computed on the column store with NumPy, without any SQL query.
+# They are plain functions, so FastAPI runs them in its thread pool.
+def current_store():
+    store = column_store.current()
+    if store is None:
+        raise HTTPException(status_code = 503, detail = "Column store not written yet : run column_store.py or a build")
+    return store
+
+
+@app.get("/stats/ratingHistogram")
+def rating_histogram_stats(year_from: Optional[int] = None, year_to: Optional[int] = None, genre: Optional[str] = None,
+                           is_adult: Optional[bool] = None, min_votes: Optional[int] = None,
+                           bins: Annotated[int, Query(ge = 1, le = 90)] = 18)-> Rating_histogram:
+    store = current_store()
+    return rating_histogram(store, store.movie_mask(year_from, year_to, is_adult, genre, min_votes), bins)
+
+
+@app.get("/stats/runtimeByDecade")
+def runtime_stats(genre: Optional[str] = None, is_adult: Optional[bool] = None)-> List[Runtime_per_decade]:
+    store = current_store()
+    return runtime_by_decade(store, store.movie_mask(genre = genre, is_adult = is_adult))
+
+
+@app.get("/stats/votePercentiles")
+def vote_stats(percentiles: Annotated[List[float], Query()] = [50, 90, 99], year_from: Optional[int] = None,
+               year_to: Optional[int] = None, genre: Optional[str] = None, is_adult: Optional[bool] = None)-> List[Vote_percentile]:
+    if not all(0 <= percentile <= 100 for percentile in percentiles):
+        raise HTTPException(status_code = 400, detail = "Percentiles must be between 0 and 100")
+    store = current_store()
+    return vote_percentiles(store, store.movie_mask(year_from, year_to, is_adult, genre), percentiles)
+
+
+@app.get("/stats/genreHeatmap")
+def genre_heatmap_stats(year_from: Optional[int] = None, year_to: Optional[int] = None, is_adult: Optional[bool] = None,
+                        min_votes: Optional[int] = None)-> Genre_heatmap:
+    store = current_store()
+    return genre_heatmap(store, store.movie_mask(year_from, year_to, is_adult, min_votes = min_votes))
+
+
+@app.get("/cube")
+async def cube(session: SessionDep, by: Annotated[List[Dimension], Query()] = [], year_from: Optional[int] = None,
+               year_to: Optional[int] = None, genre: Optional[str] = None, is_adult: Optional[bool] = None,
+               rating_from: Optional[int] = None, rating_to: Optional[int] = None)-> List[Cube_slice]:
+    """Number of movies, number of rated movies, mean rating and total votes for each combination of values of the
+    dimensions of by, over the movies matching the filters. Ratings are filtered by bucket (see aggregates.RATING_BUCKET).
+    Answered from the cells of cube_cells keeping the dimensions of by and of the filters : filtered dimensions are summed
+    over, which is exact since a movie has one value of each (and only one genre can be asked).
+    """
+    by = list(dict.fromkeys(by))
+    filters = {'year': [(year_from, Cube_cell.year.__ge__), (year_to, Cube_cell.year.__le__)],
+               'genre': [(genre, Cube_cell.genre.__eq__)], 'is_adult': [(is_adult, Cube_cell.is_adult.__eq__)],
+               'rating_bucket': [(rating_from, Cube_cell.rating_bucket.__ge__), (rating_to, Cube_cell.rating_bucket.__le__)]}
+    filtered = set(by)
+    conditions = []
+    for dimension, bounds in filters.items():
+        for value, compare in bounds:
+            if value is not None:
+                filtered.add(dimension)
+                conditions.append(compare(value))
+    dims = sum(1 << bit for bit, dimension in enumerate(CUBE_DIMENSIONS) if dimension in filtered)
+
+    columns = [getattr(Cube_cell, dimension) for dimension in by]
+    rated_number = func.sum(Cube_cell.rated_number)
+    data = (
+    session.query(
+        *columns, func.coalesce(func.sum(Cube_cell.movie_number), 0).label("movie_number"),
+        func.coalesce(rated_number, 0).label("rated_number"),
+        (func.sum(Cube_cell.rating_sum) / func.nullif(rated_number, 0)).label("mean_rating"),
+        func.coalesce(func.sum(Cube_cell.num_votes), 0).label("num_votes"))
+        .filter(Cube_cell.dims == dims, *conditions)
+        .group_by(*columns)
+        .order_by(*columns)
+    )
+    return await run_query(data.all)
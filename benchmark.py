@@ -0,0 +1,199 @@
+from models import Base
+from sqlalchemy import create_engine
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from db_functions import *
+import generate_data
+import chunk_cache
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+import tracemalloc
+
+# Stages of a build, in the order of setup_database.py, with the tables they fill
+STAGES = {
+    'movies': {'loader': load_movies, 'dump': 'title.basics', 'tables': ['movies', 'genres', 'movie_genre']},
+    'ratings': {'loader': load_ratings, 'dump': 'title.ratings', 'tables': ['movie_ratings']},
+    'actors': {'loader': load_actors, 'dump': 'name.basics', 'tables': ['actors']},
+    'played_in': {'loader': load_played_in, 'dump': 'title.principals', 'tables': ['played_in']},
+    'known_for': {'loader': load_known_for, 'dump': 'name.basics', 'tables': ['played_in']},
+}
+
+BASELINE = 'benchmark_baseline.json'
+
+# Allowed slowdown (or memory growth) compared to the baseline before a stage is reported as a regression
+TOLERANCE = 0.2
+
+
+def count_rows(path):
+    """Number of rows of a gzip dump, header excluded."""
+    with gzip.open(path, 'rb') as file:
+        return sum(1 for _ in file) - 1
+
+
+def peak_memory():
+    """Peak resident memory of this process and of its finished children, in MB.
+    Falls back to the peak of Python allocations when the resource module is not available.
+    """
+    if resource is None:
+        return tracemalloc.get_traced_memory()[1] / 2**20
+
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # In bytes on macOS, in KB elsewhere
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def run_stage(stage, path, bulk, source, memory_limit, workers, cache_dir):
+    """Run one loader on an existing database. Called in a fresh process, so that its peak memory is its own.
+    cache_dir is the directory of the preprocessing cache, empty to parse the dumps.
+
+    Returns:
+        float : Wall time of the loader, in seconds
+        float : Peak memory of the stage, in MB
+    """
+    if resource is None:
+        tracemalloc.start()
+    chunk_cache.CACHE_DIR = cache_dir
+    engine = create_bulk_engine(path) if bulk else create_engine(path)
+    loader = STAGES[stage]['loader']
+    args = {'workers': workers} if stage == 'played_in' else {}
+
+    start = time.perf_counter()
+    loader(engine, test = False, source = source, memory_limit = memory_limit, **args)
+    seconds = time.perf_counter() - start
+
+    return seconds, peak_memory()
+
+
+def benchmark(source, memory_limit = MEMORY_LIMIT, workers = None, bulk = False, cache = False):
+    """Build a database from the dumps of source in a temporary file, measuring each loader.
+
+    Args:
+        source (str): Local directory containing the dumps, ie written by generate_data.py.
+        memory_limit (float, optional): Memory budget in MB for one chunk. Defaults to MEMORY_LIMIT.
+        workers (int, optional): Number of processes filtering title.principals. Defaults to the number of CPUs.
+        bulk (bool, optional): Use the bulk-load mode of setup_database.py. Defaults to False.
+        cache (bool, optional): Use the preprocessing cache, so that a second run measures reading cached chunks
+          instead of parsing the dumps. Defaults to False.
+
+    Returns:
+        dict: Description of the run, and rows/s and peak memory of each stage
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = f"sqlite:///{os.path.join(directory, 'benchmark.db')}"
+        engine = create_bulk_engine(path) if bulk else create_engine(path)
+        Base.metadata.drop_all(bind = engine)
+        create_tables(engine, indexes = not bulk)
+
+        for stage, description in STAGES.items():
+            rows_in = count_rows(dump_path(source, DUMPS[description['dump']]['file']))
+
+            # One process per stage, started from scratch
+            with ProcessPoolExecutor(1, mp_context = get_context('spawn')) as executor:
+                seconds, memory = executor.submit(run_stage, stage, path, bulk, source, memory_limit, workers,
+                                                 chunk_cache.CACHE_DIR if cache else '').result()
+
+            with engine.connect() as connection:
+                rows_out = {table: connection.exec_driver_sql(f"SELECT count(*) FROM {table}").scalar()
+                            for table in description['tables']}
+
+            results[stage] = {'rows_in': rows_in, 'rows_out': rows_out, 'seconds': round(seconds, 3),
+                              'rows_per_s': round(rows_in / seconds, 1), 'peak_memory_mb': round(memory, 1)}
+
+        if bulk :
+            start = time.perf_counter()
+            create_indexes(engine)
+            results['indexes'] = {'seconds': round(time.perf_counter() - start, 3)}
+        engine.dispose()
+
+    return {'python': platform.python_version(), 'machine': platform.machine(), 'memory_limit': memory_limit,
+            'workers': workers, 'bulk': bulk, 'cache': cache, 'stages': results}
+
+
+def compare(report, baseline, tolerance = TOLERANCE):
+    """Compare a run with a stored baseline, stage by stage.
+
+    Args:
+        report (dict): Result of benchmark.
+        baseline (dict): Result of benchmark saved earlier.
+        tolerance (float, optional): Allowed relative slowdown or memory growth. Defaults to TOLERANCE.
+
+    Returns:
+        list: Description of each regression, empty if there is none
+    """
+    regressions = []
+    for stage, result in report['stages'].items():
+        reference = baseline['stages'].get(stage)
+        if reference is None or 'rows_per_s' not in result :
+            continue
+        if reference['rows_in'] != result['rows_in']:
+            print(f"{stage} : the baseline was measured on {reference['rows_in']} rows, not {result['rows_in']}")
+
+        speed = result['rows_per_s'] / reference['rows_per_s'] - 1
+        memory = result['peak_memory_mb'] / reference['peak_memory_mb'] - 1
+        print(f"{stage:<10} {result['rows_per_s']:>12.0f} rows/s ({speed:+.0%})  "
+              f"{result['peak_memory_mb']:>8.1f} MB ({memory:+.0%})")
+
+        if speed < -tolerance :
+            regressions.append(f"{stage} : {speed:+.0%} rows/s")
+        if memory > tolerance :
+            regressions.append(f"{stage} : {memory:+.0%} peak memory")
+    return regressions
+
+
+# Stages run in spawned processes, which import this file again
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Measure the loaders on synthetic dumps and compare with a baseline.")
+    parser.add_argument('--source', default = None,
+                        help = "Directory containing the dumps. Defaults to dumps generated in a temporary directory.")
+    parser.add_argument('--rows', type = int, default = 100000,
+                        help = "Number of titles of the generated dumps, when --source is not given.")
+    parser.add_argument('--memory-limit', type = float, default = MEMORY_LIMIT,
+                        help = f"Memory budget in MB for one parsed chunk of a dump. Defaults to {MEMORY_LIMIT}.")
+    parser.add_argument('--workers', type = int, default = None,
+                        help = "Number of processes filtering title.principals. Defaults to the number of CPUs.")
+    parser.add_argument('--bulk', action = 'store_true', help = "Bulk-load mode, as setup_database.py --bulk.")
+    parser.add_argument('--preprocess-cache', action = 'store_true',
+                        help = f"Read cleaned chunks from the preprocessing cache ({chunk_cache.CACHE_DIR}) when they are there.")
+    parser.add_argument('--baseline', default = BASELINE, help = f"Baseline file. Defaults to {BASELINE}.")
+    parser.add_argument('--save-baseline', action = 'store_true', help = "Store this run as the new baseline.")
+    parser.add_argument('--tolerance', type = float, default = TOLERANCE,
+                        help = f"Allowed relative slowdown or memory growth. Defaults to {TOLERANCE}.")
+    parser.add_argument('--output', default = None, help = "Also write the report of this run in this JSON file.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = args.source
+        if source is None :
+            source = directory
+            generate_data.generate(source, args.rows)
+
+        report = benchmark(source, args.memory_limit, args.workers, args.bulk, args.preprocess_cache)
+
+    print(json.dumps(report, indent = 2))
+    if args.output :
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent = 2)
+
+    if args.save_baseline :
+        with open(args.baseline, 'w') as file:
+            json.dump(report, file, indent = 2)
+        print(f"Baseline saved in {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"Regression : {regression}")
+        sys.exit(1 if regressions else 0)
+    else :
+        print(f"No baseline in {args.baseline}, run with --save-baseline to create one")
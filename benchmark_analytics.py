@@ -0,0 +1,97 @@
+from benchmark_api import prepare_database
+from analytics import Analytics, SUMMARY_QUERIES, analytics_path, export_analytics, to_sql
+from sqlalchemy.orm import Session
+from sqlalchemy import create_engine
+import numpy as np
+
+import argparse
+import json
+import os
+import time
+
+# Runs of each query, the median is kept
+REPEAT = 5
+
+
+def median_ms(function, repeat = REPEAT):
+    """Median time of function over repeat runs, in ms, and its last result."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return round(float(np.median(times)) * 1000, 3), result
+
+
+def dashboard_queries(database):
+    """Statements of the dashboard endpoints, taken from app.py so that both backends run exactly what the API runs."""
+    # app.py opens the database given by the environment when imported
+    os.environ['CINEMA_DATABASE'] = database
+    import app
+
+    with Session() as session:
+        return {
+            '/perYear': app.movie_per_year_query(session).statement,
+            '/perGenre': app.movie_per_genre_query(session).statement,
+            '/movieRating': app.rating_ranking_query(session).statement,
+            '/actorRanking': app.actor_ranking_query(session).statement,
+        }
+
+
+def compare_backends(database, repeat = REPEAT):
+    """Time the dashboard endpoints and the summary queries on SQLite and on the DuckDB copy, and check that both give
+    the same rows. On SQLite, endpoints read the summary tables filled at build time. On DuckDB, they are views
+    computed at each query, so the summary queries are the fair comparison of the two engines.
+
+    Args:
+        database (str): Path of the SQLite file. Its DuckDB copy is written if it doesn't exist.
+        repeat (int, optional): Runs of each query. Defaults to REPEAT.
+
+    Returns:
+        dict: For each endpoint and summary query, time on each backend in ms, speedup and equality of the results
+    """
+    if not os.path.exists(analytics_path(database)):
+        start = time.perf_counter()
+        export_analytics(database)
+        print(f"DuckDB copy written in {time.perf_counter() - start:.2f} s")
+
+    engine = create_engine(f"sqlite:///{database}")
+    duckdb = Analytics(analytics_path(database))
+    queries = {**dashboard_queries(database), **{name: query() for name, query in SUMMARY_QUERIES.items()}}
+
+    report = {}
+    with engine.connect() as connection:
+        for name, query in queries.items():
+            sqlite_ms, sqlite_rows = median_ms(lambda: [tuple(row) for row in connection.exec_driver_sql(to_sql(query))], repeat)
+            duckdb_ms, (_, duckdb_rows) = median_ms(lambda: duckdb.execute(query), repeat)
+            # Summary queries have no order : compare them sorted
+            if name in SUMMARY_QUERIES:
+                sqlite_rows, duckdb_rows = sorted(sqlite_rows, key = repr), sorted(duckdb_rows, key = repr)
+            report[name] = {'sqlite_ms': sqlite_ms, 'duckdb_ms': duckdb_ms, 'speedup': round(sqlite_ms / duckdb_ms, 2),
+                            'rows': len(sqlite_rows), 'same_result': sqlite_rows == duckdb_rows}
+    engine.dispose()
+    return report
+
+
+def print_report(report):
+    print(f"{'query':<15} {'sqlite':>12} {'duckdb':>12} {'speedup':>8} {'rows':>8}  same")
+    for name, result in report.items():
+        print(f"{name:<15} {result['sqlite_ms']:>9.2f} ms {result['duckdb_ms']:>9.2f} ms {result['speedup']:>7.2f}x "
+              f"{result['rows']:>8}  {result['same_result']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Compare the dashboard queries on SQLite and on the DuckDB copy of the database.")
+    parser.add_argument('--database', default = 'benchmark.db',
+                        help = "SQLite file, built from synthetic dumps of --rows titles if it doesn't exist. Defaults to benchmark.db.")
+    parser.add_argument('--rows', type = int, default = 1000000, help = "Number of titles of the synthetic dumps. Defaults to 1000000.")
+    parser.add_argument('--repeat', type = int, default = REPEAT, help = f"Runs of each query. Defaults to {REPEAT}.")
+    parser.add_argument('--output', default = None, help = "Write the report in this JSON file.")
+    args = parser.parse_args()
+
+    prepare_database(args.database, args.rows)
+    report = compare_backends(os.path.abspath(args.database), args.repeat)
+    print_report(report)
+    if args.output :
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent = 2)
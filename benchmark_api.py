@@ -0,0 +1,231 @@
+from setup_database import build_database
+import generate_data
+import numpy as np
+import httpx
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+# Endpoints used by the dashboard
+ENDPOINTS = ["/perYear", "/perGenre", "/movieRating", "/actorRanking"]
+
+# Allowed loss of throughput (or growth of p95 latency) compared to the baseline before an endpoint is reported
+TOLERANCE = 0.2
+
+# How long uvicorn can take to answer its first request, in seconds
+STARTUP_TIMEOUT = 30
+
+
+def prepare_database(database, rows, seed = 0):
+    """Build a database from synthetic dumps of the given size, unless the file already exists.
+
+    Args:
+        database (str): Path of the SQLite file.
+        rows (int): Number of titles of the synthetic dumps.
+        seed (int, optional): Seed of generate_data. Defaults to 0.
+    """
+    if os.path.exists(database):
+        print(f"Using existing database {database}")
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        generate_data.generate(directory, rows, seed)
+        build_database(f"sqlite:///{database}", source = directory, bulk = True).dispose()
+
+
+def percentiles(latencies):
+    """Throughput independent statistics of a list of latencies in seconds, in ms."""
+    latencies = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (np.nan,) * 3
+    return {'p50_ms': round(p50, 3), 'p95_ms': round(p95, 3), 'p99_ms': round(p99, 3),
+            'mean_ms': round(latencies.mean(), 3) if len(latencies) else np.nan,
+            'max_ms': round(latencies.max(), 3) if len(latencies) else np.nan}
+
+
+async def load_endpoint(client, endpoint, concurrency, requests, warmup):
+    """Send requests to one endpoint from concurrency clients at the same time.
+
+    Args:
+        client (httpx.AsyncClient): Client of the API.
+        endpoint (str): Path of the endpoint, with its query string.
+        concurrency (int): Number of requests in flight at any time.
+        requests (int): Number of measured requests.
+        warmup (int): Number of requests sent first and not measured.
+
+    Returns:
+        dict: Throughput, errors and latency percentiles
+    """
+    for _ in range(warmup):
+        await client.get(endpoint)
+
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            try:
+                response = await client.get(endpoint)
+                failed = response.status_code != 200
+            except httpx.HTTPError:
+                failed = True
+            latencies.append(time.perf_counter() - start)
+            errors += failed
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    seconds = time.perf_counter() - start
+
+    return {'requests': requests, 'errors': errors, 'seconds': round(seconds, 3),
+            'throughput_rps': round(requests / seconds, 1), **percentiles(latencies)}
+
+
+async def run_load(client, endpoints, concurrency, requests, warmup):
+    """Load each endpoint in turn, so that their latencies don't mix."""
+    return {endpoint: await load_endpoint(client, endpoint, concurrency, requests, warmup) for endpoint in endpoints}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_uvicorn(port, workers, env):
+    """Start the API with uvicorn in another process and wait until it answers.
+
+    Returns:
+        subprocess.Popen: uvicorn process
+    """
+    server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'app:app', '--host', '127.0.0.1', '--port', str(port),
+                               '--workers', str(workers), '--log-level', 'warning'],
+                              cwd = os.path.dirname(os.path.abspath(__file__)), env = env)
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"uvicorn stopped with code {server.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/version").status_code == 200:
+                return server
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"uvicorn didn't answer within {STARTUP_TIMEOUT} s")
+
+
+def benchmark_api(database, endpoints = ENDPOINTS, concurrency = 16, requests = 1000, warmup = 20,
+                  server = 'inprocess', workers = 1, cache = True):
+    """Measure the API on a database, either in this process (no network, only the app) or behind uvicorn.
+
+    Args:
+        database (str): Path of the SQLite file.
+        endpoints (list, optional): Paths to load. Defaults to ENDPOINTS.
+        concurrency (int, optional): Number of requests in flight at any time. Defaults to 16.
+        requests (int, optional): Number of measured requests per endpoint. Defaults to 1000.
+        warmup (int, optional): Number of requests sent first to each endpoint and not measured. Defaults to 20.
+        server (str, optional): 'inprocess' or 'uvicorn'. Defaults to 'inprocess'.
+        workers (int, optional): Number of uvicorn workers. Defaults to 1.
+        cache (bool, optional): Keep the response cache of the API. If False, every request runs its query. Defaults to True.
+
+    Returns:
+        dict: Settings of the run and results of each endpoint
+    """
+    # The app reads its settings when it is imported, in this process or in uvicorn workers
+    env = {**os.environ, 'CINEMA_DATABASE': os.path.abspath(database)}
+    if not cache:
+        env['CINEMA_CACHE_MAX_BYTES'] = '0'
+
+    if server == 'uvicorn':
+        port = free_port()
+        process = start_uvicorn(port, workers, env)
+        try:
+            client = httpx.AsyncClient(base_url = f"http://127.0.0.1:{port}",
+                                       limits = httpx.Limits(max_connections = concurrency))
+            results = asyncio.run(run_load(client, endpoints, concurrency, requests, warmup))
+        finally:
+            process.terminate()
+            process.wait()
+    else:
+        os.environ.update(env)
+        from app import app
+        client = httpx.AsyncClient(transport = httpx.ASGITransport(app = app), base_url = "http://benchmark")
+        results = asyncio.run(run_load(client, endpoints, concurrency, requests, warmup))
+
+    return {'database': database, 'database_mb': round(os.path.getsize(database) / 2**20, 1), 'server': server,
+            'workers': workers if server == 'uvicorn' else None, 'concurrency': concurrency, 'cache': cache,
+            'endpoints': results}
+
+
+def compare(report, baseline, tolerance = TOLERANCE):
+    """Compare a run with a stored baseline, endpoint by endpoint.
+
+    Returns:
+        list: Description of each regression, empty if there is none
+    """
+    regressions = []
+    for endpoint, result in report['endpoints'].items():
+        reference = baseline['endpoints'].get(endpoint)
+        if reference is None:
+            continue
+        throughput = result['throughput_rps'] / reference['throughput_rps'] - 1
+        latency = result['p95_ms'] / reference['p95_ms'] - 1
+        print(f"{endpoint:<15} {result['throughput_rps']:>10.0f} req/s ({throughput:+.0%})  "
+              f"p95 {result['p95_ms']:>8.2f} ms ({latency:+.0%})")
+
+        if throughput < -tolerance:
+            regressions.append(f"{endpoint} : {throughput:+.0%} throughput")
+        if latency > tolerance:
+            regressions.append(f"{endpoint} : {latency:+.0%} p95 latency")
+        if result['errors']:
+            regressions.append(f"{endpoint} : {result['errors']} errors")
+    return regressions
+
+
+# Loaders run in worker processes, which import this file again on some platforms
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Measure throughput and latency of the API under concurrent load, offline.")
+    parser.add_argument('--database', default = None,
+                        help = "SQLite file to serve. Built from synthetic dumps of --rows titles if it doesn't exist. "
+                               "Defaults to a temporary file.")
+    parser.add_argument('--rows', type = int, default = 100000, help = "Number of titles of the synthetic dumps.")
+    parser.add_argument('--server', choices = ['inprocess', 'uvicorn'], default = 'inprocess',
+                        help = "Call the app in this process, or through HTTP with uvicorn. Defaults to inprocess.")
+    parser.add_argument('--workers', type = int, default = 1, help = "Number of uvicorn workers. Defaults to 1.")
+    parser.add_argument('--concurrency', type = int, default = 16, help = "Requests in flight at any time. Defaults to 16.")
+    parser.add_argument('--requests', type = int, default = 1000, help = "Measured requests per endpoint. Defaults to 1000.")
+    parser.add_argument('--warmup', type = int, default = 20, help = "Requests per endpoint sent before measuring. Defaults to 20.")
+    parser.add_argument('--endpoints', nargs = '+', default = ENDPOINTS, help = "Paths to load. Defaults to the dashboard endpoints.")
+    parser.add_argument('--no-cache', action = 'store_true', help = "Turn off the response cache, to measure the queries.")
+    parser.add_argument('--output', default = None, help = "Write the report in this JSON file.")
+    parser.add_argument('--baseline', default = None, help = "Report of an earlier run to compare with.")
+    parser.add_argument('--tolerance', type = float, default = TOLERANCE,
+                        help = f"Allowed relative loss of throughput or growth of p95 latency. Defaults to {TOLERANCE}.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = args.database or os.path.join(directory, 'benchmark.db')
+        prepare_database(database, args.rows)
+
+        report = benchmark_api(database, args.endpoints, args.concurrency, args.requests, args.warmup,
+                               args.server, args.workers, cache = not args.no_cache)
+
+    print(json.dumps(report, indent = 2))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent = 2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"Regression : {regression}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,134 @@
+from sqlalchemy import create_engine, select, func, exc
+import generate_data
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Number of runs of each query, the median is kept
+REPEAT = 5
+
+
+def storage_sizes(connection):
+    """Bytes used by each table and index, read from the dbstat virtual table.
+
+    Returns:
+        dict: Size in MB of each table or index, None if SQLite was compiled without dbstat
+    """
+    try:
+        rows = connection.exec_driver_sql("SELECT name, sum(pgsize) FROM dbstat GROUP BY name ORDER BY 2 DESC").all()
+    except exc.OperationalError:
+        return None
+    return {name: round(size / 2**20, 3) for name, size in rows}
+
+
+def join_queries():
+    """Queries joining tables on ids, as run by the aggregates and the /v2 endpoints."""
+    # Imported here : the type of the ids is read from the environment when models.py is imported
+    from models import Movie, Genre, Movie_genre
+    from aggregates import actor_scores_query, top_movies_query
+
+    genres_since_2000 = (
+        select(Genre.name, func.count(Movie_genre.c.movie))
+        .join(Movie_genre, Genre.id == Movie_genre.c.genre)
+        .join(Movie, Movie_genre.c.movie == Movie.tconst)
+        .where(Movie.start_year >= 2000)
+        .group_by(Genre.id)
+    )
+    return {'actor_scores': actor_scores_query(), 'top_movies': top_movies_query(), 'genres_since_2000': genres_since_2000}
+
+
+def measure(database, source, repeat = REPEAT):
+    """Build a database from the dumps of source, then measure its size and the time of join_queries.
+    Runs with the type of ids of the current process (CINEMA_INTEGER_IDS).
+
+    Returns:
+        dict: Size of the file, of each table and index, and median time of each query in ms
+    """
+    from setup_database import build_database
+
+    build_database(f"sqlite:///{database}", source = source, bulk = True).dispose()
+    engine = create_engine(f"sqlite:///{database}")
+
+    queries = {}
+    with engine.connect() as connection:
+        sizes = storage_sizes(connection)
+        for name, query in join_queries().items():
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                connection.execute(query).all()
+                times.append(time.perf_counter() - start)
+            queries[name] = round(statistics.median(times) * 1000, 3)
+    engine.dispose()
+
+    return {'file_mb': round(os.path.getsize(database) / 2**20, 3), 'sizes_mb': sizes, 'queries_ms': queries}
+
+
+def compare_ids(source, directory, repeat = REPEAT):
+    """Build the same dumps with string ids and with integer ids, each one in its own process.
+
+    Returns:
+        dict: Result of measure for 'string' and 'integer' ids
+    """
+    report = {}
+    for mode, integer_ids in [('string', '0'), ('integer', '1')]:
+        database = os.path.join(directory, f"ids_{mode}.db")
+        output = os.path.join(directory, f"ids_{mode}.json")
+        env = {**os.environ, 'CINEMA_INTEGER_IDS': integer_ids}
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--measure', database, '--source', source,
+                        '--repeat', str(repeat), '--output', output], env = env, check = True)
+        with open(output) as file:
+            report[mode] = json.load(file)
+    return report
+
+
+def print_comparison(report):
+    string, integer = report['string'], report['integer']
+    print(f"{'file':<35} {string['file_mb']:>10.2f} MB {integer['file_mb']:>10.2f} MB "
+          f"({integer['file_mb'] / string['file_mb'] - 1:+.0%})")
+    if string['sizes_mb'] and integer['sizes_mb']:
+        for name, size in string['sizes_mb'].items():
+            other = integer['sizes_mb'].get(name, 0)
+            change = f"({other / size - 1:+.0%})" if size else ""
+            print(f"{name:<35} {size:>10.2f} MB {other:>10.2f} MB {change}")
+    for name, ms in string['queries_ms'].items():
+        other = integer['queries_ms'][name]
+        print(f"{name:<35} {ms:>10.2f} ms {other:>10.2f} ms ({other / ms - 1:+.0%})")
+
+
+# Builds run in other processes, which import this file again
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Compare size and join speed of a database with string ids and with integer ids.")
+    parser.add_argument('--source', default = None,
+                        help = "Directory containing the dumps. Defaults to dumps generated in a temporary directory.")
+    parser.add_argument('--rows', type = int, default = 100000,
+                        help = "Number of titles of the generated dumps, when --source is not given.")
+    parser.add_argument('--repeat', type = int, default = REPEAT, help = f"Runs of each query. Defaults to {REPEAT}.")
+    parser.add_argument('--output', default = None, help = "Write the report in this JSON file.")
+    parser.add_argument('--measure', default = None, help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Measure of one database, with the ids set by the environment
+    if args.measure :
+        result = measure(args.measure, args.source, args.repeat)
+        with open(args.output, 'w') as file:
+            json.dump(result, file, indent = 2)
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = args.source
+        if source is None :
+            source = directory
+            generate_data.generate(source, args.rows)
+        report = compare_ids(os.path.abspath(source), directory, args.repeat)
+
+    print_comparison(report)
+    if args.output :
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent = 2)
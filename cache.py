@@ -0,0 +1,104 @@
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+import os
+
+# Memory allowed for cached response bodies, in bytes. 0 turns the cache off (ie to benchmark the queries).
+CACHE_MAX_BYTES = int(os.environ.get('CINEMA_CACHE_MAX_BYTES', 64 * 2**20))
+
+# How often the data version is read from the database, in seconds
+VERSION_CHECK_INTERVAL = 5
+
+# How long a client can reuse a response without asking again, in seconds
+CACHE_MAX_AGE = 60
+
+
+class Data_version:
+    """Version stamp of the data, stored in the database as PRAGMA user_version and bumped by the loaders.
+    It is read at most once every interval, so most requests don't touch the database at all.
+    """
+
+    def __init__(self, engine, interval = VERSION_CHECK_INTERVAL):
+        self.engine = engine
+        self.interval = interval
+        self.version = None
+        self.checked = 0
+
+    def is_fresh(self):
+        """True if the version was read less than interval seconds ago, so that get won't query the database."""
+        return self.version is not None and time.monotonic() - self.checked <= self.interval
+
+    def get(self):
+        """Return the current version of the data."""
+        now = time.monotonic()
+        if not self.is_fresh():
+            with self.engine.connect() as connection:
+                self.version = connection.exec_driver_sql("PRAGMA user_version").scalar()
+            self.checked = now
+        return self.version
+
+
+class Cached_response:
+    """Serialized body of a response, ready to be sent again."""
+
+    def __init__(self, body, media_type, version):
+        self.body = body
+        self.media_type = media_type
+        self.etag = f'"{version}-{hashlib.sha1(body).hexdigest()[:16]}"'
+
+    def matches(self, if_none_match):
+        """True if an If-None-Match header names this response, so that the client copy is still valid.
+        Tags are compared exactly, the weak W/ prefix being ignored as RFC 9110 asks for If-None-Match, and * matches any.
+
+        Args:
+            if_none_match (str): Value of the header, ie '"3-0123456789abcdef", W/"2-fedcba9876543210"'. Can be None.
+        """
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return any(tag == '*' or tag.removeprefix('W/').strip() == self.etag for tag in tags)
+
+
+class Response_cache:
+    """LRU cache of serialized responses, bounded by the total size of the bodies.
+    Keys contain the data version, so entries of an older version are never hit again and are evicted first.
+    """
+
+    def __init__(self, max_bytes = CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached response of key, or None. Counts hits and misses."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        """Store a response, evicting the least recently used ones if the cache is full."""
+        if len(entry.body) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old.body)
+            self.entries[key] = entry
+            self.size += len(entry.body)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last = False)
+                self.size -= len(evicted.body)
+
+    def stats(self):
+        """Counters for monitoring."""
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries), 'size': self.size}
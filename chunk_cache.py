@@ -0,0 +1,227 @@
+from metrics import collect, count_in, reject
+import hashlib
+import inspect
+import json
+import shutil
+import threading
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:  # The cache is optional : without pyarrow, dumps are parsed every time
+    pa = None
+
+# Directory of the cleaned chunks. An empty value turns the cache off.
+CACHE_DIR = os.environ.get('CINEMA_PREPROCESS_CACHE', 'preprocess_cache')
+
+# Compression of the cached files : 'lz4', 'zstd' or None. Without compression, numbers are read straight
+# from the memory-mapped file instead of being decompressed in memory.
+CACHE_COMPRESSION = 'lz4'
+
+MANIFEST = 'manifest.json'
+
+# Checksums of the dumps, kept with their size and modification time so that an unchanged file is not read again
+CHECKSUMS = 'checksums.json'
+checksums_lock = threading.Lock()
+
+
+def file_checksum(path, directory = None):
+    """SHA-256 of a local file, computed again only when its size or modification time changed.
+
+    Args:
+        path (str): Path of the file.
+        directory (str, optional): Cache directory, where the checksums are kept. Defaults to CACHE_DIR.
+
+    Returns:
+        str: Hexadecimal checksum
+    """
+    directory = directory or CACHE_DIR
+    stat = os.stat(path)
+    signature = [stat.st_size, stat.st_mtime_ns]
+    checksums_path = os.path.join(directory, CHECKSUMS)
+
+    with checksums_lock:
+        try:
+            with open(checksums_path) as file:
+                checksums = json.load(file)
+        except (OSError, ValueError):
+            checksums = {}
+        known = checksums.get(os.path.abspath(path))
+        if known is not None and known['signature'] == signature:
+            return known['sha256']
+
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while block := file.read(2**20):
+            sha256.update(block)
+
+    with checksums_lock:
+        checksums[os.path.abspath(path)] = {'signature': signature, 'sha256': sha256.hexdigest()}
+        os.makedirs(directory, exist_ok = True)
+        with open(checksums_path + '.tmp', 'w') as file:
+            json.dump(checksums, file, indent = 2)
+        os.replace(checksums_path + '.tmp', checksums_path)
+    return sha256.hexdigest()
+
+
+def cache_for(name, path, function, version, **settings):
+    """Cache of the chunks of a dump cleaned by function.
+    Its key changes with the content of the dump, the source code of function, version and settings,
+    so that a change of any of them is never served stale chunks.
+
+    Args:
+        name (str): Name of the dump (ie 'title.basics').
+        path (str): Path of the dump.
+        function (function): Cleaning function, whose source code is part of the key.
+        version (int): Version of the cleaning, to bump when it changes outside of function.
+        **settings: Anything else changing the chunks (ie memory limit, columns and types read).
+
+    Returns:
+        Chunk_cache: Cache of the dump, None if the cache is off, pyarrow is missing or the dump is not a local file
+    """
+    if pa is None or not CACHE_DIR or '://' in path:
+        return None
+
+    key = json.dumps([version, name, file_checksum(path), inspect.getsource(function), settings],
+                     sort_keys = True, default = repr)
+    return Chunk_cache(name, hashlib.sha256(key.encode()).hexdigest()[:16])
+
+
+def write_frame(frame, path, rows_read, rejected):
+    """Write a cleaned chunk in the Arrow IPC (Feather v2) format, with what it took to produce it.
+
+    Args:
+        frame (pd.DataFrame): Cleaned chunk. Its index is not kept.
+        path (str): Path of the file.
+        rows_read (int): Number of rows of the dump the chunk comes from.
+        rejected (dict): Number of rows dropped from those, for each reason.
+    """
+    table = pa.Table.from_pandas(frame, preserve_index = False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                           b'rows_read': str(int(rows_read)).encode(),
+                                           b'rejected': json.dumps({reason: int(count) for reason, count in rejected.items()}).encode()})
+    options = pa.ipc.IpcWriteOptions(compression = CACHE_COMPRESSION)
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema, options = options) as writer:
+        writer.write_table(table)
+
+
+def read_metadata(path):
+    """Rows read and rejections stored with a cached chunk, without reading its data."""
+    metadata = pa.ipc.open_file(pa.memory_map(path)).schema.metadata
+    return int(metadata[b'rows_read']), json.loads(metadata[b'rejected'])
+
+
+def read_frame(path):
+    """Read a cached chunk from a memory-mapped file.
+
+    Returns:
+        pd.DataFrame: Cleaned chunk. attrs['rows_read'] and attrs['rejected'] are the values given to write_frame.
+    """
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    frame = table.to_pandas()
+    # Arrow gives None for missing strings where read_csv gives NaN
+    frame = frame.fillna(float('nan'))
+    frame.attrs['rows_read'] = int(table.schema.metadata[b'rows_read'])
+    frame.attrs['rejected'] = json.loads(table.schema.metadata[b'rejected'])
+    return frame
+
+
+class Chunk_cache:
+    """Cleaned chunks of one dump, one Arrow file per chunk in the directory <CACHE_DIR>/<name>-<key>.
+    Chunks are written in a temporary directory, which replaces the previous entry of the dump only once complete.
+    """
+
+    def __init__(self, name, key, directory = None):
+        self.name = name
+        self.directory = directory or CACHE_DIR
+        self.path = os.path.join(self.directory, f"{name}-{key}")
+        self.temp = None
+        self.written = []
+
+    def parts(self, offset = 0):
+        """Paths of the cached chunks coming after the first offset rows of the dump.
+
+        Returns:
+            list: Paths, None if the dump is not cached or if offset falls inside a chunk
+        """
+        try:
+            with open(os.path.join(self.path, MANIFEST)) as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            return None
+
+        paths = []
+        skipped = 0
+        for part in manifest['parts']:
+            if skipped < offset:
+                skipped += part['rows_read']
+            else :
+                paths.append(os.path.join(self.path, part['file']))
+        return paths if skipped == offset else None
+
+    def start(self):
+        """Start writing a new entry, chunk by chunk with new_part."""
+        self.temp = f"{self.path}.tmp{os.getpid()}"
+        shutil.rmtree(self.temp, ignore_errors = True)
+        os.makedirs(self.temp)
+        self.written = []
+
+    def new_part(self):
+        """Path of the next chunk of the entry being written. Chunks are read back in the order of this call."""
+        path = os.path.join(self.temp, f"part-{len(self.written):05d}.arrow")
+        self.written.append(path)
+        return path
+
+    def commit(self):
+        """Make the entry being written the entry of the dump, replacing the older ones."""
+        parts = [{'file': os.path.basename(path), 'rows_read': read_metadata(path)[0]} for path in self.written]
+        with open(os.path.join(self.temp, MANIFEST), 'w') as file:
+            json.dump({'name': self.name, 'parts': parts}, file, indent = 2)
+
+        for entry in os.listdir(self.directory):
+            if entry.startswith(f"{self.name}-") and '.tmp' not in entry:
+                shutil.rmtree(os.path.join(self.directory, entry), ignore_errors = True)
+        os.replace(self.temp, self.path)
+        self.temp = None
+
+    def discard(self):
+        """Forget the entry being written, ie the load stopped before the end of the dump."""
+        if self.temp is not None:
+            shutil.rmtree(self.temp, ignore_errors = True)
+            self.temp = None
+
+
+def cached_chunks(paths):
+    """Read cached chunks, counting their rows and rejections in the current stage of metrics as if they were parsed.
+
+    Yields:
+        pd.DataFrame: Cleaned chunk. attrs['rows_read'] is the number of rows of the dump it comes from.
+    """
+    for path in paths:
+        frame = read_frame(path)
+        count_in(frame.attrs['rows_read'])
+        for reason, count in frame.attrs['rejected'].items():
+            reject(reason, count)
+        yield frame
+
+
+def caching_chunks(cache, chunks):
+    """Pass the chunks of a preprocess function through, storing each one in cache.
+    The entry is committed only if every chunk was read.
+
+    Args:
+        cache (Chunk_cache): Cache of the dump.
+        chunks (iterable): Cleaned chunks, with attrs['rows_read'].
+
+    Yields:
+        pd.DataFrame: Same chunks
+    """
+    cache.start()
+    try:
+        for chunk, rejected in collect(chunks):
+            write_frame(chunk, cache.new_part(), chunk.attrs['rows_read'], rejected)
+            yield chunk
+        cache.commit()
+    finally:
+        cache.discard()
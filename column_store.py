@@ -0,0 +1,259 @@
+from contextlib import closing
+import numpy as np
+import pandas as pd
+import argparse
+import threading
+import sqlite3
+import struct
+import json
+import time
+import os
+
+# The store is written next to the database, ie database.db.columns
+STORE_SUFFIX = '.columns'
+
+# Columns of each movie, with their type and the value of a missing one. Movies without rating get a NaN rating and 0 votes.
+COLUMNS = {
+    'start_year': ('int16', 0),
+    'run_time_minutes': ('int32', -1),
+    'is_adult': ('int8', 0),
+    'average_rating': ('float32', np.nan),
+    'num_votes': ('int64', 0),
+}
+
+# Genres of the movies, one row per pair of movie_genre ordered by movie : position of the movie in the columns above,
+# genre code, and start year of the movie again so that the heatmap doesn't have to look it up
+PAIR_COLUMNS = {'genre_movie': 'int32', 'genre_code': 'int16', 'genre_year': 'int16'}
+
+# Columns start on a multiple of this number of bytes
+ALIGNMENT = 64
+
+# Rows read from SQLite at once
+STORE_CHUNK_ROWS = 1000000
+
+# Ratings go from 1 to 10
+RATING_RANGE = (1, 10)
+
+# How often the API checks if a new store was swapped in, in seconds
+STORE_CHECK_INTERVAL = 1
+
+
+def store_path(database):
+    """Path of the column store of a SQLite database."""
+    return database + STORE_SUFFIX
+
+
+def aligned(size):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def read_movie_columns(connection, chunk_rows = STORE_CHUNK_ROWS):
+    """Columns of every movie ordered by id, with its rating, and the movie-genre pairs as positions and genre codes.
+
+    Returns:
+        tuple: Arrays of COLUMNS and PAIR_COLUMNS, and names of the genres in the order of their codes
+    """
+    rows = connection.execute("SELECT count(*) FROM movies").fetchone()[0]
+    columns = {name: np.full(rows, missing, dtype = dtype) for name, (dtype, missing) in COLUMNS.items()}
+    ids = []
+    start = 0
+    query = ("SELECT m.tconst, m.start_year, m.run_time_minutes, m.is_adult, r.average_rating, r.num_votes "
+             "FROM movies m LEFT JOIN movie_ratings r ON r.tconst = m.tconst ORDER BY m.tconst")
+    for chunk in pd.read_sql(query, connection, chunksize = chunk_rows):
+        end = start + len(chunk)
+        for name, (dtype, missing) in COLUMNS.items():
+            columns[name][start:end] = chunk[name].fillna(missing).to_numpy(dtype)
+        ids.append(chunk['tconst'].to_numpy())
+        start = end
+    positions = pd.Index(np.concatenate(ids) if ids else [])
+
+    genres = pd.read_sql("SELECT id, name FROM genres ORDER BY id", connection)
+    codes = pd.Series(np.arange(len(genres)), index = genres['id'])
+    pairs = pd.read_sql("SELECT movie, genre FROM movie_genre", connection)
+    movies = positions.get_indexer(pairs['movie'])
+    # Pairs of unknown movies or genres are dropped (there is none in a database which passed validate_database)
+    genre_codes = pairs['genre'].map(codes)
+    known = (movies >= 0) & genre_codes.notna().to_numpy()
+    # Pairs in the order of the movies, so that looking up the columns of their movies reads memory sequentially
+    order = np.argsort(movies[known], kind = 'stable')
+    columns['genre_movie'] = movies[known][order].astype(PAIR_COLUMNS['genre_movie'])
+    columns['genre_code'] = genre_codes[known].to_numpy()[order].astype(PAIR_COLUMNS['genre_code'])
+    columns['genre_year'] = columns['start_year'][columns['genre_movie']].astype(PAIR_COLUMNS['genre_year'])
+    return columns, genres['name'].tolist()
+
+
+def write_column_store(database, path = None):
+    """Write the columns of the movies of a SQLite database in one file, which the API memory-maps (see Column_store).
+    The file starts with the length of a JSON header, then the header (genres, and type, offset and length of each
+    column), then each column aligned on ALIGNMENT bytes. It is written under a temporary name and renamed once complete.
+
+    Args:
+        database (str): Path of the SQLite file.
+        path (str, optional): Path of the store. Defaults to store_path(database).
+
+    Returns:
+        dict: Number of movies and of movie-genre pairs
+    """
+    path = path or store_path(database)
+    with closing(sqlite3.connect(f"file:{database}?mode=ro", uri = True)) as connection:
+        columns, genres = read_movie_columns(connection)
+
+    layout = {}
+    offset = 0
+    for name, array in columns.items():
+        layout[name] = {'dtype': array.dtype.str, 'offset': offset, 'length': len(array)}
+        offset = aligned(offset + array.nbytes)
+    header = json.dumps({'genres': genres, 'columns': layout}).encode()
+
+    temp = path + '.tmp'
+    with open(temp, 'wb') as file:
+        file.write(struct.pack('<Q', len(header)) + header)
+        data_start = aligned(8 + len(header))
+        for name, array in columns.items():
+            file.seek(data_start + layout[name]['offset'])
+            file.write(array.tobytes())
+    os.replace(temp, path)
+    return {'movies': len(columns['start_year']), 'pairs': len(columns['genre_movie'])}
+
+
+class Column_store:
+    """Columns written by write_column_store, memory-mapped read-only : every worker of the API shares the same pages."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            length = struct.unpack('<Q', file.read(8))[0]
+            header = json.loads(file.read(length))
+        data_start = aligned(8 + length)
+        self.genres = header['genres']
+        self.columns = {name: np.memmap(path, dtype = column['dtype'], mode = 'r', offset = data_start + column['offset'],
+                                        shape = (column['length'],)) if column['length'] else np.empty(0, column['dtype'])
+                        for name, column in header['columns'].items()}
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def movie_mask(self, year_from = None, year_to = None, is_adult = None, genre = None, min_votes = None):
+        """Movies matching every given filter, as a boolean array over the movies."""
+        mask = np.ones(len(self['start_year']), dtype = bool)
+        if year_from is not None:
+            mask &= self['start_year'] >= year_from
+        if year_to is not None:
+            mask &= (self['start_year'] <= year_to) & (self['start_year'] != 0)
+        if is_adult is not None:
+            mask &= self['is_adult'] == int(is_adult)
+        if min_votes is not None:
+            mask &= self['num_votes'] >= min_votes
+        if genre is not None:
+            in_genre = np.zeros_like(mask)
+            if genre in self.genres:
+                in_genre[self['genre_movie'][self['genre_code'] == self.genres.index(genre)]] = True
+            mask &= in_genre
+        return mask
+
+
+class Live_store:
+    """Column store currently at path. Like app.Live_engine, the new file is opened once a build or a refresh swapped it in.
+    Requests already using the old one keep reading its mapping, which stays valid after the rename.
+    """
+
+    def __init__(self, path, interval = STORE_CHECK_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.file = None
+        self.store = None
+        self.checked = 0
+        self.lock = threading.Lock()
+
+    def current(self):
+        """Column_store of the file at path, None if there is none yet."""
+        if time.monotonic() - self.checked > self.interval:
+            with self.lock:
+                if time.monotonic() - self.checked > self.interval:
+                    try:
+                        stat = os.stat(self.path)
+                        if (stat.st_dev, stat.st_ino) != self.file:
+                            self.store = Column_store(self.path)
+                            self.file = (stat.st_dev, stat.st_ino)
+                    except FileNotFoundError:
+                        pass
+                    self.checked = time.monotonic()
+        return self.store
+
+
+def rating_histogram(store, mask, bins):
+    """Number of rated movies of mask in each of bins equal intervals of rating."""
+    ratings = store['average_rating'][mask]
+    counts, edges = np.histogram(ratings[~np.isnan(ratings)], bins = bins, range = RATING_RANGE)
+    return {'edges': np.round(edges, 6).tolist(), 'counts': counts.tolist()}
+
+
+def counted_percentiles(counts, percentiles):
+    """Percentiles of integer values given by their counts (counts[v] is the number of times v appears),
+    interpolated like np.percentile on the values themselves but without sorting them.
+    """
+    cumulated = np.cumsum(counts)
+    positions = (cumulated[-1] - 1) * np.asarray(percentiles, dtype = float) / 100
+    low = np.searchsorted(cumulated, np.floor(positions), side = 'right')
+    high = np.searchsorted(cumulated, np.ceil(positions), side = 'right')
+    return low + (high - low) * (positions - np.floor(positions))
+
+
+def runtime_by_decade(store, mask):
+    """Number of movies, mean and quartiles of the run time of the movies of mask, for each decade of start year.
+    Run times are integers : they are counted for each year and run time, and the statistics are read from the counts.
+    """
+    known = mask & (store['run_time_minutes'] >= 0) & (store['start_year'] != 0)
+    years = store['start_year'][known].astype(np.int64)
+    runtimes = store['run_time_minutes'][known]
+    if len(years) == 0:
+        return []
+
+    # First row of the counts is the first year of its decade, so that each decade is 10 rows
+    first = years.min() // 10 * 10
+    width = int(runtimes.max()) + 1
+    decades = (years.max() - first) // 10 + 1
+    counts = np.bincount((years - first) * width + runtimes, minlength = decades * 10 * width)
+    counts = counts.reshape(decades, 10, width).sum(axis = 1)
+    sums = counts @ np.arange(width)
+
+    result = []
+    for decade in np.flatnonzero(counts.sum(axis = 1)):
+        movie_number = int(counts[decade].sum())
+        p25, median, p75 = counted_percentiles(counts[decade], [25, 50, 75])
+        result.append({'decade': int(first + decade * 10), 'movie_number': movie_number, 'mean': float(sums[decade] / movie_number),
+                       'p25': float(p25), 'median': float(median), 'p75': float(p75)})
+    return result
+
+
+def vote_percentiles(store, mask, percentiles):
+    """Percentiles of the number of votes of the rated movies of mask."""
+    votes = store['num_votes'][mask & ~np.isnan(store['average_rating'])]
+    values = np.percentile(votes, percentiles) if len(votes) else [None] * len(percentiles)
+    return [{'percentile': percentile, 'num_votes': None if value is None else float(value)}
+            for percentile, value in zip(percentiles, values)]
+
+
+def genre_heatmap(store, mask):
+    """Number of movies of mask for each genre (rows) and start year (columns)."""
+    selected = store['genre_year'] != 0
+    if not mask.all():
+        selected &= mask[store['genre_movie']]
+    codes, years = store['genre_code'][selected].astype(np.int64), store['genre_year'][selected].astype(np.int64)
+    if len(years) == 0:
+        return {'years': [], 'genres': store.genres, 'counts': [[] for _ in store.genres]}
+
+    first, last = years.min(), years.max()
+    width = last - first + 1
+    counts = np.bincount(codes * width + years - first, minlength = len(store.genres) * width).reshape(len(store.genres), width)
+    return {'years': list(range(int(first), int(last) + 1)), 'genres': store.genres, 'counts': counts.tolist()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Write the column store of an existing database (builds and refreshes write it already).")
+    parser.add_argument('--database', default = 'database.db', help = "SQLite file. Defaults to database.db.")
+    args = parser.parse_args()
+
+    start = time.time()
+    counts = write_column_store(args.database)
+    print(f"{store_path(args.database)} written : {counts['movies']} movies, {counts['pairs']} genres of movies "
+          f"in {time.time() - start:.2f} s")
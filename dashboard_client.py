@@ -0,0 +1,116 @@
+from requests.adapters import HTTPAdapter
+import streamlit as st
+import requests
+import os
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow is optional : without pyarrow, the dashboard is fetched as JSON
+    pa = None
+
+# Address of the API, which can be changed with an environment variable
+API_URL = os.environ.get('CINEMA_API', 'http://127.0.0.1:8000')
+
+# Datasets needed by the dashboard, all returned at once by the /dashboard endpoint
+DASHBOARD_DATASETS = ["perYear", "perGenre", "movieRating", "actorRanking"]
+
+# How long the data version is trusted before asking the API again, in seconds
+VERSION_TTL = 10
+# Cached datasets are dropped after this time even if the version didn't change, in seconds
+DATA_TTL = 3600
+
+
+class Dashboard_error(Exception):
+    """The API didn't give the datasets of the dashboard."""
+
+
+@st.cache_resource
+def get_session():
+    """HTTP session shared by every rerun of the dashboard : connections to the API are kept open and reused."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = 1)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_data(url):
+    response = get_session().get(url)
+
+    if response.status_code == 200:
+        data = response.json()
+        print('Data collected')
+        return data
+    else:
+        print(f"Erreur {response.status_code}: {response.text}")
+        return None
+
+
+def read_arrow(body):
+    """Datasets of an Arrow answer of /dashboard : one IPC stream per dataset, named in the metadata of its schema.
+
+    Args:
+        body (bytes): Body of the response.
+
+    Returns:
+        dict: Columns of each dataset, one list per field
+    """
+    reader = pa.BufferReader(body)
+    data = {}
+    while reader.tell() < len(body):
+        table = pa.ipc.open_stream(reader).read_all()
+        data[table.schema.metadata[b'dataset'].decode()] = table.to_pydict()
+    return data
+
+
+def get_arrow(url):
+    response = get_session().get(url, params = {'format': 'arrow'})
+
+    if response.status_code == 200:
+        data = read_arrow(response.content)
+        print('Data collected')
+        return data
+    else:
+        print(f"Erreur {response.status_code}: {response.text}")
+        return None
+
+
+@st.cache_data(ttl = VERSION_TTL)
+def get_version():
+    """Version of the data served by the API. It changes each time the database is loaded or refreshed."""
+    data = get_data(f"{API_URL}/version")
+    return data['version'] if data else None
+
+
+@st.cache_data(ttl = DATA_TTL)
+def fetch_dashboard(version):
+    """Collect every dataset of the dashboard in one request, in the Arrow format when pyarrow is installed (smaller
+    and faster to decode than JSON). Cached for each version of the data, so results are reused on every rerun until
+    a loader changes the database.
+
+    Args:
+        version (int): Version of the data, only used as a key of the cache.
+
+    Returns:
+        dict: Columns of each dataset of DASHBOARD_DATASETS, one list per field
+
+    Raises:
+        Dashboard_error: If the API didn't answer. st.cache_data doesn't store exceptions, so the next rerun asks again.
+    """
+    data = get_arrow(f"{API_URL}/dashboard") if pa is not None else get_data(f"{API_URL}/dashboard")
+    if data is None:
+        raise Dashboard_error(f"{API_URL}/dashboard didn't answer")
+    return {name: data[name] for name in DASHBOARD_DATASETS}
+
+
+def load_dashboard():
+    """Data of the dashboard, from the cache when the data version didn't change.
+
+    Returns:
+        dict: Columns of each dataset of DASHBOARD_DATASETS, one list per field, or None if the API can't be reached
+    """
+    try:
+        return fetch_dashboard(get_version())
+    except (Dashboard_error, requests.RequestException) as error:
+        print(f"Erreur : {error}")
+        return None
@@ -35,3 +35,56 @@ class Actor_rating(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+# Pages of the rankings : next_cursor has to be given back to get the following page, it is None on the last page
+class Rating_page(BaseModel):
+    items: List[Rating_ranking]
+    next_cursor: Optional[str]
+
+
+class Actor_page(BaseModel):
+    items: List[Actor_rating]
+    next_cursor: Optional[str]
+
+
+# Distributions computed from the column store (see column_store.py)
+class Rating_histogram(BaseModel):
+    edges: List[float]
+    counts: List[int]
+
+
+class Runtime_per_decade(BaseModel):
+    decade: int
+    movie_number: int
+    mean: float
+    p25: float
+    median: float
+    p75: float
+
+
+class Vote_percentile(BaseModel):
+    percentile: float
+    num_votes: Optional[float]
+
+
+# counts[i][j] is the number of movies of genres[i] started in years[j]
+class Genre_heatmap(BaseModel):
+    years: List[int]
+    genres: List[str]
+    counts: List[List[int]]
+
+
+# Slice of the cube : dimensions which are not asked are None
+class Cube_slice(BaseModel):
+    year: Optional[int] = None
+    genre: Optional[str] = None
+    is_adult: Optional[bool] = None
+    rating_bucket: Optional[int] = None
+    movie_number: int
+    rated_number: int
+    mean_rating: Optional[float]
+    num_votes: int
+
+    class Config:
+        from_attributes = True
@@ -1,320 +1,1140 @@
-from models import Base, Movie, Actor, Movie_rating, Played_in, Genre
+from models import Base, Movie, Actor, Movie_rating, Played_in, Genre, Build_checkpoint, INTEGER_IDS, ID_DIGITS
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, select, event, exc
+from sqlalchemy.schema import CreateTable
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, closing
+from collections import deque
+from itertools import islice
+from metrics import measure_stage, step, timed, count_in, count_out, reject, record, add_cpu, Counting_reader
+from pipeline import prefetch
+from chunk_cache import cache_for, cached_chunks, caching_chunks, read_frame, write_frame
+from functools import wraps
 from tqdm import tqdm
 import pandas as pd
+import urllib.request
+import multiprocessing
+import threading
+import gzip
+import time
+import io
+import os
+
+# Default location of the dumps. A local directory holding the same file names can be used instead (mirror).
+IMDB_URL = 'https://datasets.imdbws.com'
+TEST_DIR = 'test_small_db'
+
+# Approximate memory budget (in MB) for one parsed chunk of a dump
+MEMORY_LIMIT = 256
+
+# Number of rows sent to the database in one executemany
+BATCH_SIZE = 50000
+
+# SQLite allows one writer at a time : stages running at the same time (see pipeline.py) take turns through this lock
+WRITE_LOCK = threading.Lock()
+
+# Version of the cleaning of the dumps, part of the key of the preprocessing cache (see chunk_cache.py).
+# Changes of a preprocess function are detected from its source code : bump this one for changes made elsewhere.
+PREPROCESS_VERSION = 1
+
+# Directory of the rows which could not be inserted, one CSV file per table (see replay_rejects)
+REJECT_DIR = 'rejects'
+
+# PRAGMAs applied to every connection during a bulk load. Durability is not needed there, but each chunk must still
+# commit or roll back as a whole if the process dies, so that the build can be resumed : WAL keeps that without syncs.
+BULK_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'OFF',
+    'cache_size': -512000,  # In KB when negative, so 500 MB
+    'temp_store': 'MEMORY',
+}
+
+# For each dump : file names and the only columns we read, with their types.
+# Numbers which can contain garbage are read as strings and converted afterwards.
+DUMPS = {
+    'name.basics': {
+        'file': 'name.basics.tsv.gz',
+        'test_file': 'test_name.csv',
+        'dtype': {'nconst': str, 'primaryName': str, 'birthYear': 'float64', 'deathYear': 'float64',
+                  'primaryProfession': str, 'knownForTitles': str}
+    },
+    'title.basics': {
+        'file': 'title.basics.tsv.gz',
+        'test_file': 'test_title.csv',
+        'dtype': {'tconst': str, 'titleType': 'category', 'primaryTitle': str, 'originalTitle': str,
+                  'isAdult': str, 'startYear': str, 'runtimeMinutes': str, 'genres': str}
+    },
+    'title.ratings': {
+        'file': 'title.ratings.tsv.gz',
+        'test_file': 'test_rating.csv',
+        'dtype': {'tconst': str, 'averageRating': 'float64', 'numVotes': 'int64'}
+    },
+    'title.principals': {
+        'file': 'title.principals.tsv.gz',
+        'test_file': 'test_played_in.csv',
+        'dtype': {'tconst': str, 'nconst': str, 'category': 'category'}
+    },
+}
+
+
+def dump_path(source, file_name):
+    """Build the path of a dump file, either from a local mirror directory or from an URL.
 
+    Args:
+        source (str): Local directory or base URL containing the dumps.
+        file_name (str): Name of the dump file.
+
+    Returns:
+        str: Path or URL of the file.
+    """
+    if '://' in source:
+        return source.rstrip('/') + '/' + file_name
+    return os.path.join(source, file_name)
 
-def preprocess_actors(engine, test):
-    """Load DataFrame from name.basics.tsv or test_name.csv, rename columns and filter only actors/actress born after 1940.
+
+def chunk_rows(path, memory_limit, **read_args):
+    """Estimate how many rows of a file fit in memory_limit once parsed, reading a small sample of it.
 
     Args:
-        engine (sqlalchemy.orm.engine): Engine to connect to database.
-        test (bool): if True, use the test table in test_small_db repository. Allow to test functions on small database.
+        path (str): Path or URL of the file.
+        memory_limit (float): Memory budget in MB for one chunk.
+        **read_args: Arguments given to pd.read_csv.
+
+    Returns:
+        int: Number of rows per chunk.
+    """
+    sample = pd.read_csv(path, nrows = 10000, **read_args)
+    row_size = sample.memory_usage(deep = True).sum() / max(sample.shape[0], 1)
+    return max(int(memory_limit * 2**20 / row_size), 1)
+
+
+def dump_source(name, test = False, source = None):
+    """Find where an IMDb dump is and how to parse it, with only the useful columns and explicit types.
+
+    Args:
+        name (str): Name of the dump, key of DUMPS (ie 'title.basics').
+        test (bool, optional): if True, use the test table in test_small_db repository. Defaults to False.
+        source (str, optional): Local mirror directory or base URL of the dumps.
+          Defaults to the IMDb website, or to test_small_db repository when test is True.
 
     Returns:
-        pd.DataFrame: filtered and cleaned DataFrame
+        str : Path or URL of the file
+        dict : Arguments to give to pd.read_csv
     """
+    dump = DUMPS[name]
     if test :
-        name_basics = pd.read_csv('test_small_db/test_name.csv', sep = ';', na_values = '\\N')
+        path = os.path.join(source or TEST_DIR, dump['test_file'])
+        read_args = {'sep': ';'}
     else :
-        url = 'https://datasets.imdbws.com/name.basics.tsv.gz'
-        name_basics = pd.read_csv(url, sep = '\t', na_values = '\\N', compression = "gzip")
-    
-    # Let's gather only actor and actress born after 1940 to limit the file size
-    name_basics = name_basics[name_basics['birthYear'] >= 1940]
-    name_basics = name_basics[
-        name_basics['primaryProfession'].str.contains('actor|actress', na=False)
-    ]
-    name_basics = name_basics.drop(['primaryProfession'], axis = 1)
-
-    name_basics = name_basics.rename(columns={
-        'nconst': 'nconst',
-        'primaryName': 'primary_name',
-        'birthYear': 'birth_year',
-        'deathYear': 'death_year'
-    })
-    return name_basics
+        path = dump_path(source or IMDB_URL, dump['file'])
+        read_args = {'sep': '\t', 'compression': 'gzip'}
 
+    read_args.update(na_values = '\\N', usecols = list(dump['dtype']), dtype = dump['dtype'])
+    return path, read_args
 
-def preprocess_movies(engine, test):
-    """Load DataFrame from title.basics.tsv or test_title.csv, rename columns and filter only movie type.
+
+def open_dump(path):
+    """Open a local file or an URL in binary mode. Bytes read are counted in the current stage of metrics.
 
     Args:
-        engine (sqlalchemy.orm.engine): Engine to connect to database.
-        test (bool): if True, use the test table in test_small_db repository. Allow to test functions on small database.
+        path (str): Path or URL of the file.
 
     Returns:
-        pd.DataFrame: filtered and cleaned DataFrame
+        io.BufferedReader: Opened file
+    """
+    raw = urllib.request.urlopen(path) if '://' in path else open(path, 'rb')
+    return io.BufferedReader(Counting_reader(raw))
+
+
+def read_dump(name, test = False, source = None, memory_limit = MEMORY_LIMIT, offset = 0):
+    """Read an IMDb dump chunk by chunk, with only the useful columns and explicit types.
+    The size of the chunks is computed so that one parsed chunk stays under memory_limit.
+
+    Args:
+        name (str): Name of the dump, key of DUMPS (ie 'title.basics').
+        test (bool, optional): if True, use the test table in test_small_db repository. Defaults to False.
+        source (str, optional): Local mirror directory or base URL of the dumps. Defaults to None.
+        memory_limit (float, optional): Memory budget in MB for one chunk. Defaults to MEMORY_LIMIT.
+        offset (int, optional): Number of rows to skip after the header, ie already loaded. Defaults to 0.
+
+    Yields:
+        pd.DataFrame : chunk of the dump
     """
+    path, read_args = dump_source(name, test, source)
+    chunksize = chunk_rows(path, memory_limit, **read_args)
+    skiprows = range(1, offset + 1) if offset else None
+
+    with open_dump(path) as file:
+        yield from pd.read_csv(file, chunksize = chunksize, skiprows = skiprows, **read_args)
+
+
+def read_blocks(name, test = False, source = None, memory_limit = MEMORY_LIMIT, offset = 0):
+    """Read an IMDb dump as raw blocks of lines, without parsing them. Each block starts with the header line,
+    so that it can be parsed on its own (for instance in another process) with the arguments returned by dump_source.
+
+    Args:
+        name (str): Name of the dump, key of DUMPS (ie 'title.principals').
+        test (bool, optional): if True, use the test table in test_small_db repository. Defaults to False.
+        source (str, optional): Local mirror directory or base URL of the dumps. Defaults to None.
+        memory_limit (float, optional): Memory budget in MB for one parsed block. Defaults to MEMORY_LIMIT.
+        offset (int, optional): Number of lines to skip after the header, ie already loaded. Defaults to 0.
+
+    Yields:
+        bytes: header and block of lines
+    """
+    path, read_args = dump_source(name, test, source)
+    chunksize = chunk_rows(path, memory_limit, **read_args)
+
+    raw = open_dump(path)
+    with raw, (gzip.GzipFile(fileobj = raw) if read_args.get('compression') == 'gzip' else raw) as file:
+        header = file.readline()
+        for _ in islice(file, offset):
+            pass
+        while True:
+            lines = list(islice(file, chunksize))
+            if not lines:
+                break
+            yield header + b''.join(lines)
 
+
+def parse_ids(ids, prefix):
+    """Turn IMDb ids into ids as stored in the database : their numeric part when ids are stored as integers
+    (see models.INTEGER_IDS), themselves otherwise.
+
+    Args:
+        ids (pd.Series): IMDb ids, ie 'tt0000001'.
+        prefix (str): Prefix of the ids, ie 'tt'.
+
+    Returns:
+        pd.Series: Stored ids. Ids which are not valid (other prefix, not a number, or extra zeros so that they would not
+          be rendered back the same) are NaN.
+    """
+    if not INTEGER_IDS:
+        return ids
+    digits = ids.str[len(prefix):]
+    length = digits.str.len()
+    valid = (ids.str.startswith(prefix, na = False) & digits.str.isdigit().fillna(False).astype(bool)
+             & ((length == ID_DIGITS) | ((length > ID_DIGITS) & (digits.str[:1] != '0'))))
+    return pd.to_numeric(digits.where(valid), errors = 'coerce')
+
+
+def parse_id_columns(frame, prefixes):
+    """Apply parse_ids to some columns of a chunk, dropping the rows with an invalid id.
+
+    Args:
+        frame (pd.DataFrame): Chunk of a dump.
+        prefixes (dict): Prefix of the ids of each column, ie {'tconst': 'tt'}.
+
+    Returns:
+        pd.DataFrame : Chunk with stored ids
+        int : Number of dropped rows
+    """
+    if not INTEGER_IDS:
+        return frame, 0
+    frame = frame.assign(**{column: parse_ids(frame[column], prefix) for column, prefix in prefixes.items()})
+    valid = frame[list(prefixes)].notna().all(axis = 1)
+    return frame[valid].astype({column: 'int64' for column in prefixes}), int((~valid).sum())
+
+
+def dump_cache(name, function, test, source, memory_limit):
+    """Preprocessing cache of a dump cleaned by function. Test tables are small and edited by hand : they are not cached.
+
+    Returns:
+        chunk_cache.Chunk_cache: Cache of the dump, None if it can't be cached
+    """
     if test :
-        title_basics = pd.read_csv('test_small_db/test_title.csv', sep=';', na_values='\\N')
-    else :
-        url = 'https://datasets.imdbws.com/title.basics.tsv.gz'
-        title_basics = pd.read_csv(url, sep='\t', na_values='\\N', dtype = {'runtimeMinutes': 'string'}, compression = "gzip")
-    
-    # Let's collect only the movies
-    title_basics = title_basics[title_basics['titleType'] == 'movie']
-    title_basics = title_basics.drop(['titleType', 'endYear'], axis = 1)
-    
-    # If not a number, convert into Nan
-    title_basics['runtimeMinutes'] = pd.to_numeric(title_basics['runtimeMinutes'], errors = 'coerce')
-
-    title_basics = title_basics.rename(columns={
-        'tconst': 'tconst',
-        'primaryTitle': 'primary_title',
-        'originalTitle': 'original_title',
-        'isAdult': 'is_adult',
-        'startYear': 'start_year',
-        'runtimeMinutes': 'run_time_minutes'
-    })
+        return None
+    path, read_args = dump_source(name, test, source)
+    return cache_for(name, path, function, PREPROCESS_VERSION, memory_limit = memory_limit, read_args = read_args,
+                     integer_ids = INTEGER_IDS)
 
-    return title_basics
 
+def cached_preprocess(name):
+    """Decorator for the preprocess functions of a dump : cleaned chunks are stored in the preprocessing cache,
+    and read from there by the next calls as long as neither the dump nor the function changed.
+    Chunks are only stored by a call reading the whole dump.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(engine, test, source = None, memory_limit = MEMORY_LIMIT, offset = 0):
+            cache = dump_cache(name, function, test, source, memory_limit)
+            parts = cache.parts(offset) if cache is not None else None
+            if parts is not None:
+                yield from cached_chunks(parts)
+            elif cache is not None and not offset:
+                yield from caching_chunks(cache, function(engine, test, source, memory_limit, offset))
+            else :
+                yield from function(engine, test, source, memory_limit, offset)
+        return wrapper
+    return decorator
+
+
+@cached_preprocess('name.basics')
+def preprocess_actors(engine, test, source = None, memory_limit = MEMORY_LIMIT, offset = 0):
+    """Stream name.basics.tsv or test_name.csv chunk by chunk, rename columns and filter only actors/actress born after 1940.
 
-def preprocess_ratings(engine, test):
-    """Load DataFrame from title.ratings.tsv or test_ratings.csv, rename columns and filter only movie type.
+    Args:
+        engine (sqlalchemy.orm.engine): Engine to connect to database.
+        test (bool): if True, use the test table in test_small_db repository. Allow to test functions on small database.
+        source (str, optional): Local mirror directory or base URL of the dumps. Defaults to None.
+        memory_limit (float, optional): Memory budget in MB for one chunk. Defaults to MEMORY_LIMIT.
+        offset (int, optional): Number of rows of the dump to skip, ie already loaded. Defaults to 0.
+
+    Yields:
+        pd.DataFrame: filtered and cleaned chunk. attrs['rows_read'] is the number of rows of the dump it comes from.
+    """
+    for name_basics in read_dump('name.basics', test, source, memory_limit, offset):
+        rows_read = name_basics.shape[0]
+        count_in(name_basics.shape[0])
+        name_basics, invalid = parse_id_columns(name_basics, {'nconst': 'nm'})
+        reject('invalid id', invalid)
+
+        # Let's gather only actor and actress born after 1940 to limit the file size
+        born = name_basics['birthYear'] >= 1940
+        reject('born before 1940 or unknown', (~born).sum())
+        name_basics = name_basics[born]
+
+        actor = name_basics['primaryProfession'].str.contains('actor|actress', na=False)
+        reject('not an actor', (~actor).sum())
+        name_basics = name_basics[actor]
+        name_basics = name_basics.drop(['primaryProfession'], axis = 1)
+
+        name_basics = name_basics.rename(columns={
+            'nconst': 'nconst',
+            'primaryName': 'primary_name',
+            'birthYear': 'birth_year',
+            'deathYear': 'death_year'
+        })
+        name_basics.attrs['rows_read'] = rows_read
+        yield name_basics
+
+
+@cached_preprocess('title.basics')
+def preprocess_movies(engine, test, source = None, memory_limit = MEMORY_LIMIT, offset = 0):
+    """Stream title.basics.tsv or test_title.csv chunk by chunk, rename columns and filter only movie type.
 
     Args:
         engine (sqlalchemy.orm.engine): Engine to connect to database.
         test (bool): if True, use the test table in test_small_db repository. Allow to test functions on small database.
+        source (str, optional): Local mirror directory or base URL of the dumps. Defaults to None.
+        memory_limit (float, optional): Memory budget in MB for one chunk. Defaults to MEMORY_LIMIT.
+        offset (int, optional): Number of rows of the dump to skip, ie already loaded. Defaults to 0.
 
-    Returns:
-        pd.DataFrame: filtered and cleaned DataFrame
+    Yields:
+        pd.DataFrame: filtered and cleaned chunk. attrs['rows_read'] is the number of rows of the dump it comes from.
     """
-    if test :
-        title_ratings = pd.read_csv('test_small_db/test_rating.csv', sep = ';', na_values = '\\N')
-    else : 
-        url = "https://datasets.imdbws.com/title.ratings.tsv.gz"
-        title_ratings = pd.read_csv(url, sep = '\t', na_values = '\\N', compression = "gzip")
+    for title_basics in read_dump('title.basics', test, source, memory_limit, offset):
+        rows_read = title_basics.shape[0]
+        count_in(title_basics.shape[0])
+        title_basics, invalid = parse_id_columns(title_basics, {'tconst': 'tt'})
+        reject('invalid id', invalid)
+
+        # Let's collect only the movies
+        movie = title_basics['titleType'] == 'movie'
+        reject('not a movie', (~movie).sum())
+        title_basics = title_basics[movie]
+        title_basics = title_basics.drop(['titleType'], axis = 1)
+
+        # If not a number, convert into Nan
+        for column in ['isAdult', 'startYear', 'runtimeMinutes']:
+            title_basics[column] = pd.to_numeric(title_basics[column], errors = 'coerce')
+
+        title_basics = title_basics.rename(columns={
+            'tconst': 'tconst',
+            'primaryTitle': 'primary_title',
+            'originalTitle': 'original_title',
+            'isAdult': 'is_adult',
+            'startYear': 'start_year',
+            'runtimeMinutes': 'run_time_minutes'
+        })
+        title_basics.attrs['rows_read'] = rows_read
+        yield title_basics
+
+
+@cached_preprocess('title.ratings')
+def preprocess_ratings(engine, test, source = None, memory_limit = MEMORY_LIMIT, offset = 0):
+    """Stream title.ratings.tsv or test_ratings.csv chunk by chunk, rename columns and compute the score of each movie.
 
-    title_ratings = title_ratings.rename(columns={
-        'tconst': 'tconst',
-        'averageRating': 'average_rating',
-        'numVotes': 'num_votes'
-    })  
+    Args:
+        engine (sqlalchemy.orm.engine): Engine to connect to database.
+        test (bool): if True, use the test table in test_small_db repository. Allow to test functions on small database.
+        source (str, optional): Local mirror directory or base URL of the dumps. Defaults to None.
+        memory_limit (float, optional): Memory budget in MB for one chunk. Defaults to MEMORY_LIMIT.
+        offset (int, optional): Number of rows of the dump to skip, ie already loaded. Defaults to 0.
+
+    Yields:
+        pd.DataFrame: cleaned chunk. attrs['rows_read'] is the number of rows of the dump it comes from.
+    """
+    for title_ratings in read_dump('title.ratings', test, source, memory_limit, offset):
+        rows_read = title_ratings.shape[0]
+        count_in(title_ratings.shape[0])
+        title_ratings, invalid = parse_id_columns(title_ratings, {'tconst': 'tt'})
+        reject('invalid id', invalid)
+        title_ratings = title_ratings.rename(columns={
+            'tconst': 'tconst',
+            'averageRating': 'average_rating',
+            'numVotes': 'num_votes'
+        })
+        title_ratings['score'] = title_ratings['num_votes']*title_ratings['average_rating']
+        title_ratings.attrs['rows_read'] = rows_read
+        yield title_ratings
+
+
+def played_in_blocks(test, source = None, memory_limit = MEMORY_LIMIT, offset = 0):
+    """Blocks of title.principals to give to filter_played_in : paths of its chunks in the preprocessing cache
+    if it is there, raw blocks of lines otherwise.
 
-    return title_ratings
+    Args:
+        test (bool): if True, use the test table in test_small_db repository.
+        source (str, optional): Local mirror directory or base URL of the dumps. Defaults to None.
+        memory_limit (float, optional): Memory budget in MB for one chunk. Defaults to MEMORY_LIMIT.
+        offset (int, optional): Number of rows of the dump to skip, ie already loaded. Defaults to 0.
 
+    Returns:
+        iterable : Blocks, paths or bytes
+        chunk_cache.Chunk_cache : Cache to fill while filtering raw blocks, None if there is nothing to fill
+    """
+    cache = dump_cache('title.principals', filter_played_in, test, source, memory_limit)
+    parts = cache.parts(offset) if cache is not None else None
+    if parts is not None:
+        return parts, None
+    # Only a whole read of the dump can be cached
+    return read_blocks('title.principals', test, source, memory_limit, offset), None if offset else cache
 
-def preprocess_played_in(engine, test):
-    """Load DataFrame from title.principals.tsv or test_ratings.csv, extract existing movies and actors from database.
+
+def preprocess_played_in(engine, test, source = None, memory_limit = MEMORY_LIMIT, offset = 0):
+    """Split title.principals.tsv or test_played_in.csv in blocks (see played_in_blocks), extract existing movies and actors from database.
+    Ids are returned as pd.Index : their hash table is built once and then reused for every lookup.
 
     Args:
         engine (sqlalchemy.orm.engine): Engine to connect to database.
         test (bool): if True, use the test table in test_small_db repository. Allow to test functions on small database.
+        source (str, optional): Local mirror directory or base URL of the dumps. Defaults to None.
+        memory_limit (float, optional): Memory budget in MB for one chunk. Defaults to MEMORY_LIMIT.
+        offset (int, optional): Number of rows of the dump to skip, ie already loaded. Defaults to 0.
 
     Returns:
-        TextFileReader : DataFrames split in chunks
-        list : List of existing movies from database
-        list : List of existing actors from database
+        iterable : Blocks, raw lines to parse with read_args or paths of cached chunks
+        dict : Arguments to give to pd.read_csv to parse a block
+        pd.Index : Index of existing movies from database
+        pd.Index : Index of existing actors from database
+        chunk_cache.Chunk_cache : Cache to fill while filtering the blocks, or None
     """
-    if test :
-        chunksize = 3
-        title_principals = pd.read_csv('test_small_db/test_played_in.csv', sep=';', na_values='\\N', chunksize = chunksize)
-    else :
-        chunksize = 100000
-        title_principals = pd.read_csv('https://datasets.imdbws.com/title.principals.tsv.gz', compression = 'gzip', sep = '\t', na_values = '\\N', chunksize = chunksize)
+    title_principals, cache = played_in_blocks(test, source, memory_limit, offset)
+    read_args = dump_source('title.principals', test, source)[1]
+    read_args.pop('compression', None)
     
     Session = sessionmaker(bind = engine)
     session = Session()
 
-    existing_movie_ids = [movie[0] for movie in session.query(Movie.tconst).all()]
-    existing_actor_ids = [actor[0] for actor in session.query(Actor.nconst).all()]
+    existing_movie_ids = pd.Index([movie[0] for movie in session.query(Movie.tconst).all()])
+    existing_actor_ids = pd.Index([actor[0] for actor in session.query(Actor.nconst).all()])
 
     session.close()
 
-    return title_principals, existing_movie_ids, existing_actor_ids
+    return title_principals, read_args, existing_movie_ids, existing_actor_ids, cache
+
+
+# Filled once in each worker process of load_played_in, to avoid sending ids with every block
+played_in_worker = {}
+
+
+def init_played_in_worker(read_args, existing_movie_ids, existing_actor_ids):
+    """Store parsing arguments and id indexes in the worker process. Called once when the worker starts.
+
+    Args:
+        read_args (dict): Arguments to give to pd.read_csv to parse a block.
+        existing_movie_ids (pd.Index): Index of existing movies from database.
+        existing_actor_ids (pd.Index): Index of existing actors from database.
+    """
+    played_in_worker.update(read_args = read_args, movies = existing_movie_ids, actors = existing_actor_ids)
+
+
+def filter_played_in(block, part = None):
+    """Parse a raw block of title.principals in a worker process and keep only actors/actress
+    of movies and actors already referenced on corresponding tables.
+    Parsed rows of actors are stored in the preprocessing cache before being filtered by ids, which change between builds.
+
+    Args:
+        block (bytes or str): Header and block of lines, or path of a chunk of the preprocessing cache.
+        part (str, optional): Path where to store the parsed block in the preprocessing cache. Defaults to None.
+
+    Returns:
+        int : Id of the worker process
+        int : Number of parsed rows
+        pd.DataFrame : Filtered rows, with columns actor and movie
+        float : Time spent by the worker on this block, in seconds
+        dict : Number of dropped rows for each reason
+        float : CPU time of the worker on this block, in seconds
+    """
+    start, cpu = time.perf_counter(), time.process_time()
+    if isinstance(block, str):
+        chunk = read_frame(block)
+        nb_rows, rejected = chunk.attrs['rows_read'], dict(chunk.attrs['rejected'])
+    else :
+        try:
+            chunk = pd.read_csv(io.BytesIO(block), **played_in_worker['read_args'])
+            nb_rows = chunk.shape[0]
+            actor = chunk['category'].isin(['actor', 'actress'])
+            rejected = {'not an actor': int((~actor).sum())}
+            chunk, invalid = parse_id_columns(chunk.loc[actor, ['tconst', 'nconst']], {'tconst': 'tt', 'nconst': 'nm'})
+            if invalid:
+                rejected['invalid id'] = invalid
+        except (pd.errors.ParserError, ValueError) as e:
+            # The whole block is dropped, but the load goes on and its lines are still counted as read
+            nb_rows = block.count(b'\n') - 1 + (not block.endswith(b'\n'))
+            print(f"Error : {e}, {nb_rows} rows not loaded")
+            chunk = pd.DataFrame({'tconst': pd.Series(dtype = object), 'nconst': pd.Series(dtype = object)})
+            rejected = {'unreadable block': nb_rows}
+        if part is not None:
+            write_frame(chunk, part, nb_rows, rejected)
+
+    # get_indexer returns -1 for unknown ids
+    known_actor = played_in_worker['actors'].get_indexer(chunk['nconst']) >= 0
+    known_movie = played_in_worker['movies'].get_indexer(chunk['tconst']) >= 0
+    rejected.update({'unknown actor': int((~known_actor).sum()), 'unknown movie': int((known_actor & ~known_movie).sum())})
+    chunk = chunk[known_actor & known_movie]
+
+    kept = chunk.shape[0]
+    chunk = chunk.drop_duplicates()
+    rejected['duplicate'] = kept - chunk.shape[0]
+    chunk = chunk.rename(columns={
+        'tconst': 'movie',
+        'nconst': 'actor',
+    })
+
+    return os.getpid(), nb_rows, chunk[['actor', 'movie']], time.perf_counter() - start, rejected, time.process_time() - cpu
+
 
+def filter_played_in_parallel(title_principals, read_args, existing_movie_ids, existing_actor_ids, workers = None, cache = None):
+    """Parse and filter blocks of title.principals with several worker processes.
+    Ids are sent once to each worker. Only a few blocks are waiting at the same time to keep memory bounded.
 
+    Args:
+        title_principals (iterable): Blocks, as returned by played_in_blocks.
+        read_args (dict): Arguments to give to pd.read_csv to parse a block.
+        existing_movie_ids (pd.Index): Index of movies to keep.
+        existing_actor_ids (pd.Index): Index of actors to keep.
+        workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+        cache (chunk_cache.Chunk_cache, optional): Cache where workers store the parsed blocks. It is committed
+          once every block is filtered. Defaults to None.
+
+    Yields:
+        Future: Result of filter_played_in for each block, in the same order as in the file
+    """
+    workers = workers or os.cpu_count()
+    # Other stages may be running in threads of this process : forking it could copy a lock held by one of them
+    context = multiprocessing.get_context('forkserver') if 'forkserver' in multiprocessing.get_all_start_methods() else None
+
+    if cache is not None:
+        cache.start()
+    try:
+        with ProcessPoolExecutor(workers, mp_context = context, initializer = init_played_in_worker,
+                                 initargs = (read_args, existing_movie_ids, existing_actor_ids)) as executor:
+            pending = deque()
+            for block in title_principals:
+                part = cache.new_part() if cache is not None else None
+                pending.append(executor.submit(filter_played_in, block, part))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft()
+            while pending:
+                yield pending.popleft()
+        if cache is not None:
+            cache.commit()
+    finally:
+        if cache is not None:
+            cache.discard()
+
+
+
+def create_bulk_engine(path):
+    """Create an engine whose connections all use BULK_PRAGMAS, to load a large amount of data quickly.
+
+    Args:
+        path (str): Database URL (ie 'sqlite:///database.db').
+
+    Returns:
+        sqlalchemy.engine.Engine: Engine to connect to database.
+    """
+    engine = create_engine(path)
+
+    @event.listens_for(engine, 'connect')
+    def set_bulk_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in BULK_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+        cursor.close()
+
+    return engine
+
+
+def create_tables(engine, indexes = True):
+    """Create every table of models.py.
+
+    Args:
+        engine (sqlalchemy.orm.engine): Engine to connect to database.
+        indexes (bool, optional): if False, secondary indexes are not created, so that they are not maintained row by row
+          during a bulk load. They have to be built afterwards with create_indexes. Defaults to True.
+    """
+    if indexes :
+        Base.metadata.create_all(bind = engine)
+        return
 
-def load_ratings(engine, test = False):
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            connection.execute(CreateTable(table, if_not_exists = True))
+
+
+@measure_stage('indexes')
+def create_indexes(engine):
+    """Build every index declared in models.py once the data is loaded, then collect statistics for the query planner.
+
+    Args:
+        engine (sqlalchemy.orm.engine): Engine to connect to database.
+    """
+    print("index creation...")
+    with writing(engine) as connection:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(connection, checkfirst = True)
+        connection.exec_driver_sql("ANALYZE")
+
+
+# Columns added to the models after databases were already built, with the SQL expression filling them in these databases
+COLUMN_BACKFILLS = {
+    ('movie_ratings', 'score'): "num_votes * average_rating",
+}
+
+
+def upgrade_schema(engine):
+    """Bring a database built with an older models.py up to date, so that it can be refreshed instead of rebuilt :
+    missing tables are created, missing columns are added and filled (see COLUMN_BACKFILLS) and missing indexes are built.
+
+    Args:
+        engine (sqlalchemy.orm.engine): Engine to connect to database.
+
+    Returns:
+        list: Columns added, as 'table.column'
+    """
+    added = []
+    with writing(engine) as connection:
+        for table in Base.metadata.sorted_tables:
+            if not engine.dialect.has_table(connection, table.name):
+                table.create(connection)
+                continue
+            existing = {row[1] for row in connection.exec_driver_sql(f"PRAGMA table_info({table.name})")}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}")
+                if (table.name, column.name) in COLUMN_BACKFILLS:
+                    connection.exec_driver_sql(f"UPDATE {table.name} SET {column.name} = {COLUMN_BACKFILLS[(table.name, column.name)]}")
+                added.append(f"{table.name}.{column.name}")
+            for index in table.indexes:
+                index.create(connection, checkfirst = True)
+    if added:
+        print(f"Columns added to the database : {', '.join(added)}")
+    return added
+
+
+def enable_wal(engine):
+    """Switch the database to WAL journal mode (persistent in the file), so that the API can keep reading while a loader writes.
+
+    Args:
+        engine (sqlalchemy.orm.engine): Engine to connect to database.
+    """
+    with engine.connect() as connection:
+        connection.exec_driver_sql("PRAGMA journal_mode = WAL")
+
+
+def bump_data_version(connection):
+    """Increase the version stamp of the data (stored as PRAGMA user_version), to tell the API that cached responses are outdated.
+    Called by loaders once new data is committed.
+
+    Args:
+        connection (sqlalchemy.engine.Connection): Connection to the database.
+
+    Returns:
+        int: New version of the data
+    """
+    version = connection.exec_driver_sql("PRAGMA user_version").scalar() + 1
+    connection.exec_driver_sql(f"PRAGMA user_version = {version}")
+    return version
+
+
+@contextmanager
+def writing(engine):
+    """Open a write transaction, once the other writers of this process have finished theirs.
+    Chunks are read and parsed outside of it, so that only the writes wait.
+
+    Args:
+        engine (sqlalchemy.orm.engine): Engine to connect to database.
+
+    Yields:
+        sqlalchemy.engine.Connection: Connection to the database, inside a transaction
+    """
+    with WRITE_LOCK, engine.begin() as connection:
+        yield connection
+
+
+def execute_rows(connection, statement, frame, batch_size = BATCH_SIZE):
+    """Execute a statement with ? placeholders for each row of a DataFrame, with batched executemany.
+
+    Args:
+        connection (sqlalchemy.engine.Connection): Connection to the database, inside a transaction.
+        statement (str): SQL statement, with one ? per column of frame.
+        frame (pd.DataFrame): Parameters of the statement, one row per execution.
+        batch_size (int, optional): Number of rows sent in one executemany. Defaults to BATCH_SIZE.
+
+    Returns:
+        int: Number of rows changed by the statements
+    """
+    # The driver only knows Python types, and None for missing values
+    rows = frame.astype(object).where(frame.notna(), None).itertuples(index = False, name = None)
+
+    changed = 0
+    while batch := list(islice(rows, batch_size)):
+        changed += connection.exec_driver_sql(statement, batch).rowcount
+    return changed
+
+
+def insert_rows(connection, table, frame, batch_size = BATCH_SIZE, or_ignore = False):
+    """Append a DataFrame to a table with batched executemany, using an already opened connection.
+
+    Args:
+        connection (sqlalchemy.engine.Connection): Connection to the database, inside a transaction.
+        table (str): Name of the table.
+        frame (pd.DataFrame): Rows to insert, columns named as in the table.
+        batch_size (int, optional): Number of rows sent in one executemany. Defaults to BATCH_SIZE.
+        or_ignore (bool, optional): Skip rows whose key is already in the table instead of failing. Defaults to False.
+    """
+    if frame.empty:
+        return
+
+    verb = "INSERT OR IGNORE" if or_ignore else "INSERT"
+    statement = f"{verb} INTO {table} ({', '.join(frame.columns)}) VALUES ({', '.join(['?'] * frame.shape[1])})"
+    with step(f'insert {table}'):
+        inserted = execute_rows(connection, statement, frame, batch_size)
+    count_out(table, inserted)
+    reject(f'already in {table}', frame.shape[0] - inserted)
+
+
+def insert_frame(engine, table, frame, batch_size = BATCH_SIZE):
+    """Append a DataFrame to a table with batched executemany, all in one transaction taken with writing.
+
+    Args:
+        engine (sqlalchemy.orm.engine): Engine to connect to database.
+        table (str): Name of the table.
+        frame (pd.DataFrame): Rows to insert, columns named as in the table.
+        batch_size (int, optional): Number of rows sent in one executemany. Defaults to BATCH_SIZE.
+    """
+    if frame.empty:
+        return
+
+    with writing(engine) as connection:
+        insert_rows(connection, table, frame, batch_size)
+
+
+
+def read_checkpoints(engine):
+    """Read the progress of the current build.
+
+    Args:
+        engine (sqlalchemy.orm.engine): Engine to connect to database.
+
+    Returns:
+        dict: (rows_done, done) for each stage already started, empty if there is no checkpoint table
+    """
+    with engine.connect() as connection:
+        if not engine.dialect.has_table(connection, Build_checkpoint.__tablename__):
+            return {}
+        rows = connection.execute(select(Build_checkpoint.stage, Build_checkpoint.rows_done, Build_checkpoint.done))
+        return {stage: (rows_done or 0, bool(done)) for stage, rows_done, done in rows}
+
+
+def save_checkpoint(connection, stage, rows_done = None, done = False):
+    """Record the progress of a stage, in the transaction of the chunk it describes so that both are committed together.
+
+    Args:
+        connection (sqlalchemy.engine.Connection): Connection to the database, inside a transaction.
+        stage (str): Name of the stage (ie 'movies').
+        rows_done (int, optional): Rows of the dump read and committed so far. Defaults to None (unchanged).
+        done (bool, optional): True once the stage is complete. Defaults to False.
+    """
+    # rows_done is kept when only done changes
+    connection.exec_driver_sql("INSERT INTO build_checkpoints (stage, rows_done, done) VALUES (?, ?, ?) "
+                               "ON CONFLICT (stage) DO UPDATE SET rows_done = coalesce(excluded.rows_done, rows_done), done = excluded.done",
+                               (stage, rows_done, done))
+
+
+def insert_checked(connection, table, frame):
+    """Append a DataFrame to a table like insert_rows, but rows the database refuses (ie duplicated key) don't fail the chunk :
+    the batch is rolled back to a savepoint and inserted again row by row, keeping aside the rows which fail.
+
+    Args:
+        connection (sqlalchemy.engine.Connection): Connection to the database, inside a transaction.
+        table (str): Name of the table.
+        frame (pd.DataFrame): Rows to insert, columns named as in the table.
+
+    Returns:
+        pd.DataFrame: Rejected rows, with the error in an extra column
+    """
+    rejected = frame.iloc[:0].assign(error = pd.Series(dtype = object))
+    if frame.empty:
+        return rejected
+
+    connection.exec_driver_sql("SAVEPOINT chunk")
+    try:
+        insert_rows(connection, table, frame)
+        connection.exec_driver_sql("RELEASE chunk")
+        return rejected
+    except (exc.IntegrityError, exc.InterfaceError, exc.DataError):
+        connection.exec_driver_sql("ROLLBACK TO chunk")
+        connection.exec_driver_sql("RELEASE chunk")
+
+    # A failing statement doesn't undo the previous ones of the transaction
+    statement = f"INSERT INTO {table} ({', '.join(frame.columns)}) VALUES ({', '.join(['?'] * frame.shape[1])})"
+    errors = {}
+    with step(f'insert {table} row by row'):
+        rows = frame.astype(object).where(frame.notna(), None).itertuples(index = False, name = None)
+        for position, row in enumerate(rows):
+            try:
+                connection.exec_driver_sql(statement, row)
+            except (exc.IntegrityError, exc.InterfaceError, exc.DataError) as e:
+                errors[position] = str(e.orig)
+
+    rejected = frame.iloc[list(errors)].assign(error = list(errors.values()))
+    count_out(table, frame.shape[0] - rejected.shape[0])
+    reject(f'refused by {table}', rejected.shape[0])
+    return rejected
+
+
+def write_rejects(table, rejected, reject_dir = REJECT_DIR):
+    """Append rejected rows to the reject file of a table, to replay them later with replay_rejects.
+
+    Args:
+        table (str): Name of the table.
+        rejected (pd.DataFrame): Rows returned by insert_checked.
+        reject_dir (str, optional): Directory of the reject files. Defaults to REJECT_DIR.
+    """
+    if rejected.empty:
+        return
+
+    os.makedirs(reject_dir, exist_ok = True)
+    path = os.path.join(reject_dir, f'{table}.csv')
+    rejected.to_csv(path, sep = ';', index = False, mode = 'a', header = not os.path.exists(path))
+    print(f"{rejected.shape[0]} rows rejected by {table}, written in {path}")
+
+
+def replay_rejects(engine, reject_dir = REJECT_DIR):
+    """Try again to insert the rows of every reject file, ie once the cause of the error is fixed.
+    Rows which still fail are kept in the file, with their new error.
+
+    Args:
+        engine (sqlalchemy.orm.engine): Engine to connect to database.
+        reject_dir (str, optional): Directory of the reject files. Defaults to REJECT_DIR.
+
+    Returns:
+        dict: Number of inserted and still rejected rows for each table
+    """
+    summary = {}
+    if not os.path.isdir(reject_dir):
+        return summary
+
+    for file_name in sorted(os.listdir(reject_dir)):
+        table = file_name.removesuffix('.csv')
+        path = os.path.join(reject_dir, file_name)
+        rows = pd.read_csv(path, sep = ';', dtype = object).drop(columns = ['error'])
+
+        rejected_pairs = None
+        with writing(engine) as connection:
+            # Movies come with their genres (see insert_movies)
+            if table == 'movies' and 'genres' in rows.columns:
+                rejected, rejected_pairs = insert_movies(connection, rows)
+            else :
+                rejected = insert_checked(connection, table, rows)
+        os.remove(path)
+        write_rejects(table, rejected, reject_dir)
+        if rejected_pairs is not None:
+            write_rejects('movie_genre', rejected_pairs, reject_dir)
+
+        summary[table] = {'inserted': rows.shape[0] - rejected.shape[0], 'rejected': rejected.shape[0]}
+        print(f"{table} : {summary[table]['inserted']} rows inserted, {summary[table]['rejected']} still rejected")
+    return summary
+
+
+@measure_stage('ratings')
+def load_ratings(engine, test = False, source = None, memory_limit = MEMORY_LIMIT, offset = 0):
     """Load data to fill movie_ratings table.
     Check if the film is well referenced on the movies table before adding it to movie_ratings table.
+    Each chunk is committed with its checkpoint, so that the load can restart after the last committed chunk.
 
     Args:
         engine (sqlalchemy.orm.engine): Engine to connect to database.
         test (bool, optional): if True, use the test table in test_small_db repository. Allow to test functions on small database.
           Defaults to False.
+        source (str, optional): Local mirror directory or base URL of the dumps. Defaults to None.
+        memory_limit (float, optional): Memory budget in MB for one chunk. Defaults to MEMORY_LIMIT.
+        offset (int, optional): Rows of the dump already loaded by a previous run. Defaults to 0.
     """
 
-    # Use preprocessing function to set up the DataFrame
-    title_ratings = preprocess_ratings(engine, test)
-
     Session = sessionmaker(bind = engine)
     session = Session()
 
     # We only want to add ratings for movie already presents on the table movie
     movie_ids = [row[0] for row in session.query(Movie.tconst).all()]
-    title_ratings = title_ratings[title_ratings['tconst'].isin(movie_ids)]
+    session.close()
 
     print("rating table creation...")
-    title_ratings.to_sql('movie_ratings', con = engine, if_exists = 'append', index = False)
+    # Use preprocessing function to stream the cleaned chunks
+    with closing(prefetch(preprocess_ratings(engine, test, source, memory_limit, offset))) as chunks:
+        for title_ratings in tqdm(timed(chunks, 'read'), desc = 'Ratings chunks'):
+            offset += title_ratings.attrs['rows_read']
+            known = title_ratings['tconst'].isin(movie_ids)
+            reject('unknown movie', (~known).sum())
+            title_ratings = title_ratings[known]
 
-    session.commit()
-    session.close()
+            with writing(engine) as connection:
+                rejected = insert_checked(connection, 'movie_ratings', title_ratings)
+                save_checkpoint(connection, 'ratings', offset)
+            write_rejects('movie_ratings', rejected)
 
 
 
-def load_actors_not_used(engine, test = False):
-    """Load data to fill actors table and played_in table.
-   For each actor, extract movies from its attibutes to link actors and movies in played_in table.
+@measure_stage('actors')
+def load_actors(engine, test = False, source = None, memory_limit = MEMORY_LIMIT, offset = 0):
+    """Load data to fill actors table. Each chunk is committed with its checkpoint.
 
     Args:
-        engine (sqlalchemy.orm.engine): Engine to connect to database.        
+        engine (sqlalchemy.orm.engine): Engine to connect to database.
         test (bool, optional): if True, use the test table in test_small_db repository. Allow to test functions on small database.
           Defaults to False.
+        source (str, optional): Local mirror directory or base URL of the dumps. Defaults to None.
+        memory_limit (float, optional): Memory budget in MB for one chunk. Defaults to MEMORY_LIMIT.
+        offset (int, optional): Rows of the dump already loaded by a previous run. Defaults to 0.
     """
+    with closing(prefetch(preprocess_actors(engine, test, source, memory_limit, offset))) as chunks:
+        for name_basics in tqdm(timed(chunks, 'read'), desc = 'Actors chunks'):
+            offset += name_basics.attrs['rows_read']
+            name_basics = name_basics.drop(['knownForTitles'], axis = 1)
 
-    # Call preprocessing function to set up the DataFrame
-    name_basics = preprocess_actors(engine, test)
-
-    Session = sessionmaker(bind = engine)
-    session = Session()
+            with writing(engine) as connection:
+                rejected = insert_checked(connection, 'actors', name_basics)
+                save_checkpoint(connection, 'actors', offset)
+            write_rejects('actors', rejected)
 
-    # Using a cache to reduce interaction with the database
-    existing_movie_ids = {movie.tconst: movie for movie in session.query(Movie).all()}
-
-    # Movie extraction from actors : we only want to consider movies already referenced on the table movie. 
-    # We compare its id with the previous dict.
-    for i, row in tqdm(name_basics.iterrows(), desc = 'Association movie-actor', total = name_basics.shape[0]):
-        acteur = Actor(nconst = row['nconst'], primary_name = row['primary_name'], 
-                       birth_year = row['birth_year'], death_year = row['death_year'])
-        if pd.notna(row['knownForTitles']): 
-            film_ids = row['knownForTitles'].split(",")
-            for film_id in film_ids:
-                film_id = film_id.strip()
-                existing_movie = existing_movie_ids.get(film_id)
-                if existing_movie:
-                    acteur.movies.append(existing_movie)
-        
-        session.add(acteur)
-
-        # Commit data every 5000 iterations
-        if i%5000 == 0 : 
-            session.commit()
-    
-    session.commit()
-    session.close()
 
 
-def load_actors(engine, test = False):
-    """Load data to fill actors table.
+def known_for_edges(name_basics, existing_movie_ids, existing_actor_ids):
+    """Split the knownForTitles list of each actor into pairs actor-movie, and keep only movies and actors
+    already referenced on corresponding tables.
 
     Args:
-        engine (sqlalchemy.orm.engine): Engine to connect to database.
-        test (bool, optional): if True, use the test table in test_small_db repository. Allow to test functions on small database.
-          Defaults to False.
+        name_basics (pd.DataFrame): Cleaned chunk of name.basics, with its knownForTitles column.
+        existing_movie_ids (pd.Index): Index of movies to keep.
+        existing_actor_ids (pd.Index): Index of actors to keep.
+
+    Returns:
+        pd.DataFrame : Pairs, with columns actor and movie
+        dict : Number of dropped pairs for each reason
     """
-    name_basics = preprocess_actors(engine, test)
-    name_basics = name_basics.drop(['knownForTitles'], axis = 1)
+    pairs = name_basics[['nconst', 'knownForTitles']].dropna(subset = ['knownForTitles'])
+    pairs = pairs.assign(knownForTitles = pairs['knownForTitles'].str.split(',')).explode('knownForTitles')
+    pairs = pairs.rename(columns = {'nconst': 'actor', 'knownForTitles': 'movie'})
+    # Invalid ids are NaN, so they are unknown movies
+    pairs['movie'] = parse_ids(pairs['movie'].str.strip(), 'tt')
 
-    Session = sessionmaker(bind = engine)
-    session = Session()
+    # get_indexer returns -1 for unknown ids
+    known_actor = existing_actor_ids.get_indexer(pairs['actor']) >= 0
+    known_movie = existing_movie_ids.get_indexer(pairs['movie']) >= 0
+    rejected = {'unknown actor': int((~known_actor).sum()), 'unknown movie': int((known_actor & ~known_movie).sum())}
+    pairs = pairs[known_actor & known_movie]
 
-    name_basics.to_sql('actors', con = engine, if_exists = 'append', index = False)
+    pairs = pairs.astype({'movie': pairs['actor'].dtype})
 
+    kept = pairs.shape[0]
+    pairs = pairs.drop_duplicates()
+    rejected['duplicate'] = kept - pairs.shape[0]
+    return pairs.reset_index(drop = True), rejected
 
 
-def load_played_in(engine, test = False):
-    """Load data to fill played_in table. Use of batches to fill the table since the raw file is too large.
+@measure_stage('known_for')
+def load_known_for(engine, test = False, source = None, memory_limit = MEMORY_LIMIT, offset = 0):
+    """Add to played_in table the movies each actor is known for (knownForTitles of name.basics).
+    Most of them are already there from title.principals : pairs are inserted with INSERT OR IGNORE, so played_in
+    ends up with the union of both without duplicates. Each chunk is committed with its checkpoint.
 
     Args:
         engine (sqlalchemy.orm.engine): Engine to connect to database.
         test (bool, optional): if True, use the test table in test_small_db repository. Allow to test functions on small database.
           Defaults to False.
+        source (str, optional): Local mirror directory or base URL of the dumps. Defaults to None.
+        memory_limit (float, optional): Memory budget in MB for one chunk. Defaults to MEMORY_LIMIT.
+        offset (int, optional): Rows of the dump already loaded by a previous run. Defaults to 0.
     """
-    title_principals, existing_movie_ids, existing_actor_ids = preprocess_played_in(engine, test)
-    nb_errors = 0
+    with step('read ids'), engine.connect() as connection:
+        existing_movie_ids = pd.Index(connection.execute(select(Movie.tconst)).scalars().all())
+        existing_actor_ids = pd.Index(connection.execute(select(Actor.nconst)).scalars().all())
+
+    print("known for association...")
+    with closing(prefetch(preprocess_actors(engine, test, source, memory_limit, offset))) as chunks:
+        for name_basics in tqdm(timed(chunks, 'read'), desc = 'Known for chunks'):
+            offset += name_basics.attrs['rows_read']
+            with step('explode titles'):
+                pairs, rejected = known_for_edges(name_basics, existing_movie_ids, existing_actor_ids)
+            for reason, count in rejected.items():
+                reject(reason, count)
+
+            with writing(engine) as connection:
+                insert_rows(connection, 'played_in', pairs, or_ignore = True)
+                save_checkpoint(connection, 'known_for', offset)
+
+
+@measure_stage('played_in')
+def load_played_in(engine, test = False, source = None, memory_limit = MEMORY_LIMIT, workers = None, offset = 0):
+    """Load data to fill played_in table. Use of batches to fill the table since the raw file is too large.
+    Batches are parsed and filtered by several worker processes, and written in their order by this process only,
+    each one with its checkpoint. Rows refused by the database are written in the reject file.
 
-    # Iteration on each batch with filtering actors/actress, movies and actors already referenced on corresponding tables
-    for i, chunk in enumerate(tqdm(title_principals, desc = "Chunks treatment")):
-        try:
-            chunk = chunk[(chunk['category'].str.contains('actor|actress', case=False, na=False)) & 
-                          (chunk['nconst'].isin(existing_actor_ids)) & 
-                          (chunk['tconst'].isin(existing_movie_ids))]
-            
-            chunk = chunk.drop(['ordering', 'category', 'job', 'characters'], axis = 1)
-            chunk = chunk.drop_duplicates()
-            chunk = chunk.rename(columns={
-                'tconst': 'movie',
-                'nconst': 'actor',
-            })
+    Args:
+        engine (sqlalchemy.orm.engine): Engine to connect to database.
+        test (bool, optional): if True, use the test table in test_small_db repository. Allow to test functions on small database.
+          Defaults to False.
+        source (str, optional): Local mirror directory or base URL of the dumps. Defaults to None.
+        memory_limit (float, optional): Memory budget in MB for one chunk. Defaults to MEMORY_LIMIT.
+        workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+        offset (int, optional): Rows of the dump already loaded by a previous run. Defaults to 0.
+    """
+    with step('read ids'):
+        title_principals, read_args, existing_movie_ids, existing_actor_ids, cache = preprocess_played_in(engine, test, source,
+                                                                                                          memory_limit, offset)
+    worker_stats = {}
+
+    # Blocks are written by this process only, in the same order as in the file. The next ones are read while writing.
+    with closing(filter_played_in_parallel(prefetch(title_principals), read_args, existing_movie_ids, existing_actor_ids,
+                                           workers, cache)) as futures:
+        # Waiting for a block includes reading it and, when workers are late, their parsing and filtering
+        for future in tqdm(timed(futures, 'wait workers'), desc = "Chunks treatment"):
+            pid, nb_rows, chunk, duration, rejected, cpu = future.result()
+            # Workers are other processes : their CPU time is only known from what they report
+            add_cpu(cpu)
+            rows, seconds, cpu_seconds = worker_stats.get(pid, (0, 0, 0))
+            worker_stats[pid] = (rows + nb_rows, seconds + duration, cpu_seconds + cpu)
+            count_in(nb_rows)
+            for reason, count in rejected.items():
+                reject(reason, count)
+
+            offset += nb_rows
+            with writing(engine) as connection:
+                rejected = insert_checked(connection, 'played_in', chunk)
+                save_checkpoint(connection, 'played_in', offset)
+            write_rejects('played_in', rejected)
+
+    for pid, (rows, seconds, cpu_seconds) in worker_stats.items():
+        print(f"Worker {pid} : {rows} rows in {seconds:.2f} s ({rows / max(seconds, 1e-9):,.0f} rows/s)")
+    record(workers = {str(pid): {'rows': rows, 'wall_s': round(seconds, 3), 'cpu_s': round(cpu_seconds, 3)}
+                      for pid, (rows, seconds, cpu_seconds) in worker_stats.items()})
+
+
+
+def explode_genres(title_basics):
+    """Split the genres list of each movie into one row per pair movie-genre.
+    Lists like "Drama, Romantic" are also handled : names are stripped.
 
-            #print(i, chunk.head())
-            chunk.to_sql('played_in', con = engine, if_exists = 'append', index = False)
+    Args:
+        title_basics (pd.DataFrame): Cleaned DataFrame containing information about movies.
 
-        except Exception as e:
-            nb_errors = nb_errors + chunk.shape[0]
-            print(f"Error : {e}, Chunk : {chunk.head()}, Nombre de lignes non-insérées : {nb_errors}")
+    Returns:
+        pd.DataFrame: pairs with columns movie and name, in the order of title_basics.
+    """
+    pairs = title_basics[['tconst', 'genres']].dropna(subset = ['genres'])
+    pairs = pairs.assign(genres = pairs['genres'].str.split(',')).explode('genres')
+    pairs['genres'] = pairs['genres'].str.strip()
+    pairs = pairs.rename(columns = {'tconst': 'movie', 'genres': 'name'})
 
+    return pairs.drop_duplicates().reset_index(drop = True)
 
 
-def associate_movie_genre(engine, title_basics):
+def associate_movie_genre(connection, title_basics):
     """Link movie and its genres from title_basics DataFrame. 
-    For a movie, if one of its genre is already referenced in genres table, we just add it to the movie as an attributes. 
-    If it doesn't references, we add it in genres table, we collect its new id and we add it to the movie as an attributes.
+    Genres not already referenced in genres table are added in one bulk insert, in order of first appearance.
+    Then genre names are replaced by their id with a vectorized mapping.
 
     Args:
-        engine (sqlalchemy.orm.engine): Engine to connect to database.
+        connection (sqlalchemy.engine.Connection): Connection to the database, inside the transaction of the chunk.
         title_basics (pd.DataFrame): Cleaned DataFrame containing information about movies.
 
     Returns:
-        asso (List): Return list of dictionnary which contains pairs movie-genre.
+        asso (pd.DataFrame): Return DataFrame which contains pairs movie-genre.
     """
+    with step('explode genres'):
+        pairs = explode_genres(title_basics)
 
-    Session = sessionmaker(bind = engine)
-    session = Session()
-    
     # We want to add genres not already present on the table genres
-    existing_genres = session.query(Genre.id, Genre.name).all()
-    existing_genres = {name: genre_id for genre_id, name in existing_genres}
-    asso = []
-
-    for i, row in tqdm(title_basics.iterrows(), desc = 'Association movie-genre', total = title_basics.shape[0]):
-        film = row['tconst']
-        if pd.notna(row['genres']): 
-            genres = row['genres'].split(",")
-            for genre_name in genres:
-                genre_name = genre_name.strip()
-                existing_id = existing_genres.get(genre_name)
-                # If the genre doesn't exist yet, we add it on the table and we collect its id
-                if existing_id is None:
-                    new_genre = Genre(name = genre_name)
-                    session.add(new_genre)
-                    session.flush()
-                    existing_id = new_genre.id
-                    existing_genres[genre_name] = new_genre.id
-                
-                asso.append({'movie': film, 'genre' : existing_id})
-
-        # Add to the database every 5000 iterations
-        if i%5000 == 0 : session.commit()
-    
-    session.commit()
-    session.close()
+    existing_genres = pd.read_sql(select(Genre.id, Genre.name), connection)
+    new_genres = pairs.loc[~pairs['name'].isin(existing_genres['name']), ['name']].drop_duplicates()
+    if not new_genres.empty:
+        insert_rows(connection, 'genres', new_genres)
+        existing_genres = pd.read_sql(select(Genre.id, Genre.name), connection)
+
+    genre_ids = pd.Series(existing_genres['id'].values, index = existing_genres['name'])
+    asso = pd.DataFrame({'movie': pairs['movie'], 'genre': pairs['name'].map(genre_ids)})
+
     return asso
 
 
-def load_movies(engine, test = False):
+def insert_movies(connection, title_basics):
+    """Insert movies with insert_checked, then their pairs movie-genre.
+    Pairs of the movies the database refuses are not inserted, since foreign keys are not enforced : their genres are
+    kept in the rejected rows, so that replay_rejects inserts them with the movie.
+
+    Args:
+        connection (sqlalchemy.engine.Connection): Connection to the database, inside the transaction of the chunk.
+        title_basics (pd.DataFrame): Cleaned DataFrame containing information about movies, with their genres.
+
+    Returns:
+        pd.DataFrame: Rejected movies, with their genres and the error
+        pd.DataFrame: Rejected pairs movie-genre of the inserted movies
+    """
+    asso = associate_movie_genre(connection, title_basics)
+    rejected_movies = insert_checked(connection, 'movies', title_basics.drop(['genres'], axis = 1))
+
+    # A duplicated movie may be refused once but inserted from another row
+    inserted = title_basics['tconst'].drop(rejected_movies.index)
+    refused = asso['movie'].isin(rejected_movies['tconst']) & ~asso['movie'].isin(inserted)
+    reject('movie refused', int(refused.sum()))
+    rejected_pairs = insert_checked(connection, 'movie_genre', asso[~refused])
+
+    # Rejected rows keep the index of title_basics
+    genres = title_basics.loc[rejected_movies.index, 'genres']
+    rejected_movies = rejected_movies.drop(columns = ['error']).assign(genres = genres, error = rejected_movies['error'])
+    return rejected_movies, rejected_pairs
+
+
+@measure_stage('movies')
+def load_movies(engine, test = False, source = None, memory_limit = MEMORY_LIMIT, offset = 0):
     """Call preprocess and association function, first to clean movies DataFrame, then to extract its genres for each movie.
     Finally, create movie table and movie_genre table, which associate movies and their genres.
+    Genres, movies and pairs of a chunk are committed together with its checkpoint.
 
     Args:
         engine (sqlalchemy.orm.engine): Engine to connect to database.
         test (bool, optional): if True, use the test table in test_small_db repository. Allow to test functions on small database.
           Defaults to False.
+        source (str, optional): Local mirror directory or base URL of the dumps. Defaults to None.
+        memory_limit (float, optional): Memory budget in MB for one chunk. Defaults to MEMORY_LIMIT.
+        offset (int, optional): Rows of the dump already loaded by a previous run. Defaults to 0.
     """
 
-    title_basics = preprocess_movies(engine, test)
-    asso = associate_movie_genre(engine, title_basics)
-    
-    print("movie table creation...")
-    title_basics = title_basics.drop(['genres'], axis = 1)
-    title_basics.to_sql('movies', con = engine, if_exists='append', index=False)
-
-    print("genre table creation...")
-    asso = pd.DataFrame(asso)
-    asso.to_sql('movie_genre', con = engine, if_exists = 'append', index = False)
+    print("movie and genre tables creation...")
+    # The next chunk is read while one is written, so at most PREFETCH_CHUNKS + 1 chunks are in memory at a time
+    with closing(prefetch(preprocess_movies(engine, test, source, memory_limit, offset))) as chunks:
+        for title_basics in tqdm(timed(chunks, 'read'), desc = 'Movies chunks'):
+            offset += title_basics.attrs['rows_read']
+
+            with writing(engine) as connection:
+                rejected_movies, rejected_pairs = insert_movies(connection, title_basics)
+                save_checkpoint(connection, 'movies', offset)
+            write_rejects('movies', rejected_movies)
+            write_rejects('movie_genre', rejected_pairs)
     
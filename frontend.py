@@ -1,5 +1,5 @@
 import streamlit as st
-from app import get_data
+from dashboard_client import load_dashboard
 import pandas as pd
 import plotly.express as px
 import numpy as np
@@ -22,8 +22,14 @@ st.markdown(
 )
 
 
-# Gather data from API and plot the distribution of movie per year
-data = get_data("http://127.0.0.1:8000/perYear")
+# Gather every dataset from API at once (cached until the data changes)
+dashboard = load_dashboard()
+if dashboard is None:
+    st.error("The API can't be reached, the data will be asked again at the next refresh of the page.")
+    st.stop()
+
+# Plot the distribution of movie per year
+data = dashboard["perYear"]
 
 data = pd.DataFrame(data)
 data = data.rename(columns = {'year': 'Year', 'movie_number': 'Movie number'})
@@ -37,8 +43,8 @@ st.bar_chart(data, x_label = 'Year', y_label = "Movie number")
 
 
 
-# Gather data from API and plot the pie chart of movie per genre
-data = get_data("http://127.0.0.1:8000/perGenre")
+# Plot the pie chart of movie per genre
+data = dashboard["perGenre"]
 data = pd.DataFrame(data)
 data = data.rename(columns = {'genre': 'Genre', 'movie_number': 'Movie number'})
 
@@ -53,9 +59,11 @@ fig = px.pie(data, names='Genre', values = 'Movie number')
 st.plotly_chart(fig)
 
 
-# Gather the movie TOP 10 from API
-data_movie = get_data("http://127.0.0.1:8000/movieRating")
-data_movie = pd.DataFrame(data_movie, index = range(1, 11))
+# Movie TOP 10
+data_movie = dashboard["movieRating"]
+data_movie = pd.DataFrame(data_movie)
+# Ranks from 1, the API can give fewer than 10 rows on a small database
+data_movie.index = range(1, len(data_movie) + 1)
 data_movie['score'] = data_movie['score'].apply(np.round).astype('int')
 
 data_movie['score'] = data_movie['score'].apply(lambda x: "{:,}".format(x))
@@ -71,9 +79,10 @@ data_movie = data_movie.style.set_table_styles([
 ])
 
 
-# Gather the actor TOP 10 from API
-data_actors = get_data("http://127.0.0.1:8000/actorRanking")
-data_actors = pd.DataFrame(data_actors, index = range(1, 11))
+# Actor TOP 10
+data_actors = dashboard["actorRanking"]
+data_actors = pd.DataFrame(data_actors)
+data_actors.index = range(1, len(data_actors) + 1)
 data_actors['score'] = data_actors['score'].apply(np.round).astype('int')
 data_actors['num_votes'] = data_actors['num_votes'].apply(np.round).astype('int')
 
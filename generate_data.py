@@ -0,0 +1,258 @@
+import numpy as np
+import pandas as pd
+
+import argparse
+import csv
+import gzip
+import os
+import time
+
+# Size of the other dumps compared to title.basics, close to the real IMDb files
+NAMES_PER_TITLE = 1.25
+RATED_TITLES = 0.14
+PRINCIPALS_PER_TITLE = 8
+
+# Share of the rows with a missing value (\N) in each column
+MISSING = {
+    'startYear': 0.12,
+    'runtimeMinutes': 0.35,
+    'genres': 0.05,
+    'birthYear': 0.80,
+    'deathYear': 0.95,
+    'primaryProfession': 0.20,
+    'knownForTitles': 0.15,
+    'characters': 0.50,
+}
+
+# Share of the rows with a value which is not a number where a number is expected, like in the real dumps
+GARBAGE = 0.001
+
+# Share of title.principals rows repeated with another ordering (same person with several roles in one title)
+DUPLICATE_PRINCIPALS = 0.03
+
+TITLE_TYPES = {
+    'tvEpisode': 0.745, 'short': 0.09, 'movie': 0.065, 'video': 0.025, 'tvSeries': 0.024,
+    'tvMovie': 0.0145, 'tvMiniSeries': 0.006, 'tvSpecial': 0.005, 'videoGame': 0.0035, 'tvShort': 0.002,
+}
+
+GENRES = {
+    'Drama': 0.20, 'Comedy': 0.15, 'Documentary': 0.10, 'Talk-Show': 0.06, 'Romance': 0.05, 'Family': 0.05,
+    'Reality-TV': 0.04, 'Animation': 0.04, 'Action': 0.04, 'Crime': 0.035, 'News': 0.03, 'Adventure': 0.03,
+    'Music': 0.03, 'Game-Show': 0.025, 'Short': 0.02, 'Thriller': 0.02, 'Horror': 0.02, 'Mystery': 0.015,
+    'Fantasy': 0.015, 'History': 0.01, 'Sport': 0.01, 'Sci-Fi': 0.01, 'Biography': 0.01, 'Western': 0.005,
+    'Musical': 0.005, 'War': 0.005, 'Adult': 0.005,
+}
+
+PROFESSIONS = {
+    'actor': 0.30, 'actress': 0.20, 'miscellaneous': 0.10, 'producer': 0.08, 'writer': 0.07,
+    'director': 0.06, 'camera_department': 0.05, 'editor': 0.04, 'composer': 0.04, 'sound_department': 0.03,
+    'cinematographer': 0.03,
+}
+
+CATEGORIES = {
+    'actor': 0.30, 'actress': 0.20, 'self': 0.15, 'director': 0.08, 'writer': 0.08, 'producer': 0.06,
+    'editor': 0.04, 'composer': 0.03, 'cinematographer': 0.03, 'production_designer': 0.01,
+    'casting_director': 0.01, 'archive_footage': 0.01,
+}
+
+# Titles written at once, to keep memory bounded whatever the scale
+CHUNK_TITLES = 500000
+
+COMPRESS_LEVEL = 6
+
+
+def weighted(rng, choices, size):
+    """Draw values from a dict of value: weight."""
+    values = np.array(list(choices))
+    weights = np.array(list(choices.values()))
+    return values[rng.choice(len(values), size = size, p = weights / weights.sum())]
+
+
+def ids(prefix, numbers):
+    """Format IMDb ids, ie tt0000001."""
+    return prefix + pd.Series(numbers).astype(str).str.zfill(7).values
+
+
+def with_missing(rng, values, column):
+    """Replace a share of the values by None, written as \\N."""
+    values = pd.Series(values, dtype = object)
+    values[rng.random(len(values)) < MISSING[column]] = None
+    return values
+
+
+def with_garbage(rng, values, garbage):
+    """Replace a few values by a string which is not a number."""
+    values = pd.Series(values, dtype = object)
+    values[rng.random(len(values)) < GARBAGE] = garbage
+    return values
+
+
+def popular(rng, size, population):
+    """Draw ids with a heavy tail : a few people or titles get most of the roles and votes."""
+    return (rng.pareto(1.1, size) * population / 20).astype(np.int64) % population
+
+
+def join_columns(columns, lengths):
+    """Join the first lengths values of each row of columns with commas."""
+    joined = pd.Series(columns[0], dtype = object)
+    for i, column in enumerate(columns[1:], start = 1):
+        joined = joined + pd.Series(np.where(lengths > i, ',' + column.astype(object), ''), dtype = object)
+    return joined.values
+
+
+def join_lists(rng, choices, size, max_items):
+    """Build comma separated lists of 1 to max_items distinct values, like genres or professions."""
+    lengths = rng.integers(1, max_items + 1, size)
+    columns = [weighted(rng, choices, size)]
+    for i in range(1, max_items):
+        column = weighted(rng, choices, size)
+        # A repeated value ends the list
+        lengths = np.where((lengths > i) & np.any([column == previous for previous in columns], axis = 0), i, lengths)
+        columns.append(column)
+    return join_columns(columns, lengths)
+
+
+def title_basics(rng, start, size):
+    years = np.clip(2025 - rng.exponential(25, size), 1874, 2031).astype(int)
+    title_type = weighted(rng, TITLE_TYPES, size)
+    runtime = np.where(title_type == 'movie', rng.lognormal(4.5, 0.3, size), rng.lognormal(3.2, 0.6, size))
+
+    numbers = np.arange(start, start + size)
+    titles = 'Title ' + pd.Series(numbers).astype(str).values
+    return pd.DataFrame({
+        'tconst': ids('tt', numbers),
+        'titleType': title_type,
+        'primaryTitle': titles,
+        'originalTitle': np.where(rng.random(size) < 0.1, titles + ' (original)', titles),
+        'isAdult': (rng.random(size) < 0.02).astype(int),
+        'startYear': with_garbage(rng, with_missing(rng, years, 'startYear'), 'Documentary'),
+        'endYear': None,
+        'runtimeMinutes': with_garbage(rng, with_missing(rng, np.maximum(runtime.astype(int), 1), 'runtimeMinutes'), 'Drama'),
+        'genres': with_missing(rng, join_lists(rng, GENRES, size, 3), 'genres'),
+    })
+
+
+def title_ratings(rng, start, size, rated_share):
+    numbers = np.arange(start, start + size)
+    numbers = numbers[rng.random(size) < rated_share]
+    votes = np.minimum(5 + rng.pareto(0.9, len(numbers)) * 20, 3e6).astype(np.int64)
+    return pd.DataFrame({
+        'tconst': ids('tt', numbers),
+        'averageRating': np.clip(rng.normal(6.9, 1.4, len(numbers)), 1, 10).round(1),
+        'numVotes': votes,
+    })
+
+
+def name_basics(rng, start, size, nb_titles):
+    numbers = np.arange(start, start + size)
+    birth = rng.integers(1850, 2015, size)
+    death = birth + rng.integers(20, 100, size)
+
+    known_for = join_columns([ids('tt', popular(rng, size, nb_titles)) for _ in range(4)], rng.integers(1, 5, size))
+
+    return pd.DataFrame({
+        'nconst': ids('nm', numbers),
+        'primaryName': 'Name ' + pd.Series(numbers).astype(str).values,
+        'birthYear': with_missing(rng, birth, 'birthYear'),
+        'deathYear': with_missing(rng, np.where(death < 2025, death, None), 'deathYear'),
+        'primaryProfession': with_missing(rng, join_lists(rng, PROFESSIONS, size, 3), 'primaryProfession'),
+        'knownForTitles': with_missing(rng, known_for, 'knownForTitles'),
+    })
+
+
+def title_principals(rng, start, size, nb_names):
+    counts = rng.geometric(1 / PRINCIPALS_PER_TITLE, size)
+    titles = np.repeat(np.arange(start, start + size), counts)
+    firsts = np.repeat(np.cumsum(counts) - counts, counts)
+    ordering = np.arange(len(titles)) - firsts + 1
+    names = popular(rng, len(titles), nb_names)
+    category = weighted(rng, CATEGORIES, len(titles))
+
+    # Same person a second time in the same title, with another ordering
+    repeated = rng.random(len(titles)) < DUPLICATE_PRINCIPALS
+    last = np.repeat(counts, counts)[repeated]
+    titles = np.concatenate([titles, titles[repeated]])
+    ordering = np.concatenate([ordering, last + ordering[repeated]])
+    names = np.concatenate([names, names[repeated]])
+    category = np.concatenate([category, category[repeated]])
+
+    order = np.lexsort((ordering, titles))
+    characters = '["Character ' + pd.Series(names[order]).astype(str).values + '"]'
+    return pd.DataFrame({
+        'tconst': ids('tt', titles[order]),
+        'ordering': ordering[order],
+        'nconst': ids('nm', names[order]),
+        'category': category[order],
+        'job': None,
+        'characters': np.where(np.isin(category[order], ['actor', 'actress', 'self']),
+                               with_missing(rng, characters, 'characters'), None),
+    })
+
+
+def write_dump(path, chunks):
+    """Write DataFrames one after the other in a gzip TSV file, in the format of the IMDb dumps.
+
+    Args:
+        path (str): Path of the .tsv.gz file.
+        chunks (iterable): DataFrames with the same columns.
+
+    Returns:
+        int: Number of written rows
+    """
+    nb_rows = 0
+    with gzip.open(path, 'wt', compresslevel = COMPRESS_LEVEL, newline = '') as file:
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(file, sep = '\t', index = False, header = (i == 0), na_rep = '\\N',
+                         quoting = csv.QUOTE_NONE, lineterminator = '\n')
+            nb_rows += len(chunk)
+    return nb_rows
+
+
+def generate(out, rows, seed = 0, rated_share = RATED_TITLES, names_per_title = NAMES_PER_TITLE):
+    """Write synthetic name.basics, title.basics, title.ratings and title.principals dumps in out,
+    with the same columns, missing values and proportions as the IMDb files. Ids are consistent between the files.
+
+    Args:
+        out (str): Directory of the generated dumps, usable as --source of the loaders.
+        rows (int): Number of rows of title.basics. Other files are scaled from it.
+        seed (int, optional): Seed of the random generator, the same seed gives the same files. Defaults to 0.
+        rated_share (float, optional): Share of the titles with a rating. Defaults to RATED_TITLES.
+        names_per_title (float, optional): Number of rows of name.basics per title. Defaults to NAMES_PER_TITLE.
+
+    Returns:
+        dict: Number of rows written in each dump
+    """
+    os.makedirs(out, exist_ok = True)
+    nb_names = max(int(rows * names_per_title), 1)
+
+    def chunks(stream, build, total):
+        # Every chunk gets its own generator seeded by its position, so a chunk is the same whatever the scale
+        for start in range(0, total, CHUNK_TITLES):
+            rng = np.random.default_rng([seed, stream, start])
+            yield build(rng, start, min(CHUNK_TITLES, total - start))
+
+    builds = {
+        'title.basics': (title_basics, rows),
+        'title.ratings': (lambda rng, start, size: title_ratings(rng, start, size, rated_share), rows),
+        'name.basics': (lambda rng, start, size: name_basics(rng, start, size, rows), nb_names),
+        'title.principals': (lambda rng, start, size: title_principals(rng, start, size, nb_names), rows),
+    }
+    return {name: write_dump(os.path.join(out, f'{name}.tsv.gz'), chunks(stream, build, total))
+            for stream, (name, (build, total)) in enumerate(builds.items())}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Write synthetic IMDb dumps, to test and benchmark the loaders offline.")
+    parser.add_argument('--out', default = 'synthetic_dumps', help = "Output directory. Defaults to synthetic_dumps.")
+    parser.add_argument('--rows', type = int, default = 100000,
+                        help = "Number of titles (rows of title.basics), from 1k to 50M. Other dumps are scaled from it.")
+    parser.add_argument('--seed', type = int, default = 0, help = "Seed of the random generator. Defaults to 0.")
+    args = parser.parse_args()
+
+    start = time.time()
+    counts = generate(args.out, args.rows, args.seed)
+    for name, count in counts.items():
+        print(f"{name} : {count} rows")
+
+    end = time.time()
+    print(f"Total time : {(end-start):.2f} s")
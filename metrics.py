@@ -0,0 +1,352 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+import datetime
+import json
+import threading
+import io
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Directory of the JSON reports written at the end of each build or refresh
+REPORT_DIR = 'reports'
+
+
+# How often the resident memory is sampled while stages run, in seconds
+MEMORY_SAMPLE_INTERVAL = 0.05
+
+
+def resident_memory():
+    """Current resident memory of the process in MB, None where /proc is not available (Linux only)."""
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    return None
+
+
+def peak_memory():
+    """Peak resident memory of the process in MB since its start."""
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # In bytes on macOS, in KB elsewhere
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+class Memory_sampler:
+    """Thread sampling the resident memory of the process while stages run, to keep the maximum seen during each one.
+    The peak of the process can't be reset for one stage only, since stages of a build run at the same time in threads.
+    The memory is still the one of the whole process : a stage running next to another one sees its allocations too,
+    and spikes shorter than the interval can be missed.
+    """
+
+    def __init__(self, interval = MEMORY_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stages = set()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def sample(self):
+        memory = resident_memory()
+        if memory is None:
+            return
+        with self.lock:
+            for metrics in self.stages:
+                metrics.peak_memory_mb = max(metrics.peak_memory_mb or 0, memory)
+
+    def add(self, metrics):
+        """Start following the memory of a stage."""
+        with self.lock:
+            self.stages.add(metrics)
+            if self.thread is None:
+                self.thread = threading.Thread(target = self.run, daemon = True)
+                self.thread.start()
+        self.sample()
+
+    def remove(self, metrics):
+        """Stop following a stage, after a last sample."""
+        self.sample()
+        with self.lock:
+            self.stages.discard(metrics)
+
+    def run(self):
+        while True:
+            with self.lock:
+                # The thread stops once no stage runs, and add starts a new one
+                if not self.stages:
+                    self.thread = None
+                    return
+            self.sample()
+            time.sleep(self.interval)
+
+
+class Stage_metrics:
+    """Measures of one stage of a build (ie load_movies) : times, rows, rejections, memory and bytes read.
+    Times are split in named steps (ie parse, insert movies) to find where a stage spends its time.
+    cpu is the CPU time of the thread running the stage, plus the one reported with add_cpu by the threads and worker
+    processes working for it (ie the parsing of prefetch). Steps are timed in the thread running them.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.wall = 0
+        self.cpu = 0
+        self.rows_in = 0
+        self.rows_out = {}
+        self.rejected = {}
+        self.bytes_read = 0
+        self.peak_memory_mb = None
+        self.steps = {}
+        self.extra = {}
+
+    def add_step(self, step, wall, cpu):
+        calls, total_wall, total_cpu = self.steps.get(step, (0, 0, 0))
+        self.steps[step] = (calls + 1, total_wall + wall, total_cpu + cpu)
+
+    def to_dict(self):
+        return {
+            'stage': self.name,
+            'wall_s': round(self.wall, 3),
+            'cpu_s': round(self.cpu, 3),
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'rejected': self.rejected,
+            'bytes_read': self.bytes_read,
+            'peak_memory_mb': None if self.peak_memory_mb is None else round(self.peak_memory_mb, 1),
+            'steps': {step: {'calls': calls, 'wall_s': round(wall, 3), 'cpu_s': round(cpu, 3)}
+                      for step, (calls, wall, cpu) in self.steps.items()},
+            **self.extra,
+        }
+
+
+class Run_metrics:
+    """Measures of every stage of one build or refresh, reported to the sinks by finish_run."""
+
+    def __init__(self, kind = 'build'):
+        self.kind = kind
+        self.started = datetime.datetime.now()
+        self.start = time.perf_counter()
+        self.stages = []
+
+    def report(self):
+        return {
+            'kind': self.kind,
+            'started': self.started.isoformat(timespec = 'seconds'),
+            'wall_s': round(time.perf_counter() - self.start, 3),
+            # Highest resident memory of the process since it started, whatever the stage
+            'peak_memory_mb': None if peak_memory() is None else round(peak_memory(), 1),
+            'stages': [stage.to_dict() for stage in self.stages],
+        }
+
+
+# Run being measured, and stage being run in the current thread. Without a stage, measures are dropped.
+current_run = Run_metrics()
+current_stage = ContextVar('current_stage', default = None)
+memory_sampler = Memory_sampler()
+
+# Functions called with the report of each run
+sinks = []
+
+
+def add_sink(sink):
+    """Register a function called with the report (dict) of each run by finish_run, ie to send it to a monitoring system."""
+    sinks.append(sink)
+
+
+def json_sink(directory = REPORT_DIR):
+    """Sink writing each report in its own JSON file of directory, named after the kind and start of the run."""
+    def write(report):
+        os.makedirs(directory, exist_ok = True)
+        started = report['started'].replace(':', '').replace('-', '')
+        path = os.path.join(directory, f"{report['kind']}_{started}.json")
+        with open(path, 'w') as file:
+            json.dump(report, file, indent = 2)
+        print(f"Report written in {path}")
+    return write
+
+
+def print_sink(report):
+    """Sink printing one line per stage."""
+    for stage in report['stages']:
+        rows_out = sum(stage['rows_out'].values())
+        rejected = sum(stage['rejected'].values())
+        print(f"{stage['stage']:<12} {stage['wall_s']:>8.2f} s wall {stage['cpu_s']:>8.2f} s cpu  "
+              f"{stage['rows_in']:>10} in {rows_out:>10} out {rejected:>10} rejected  "
+              f"{stage['bytes_read'] / 2**20:>8.1f} MB read  peak {stage['peak_memory_mb']} MB")
+
+
+def start_run(kind = 'build'):
+    """Start measuring a new run. Stages of the previous run are forgotten."""
+    global current_run
+    current_run = Run_metrics(kind)
+    return current_run
+
+
+def finish_run():
+    """Give the report of the current run to every sink.
+
+    Returns:
+        dict: Report of the run
+    """
+    report = current_run.report()
+    for sink in sinks:
+        sink(report)
+    return report
+
+
+@contextmanager
+def stage(name):
+    """Measure a stage of the current run. Steps, rows and bytes recorded inside are added to it."""
+    metrics = Stage_metrics(name)
+    token = current_stage.set(metrics)
+    memory_sampler.add(metrics)
+    start, cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield metrics
+    finally:
+        metrics.wall = time.perf_counter() - start
+        # Other threads may have added their CPU time already
+        metrics.cpu += time.thread_time() - cpu
+        memory_sampler.remove(metrics)
+        current_stage.reset(token)
+        current_run.stages.append(metrics)
+
+
+def measure_stage(name):
+    """Decorator running a whole function as a stage."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_cpu(seconds):
+    """Add CPU time spent for the current stage outside of its thread, ie by a background thread or a worker process."""
+    metrics = current_stage.get()
+    if metrics is not None:
+        metrics.cpu += seconds
+
+
+@contextmanager
+def step(name):
+    """Add the time spent inside to a step of the current stage."""
+    start, cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield
+    finally:
+        metrics = current_stage.get()
+        if metrics is not None:
+            metrics.add_step(name, time.perf_counter() - start, time.thread_time() - cpu)
+
+
+def timed(iterable, name):
+    """Iterate over iterable, adding the time spent to produce each item (ie reading and parsing a chunk) to a step."""
+    iterator = iter(iterable)
+    while True:
+        with step(name):
+            item = next(iterator, StopIteration)
+        if item is StopIteration:
+            return
+        yield item
+
+
+def collect(iterable):
+    """Iterate over iterable, telling apart the rejections recorded while producing each item (ie to store them with it).
+    Measures are still added to the current stage, if any.
+
+    Yields:
+        Item of iterable
+        dict : Number of rows rejected while producing it, for each reason
+    """
+    outer = current_stage.get()
+    # Kept for the whole iteration, since a file opened by the first item counts its bytes there
+    collector = Stage_metrics('collect')
+    iterator = iter(iterable)
+    while True:
+        rows_in, rejected, bytes_read = collector.rows_in, dict(collector.rejected), collector.bytes_read
+        token = current_stage.set(collector)
+        try:
+            item = next(iterator, StopIteration)
+        finally:
+            current_stage.reset(token)
+        if item is StopIteration:
+            return
+
+        rejected = {reason: count - rejected.get(reason, 0) for reason, count in collector.rejected.items()
+                    if count != rejected.get(reason, 0)}
+        if outer is not None:
+            outer.rows_in += collector.rows_in - rows_in
+            outer.bytes_read += collector.bytes_read - bytes_read
+            for reason, count in rejected.items():
+                outer.rejected[reason] = outer.rejected.get(reason, 0) + count
+        yield item, rejected
+
+
+def count_in(rows):
+    """Count rows read from a dump by the current stage."""
+    metrics = current_stage.get()
+    if metrics is not None:
+        metrics.rows_in += int(rows)
+
+
+def count_out(table, rows):
+    """Count rows written in a table by the current stage."""
+    metrics = current_stage.get()
+    if metrics is not None:
+        metrics.rows_out[table] = metrics.rows_out.get(table, 0) + int(rows)
+
+
+def reject(reason, rows):
+    """Count rows dropped by the current stage, with the reason why."""
+    metrics = current_stage.get()
+    if metrics is not None and rows:
+        metrics.rejected[reason] = metrics.rejected.get(reason, 0) + int(rows)
+
+
+def record(**values):
+    """Add other values to the report of the current stage, ie statistics of worker processes."""
+    metrics = current_stage.get()
+    if metrics is not None:
+        metrics.extra.update(values)
+
+
+class Counting_reader(io.RawIOBase):
+    """Binary file wrapper counting the bytes read from disk or network into the current stage."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        # Bytes are counted in the stage which opened the file, even if read from another thread
+        self.metrics = current_stage.get()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = self.raw.readinto(buffer)
+        if self.metrics is not None and size:
+            self.metrics.bytes_read += size
+        return size
+
+    def close(self):
+        self.raw.close()
+        super().close()
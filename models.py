@@ -1,18 +1,45 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, create_engine, Boolean, Table
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, create_engine, Boolean, Table, Index
 from sqlalchemy.orm import relationship, declarative_base
+import os
 
 Base = declarative_base()
 
+# IMDb ids (tt0000001, nm0000001) are stored as integers (1) when CINEMA_INTEGER_IDS=1 : tables and indexes are smaller
+# and joins compare integers. The numeric part is parsed on ingest and the prefix is rendered again on output.
+# A database must be built, refreshed and served with the same setting.
+INTEGER_IDS = os.environ.get('CINEMA_INTEGER_IDS', '0') == '1'
+Imdb_id = Integer if INTEGER_IDS else String
+
+# Minimal number of digits of IMDb ids, shorter numbers are padded with zeros
+ID_DIGITS = 7
+
+
+def render_id(value, prefix):
+    """IMDb id as shown to users, ie render_id(1, 'tt') is 'tt0000001' when ids are stored as integers."""
+    return f"{prefix}{int(value):0{ID_DIGITS}d}" if INTEGER_IDS else value
+
+
+def parse_id(text, prefix):
+    """Id as stored in the database from an IMDb id, the opposite of render_id. Raises ValueError if it is not one."""
+    if not INTEGER_IDS:
+        return text
+    digits = text[len(prefix):] if isinstance(text, str) and text.startswith(prefix) else ''
+    # Ids with extra zeros would not be rendered back the same
+    if not digits.isdigit() or render_id(int(digits), prefix) != text:
+        raise ValueError(f"{text!r} is not an IMDb id starting with {prefix}")
+    return int(digits)
+
+
 # Several-several relationshop managing
 Played_in = Table(
     'played_in', Base.metadata,
-    Column('actor', String, ForeignKey('actors.nconst'), primary_key = True, index = True),
-    Column('movie', String, ForeignKey('movies.tconst'), primary_key = True, index = True)
+    Column('actor', Imdb_id, ForeignKey('actors.nconst'), primary_key = True, index = True),
+    Column('movie', Imdb_id, ForeignKey('movies.tconst'), primary_key = True, index = True)
 )
 
 Movie_genre = Table(
     'movie_genre', Base.metadata,
-    Column('movie', String, ForeignKey('movies.tconst'), primary_key = True, index = True),
+    Column('movie', Imdb_id, ForeignKey('movies.tconst'), primary_key = True, index = True),
     Column('genre', Integer, ForeignKey('genres.id'), primary_key = True, index = True)
 )
 
@@ -20,7 +47,7 @@ Movie_genre = Table(
 class Actor(Base):
     __tablename__ = 'actors'
 
-    nconst = Column(String, primary_key = True, index = True)
+    nconst = Column(Imdb_id, primary_key = True, index = True)
     primary_name = Column(String, index = True)
     birth_year = Column(Integer, index = True)
     death_year = Column(Integer, index = False, nullable = True)
@@ -31,7 +58,7 @@ class Actor(Base):
 class Movie(Base):
     __tablename__ = 'movies'
 
-    tconst = Column(String, primary_key = True, index = True)
+    tconst = Column(Imdb_id, primary_key = True, index = True)
     primary_title = Column(String)
     original_title = Column(String, index = True)
     is_adult = Column(Boolean)
@@ -46,9 +73,11 @@ class Movie(Base):
 class Movie_rating(Base):
     __tablename__ = 'movie_ratings'
 
-    tconst = Column(String, ForeignKey('movies.tconst'), primary_key = True, index = True)
+    tconst = Column(Imdb_id, ForeignKey('movies.tconst'), primary_key = True, index = True)
     average_rating = Column(Float, index = True)
     num_votes = Column(Integer, index = False)
+    # Popularity of the movie : num_votes*average_rating, stored to be indexed
+    score = Column(Float)
 
     movie = relationship("Movie", back_populates = "movie_rating")
 
@@ -59,4 +88,101 @@ class Genre(Base):
     id = Column(Integer, primary_key = True, autoincrement = True)
     name = Column(String, unique = True)
 
-    movies = relationship("Movie", secondary = Movie_genre, back_populates = 'genres')
\ No newline at end of file
+    movies = relationship("Movie", secondary = Movie_genre, back_populates = 'genres')
+
+
+# Summary tables, rebuilt from the tables above at the end of each load (see aggregates.py) and read by the API
+class Year_count(Base):
+    __tablename__ = 'year_counts'
+
+    year = Column(Integer, primary_key = True)
+    movie_number = Column(Integer)
+
+
+class Genre_count(Base):
+    __tablename__ = 'genre_counts'
+
+    id = Column(Integer, ForeignKey('genres.id'), primary_key = True)
+    genre = Column(String)
+    movie_number = Column(Integer, index = True)
+
+
+class Top_movie(Base):
+    __tablename__ = 'top_movies'
+
+    rank = Column(Integer, primary_key = True)
+    title = Column(String)
+    score = Column(Float)
+    rating = Column(Float)
+    num_votes = Column(Integer)
+
+
+class Actor_score(Base):
+    __tablename__ = 'actor_scores'
+
+    actor = Column(Imdb_id, ForeignKey('actors.nconst'), primary_key = True)
+    name = Column(String)
+    score = Column(Float)
+    average_score = Column(Float)
+    average_rating = Column(Float)
+    num_votes = Column(Float)
+    movie_number = Column(Integer)
+
+
+# Rated movies in ranking order for the /v2 rankings : one row per movie with a NULL genre, and one per genre of the movie,
+# so that every filter of the rankings is a prefix of one of the indexes below
+class Movie_ranking(Base):
+    __tablename__ = 'movie_rankings'
+
+    id = Column(Integer, primary_key = True)
+    genre = Column(String)
+    is_adult = Column(Boolean)
+    start_year = Column(Integer)
+    score = Column(Float)
+    tconst = Column(Imdb_id)
+    title = Column(String)
+    average_rating = Column(Float)
+    num_votes = Column(Integer)
+
+
+# Counts and sums of the movies for each combination of values of the dimensions kept in the cell (see aggregates.cube_cells).
+# dims is the bitmask of the kept dimensions : 1 start year, 2 genre, 4 is_adult, 8 rating bucket. Columns of the other
+# dimensions are NULL, like unknown values of a kept one (ie a movie without start year or rating).
+class Cube_cell(Base):
+    __tablename__ = 'cube_cells'
+
+    id = Column(Integer, primary_key = True)
+    dims = Column(Integer)
+    year = Column(Integer)
+    genre = Column(String)
+    is_adult = Column(Boolean)
+    rating_bucket = Column(Integer)
+    movie_number = Column(Integer)
+    # Mean rating of the movies of the cell is rating_sum / rated_number : both add up across cells
+    rated_number = Column(Integer)
+    rating_sum = Column(Float)
+    num_votes = Column(Integer)
+
+
+# Progress of a build, to resume it after a failure (see setup_database.py)
+class Build_checkpoint(Base):
+    __tablename__ = 'build_checkpoints'
+
+    stage = Column(String, primary_key = True)
+    # Rows of the dump already read and committed, for stages loaded chunk by chunk
+    rows_done = Column(Integer)
+    done = Column(Boolean)
+
+
+# Composite indexes following the order of rankings, so that pages are read straight from the index (keyset pagination)
+Index('ix_movie_ratings_score', Movie_rating.score.desc(), Movie_rating.tconst.desc())
+Index('ix_actor_scores_ranking', Actor_score.average_score.desc(), Actor_score.actor.desc())
+# Filters of the /v2 rankings, then their order : a page is one seek in one of them for a genre, is_adult and one year,
+# ranges of years are read one year at a time or checked row by row (see app.rating_page)
+Index('ix_movie_rankings_genre', Movie_ranking.genre, Movie_ranking.score.desc(), Movie_ranking.tconst.desc())
+Index('ix_movie_rankings_adult', Movie_ranking.genre, Movie_ranking.is_adult, Movie_ranking.score.desc(), Movie_ranking.tconst.desc())
+Index('ix_movie_rankings_year', Movie_ranking.genre, Movie_ranking.start_year, Movie_ranking.score.desc(), Movie_ranking.tconst.desc())
+Index('ix_movie_rankings_adult_year', Movie_ranking.genre, Movie_ranking.is_adult, Movie_ranking.start_year, Movie_ranking.score.desc(),
+      Movie_ranking.tconst.desc())
+# Cells of one combination of dimensions, ordered by year for the ranges of years
+Index('ix_cube_cells_dims', Cube_cell.dims, Cube_cell.year)
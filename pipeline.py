@@ -0,0 +1,109 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextvars import copy_context
+from queue import Queue, Full, Empty
+from metrics import add_cpu
+import threading
+import time
+
+# Chunks parsed in advance by prefetch, on top of the one being written
+PREFETCH_CHUNKS = 1
+
+# Stages of a build running at the same time
+PIPELINE_THREADS = 4
+
+
+def run_pipeline(stages, threads = PIPELINE_THREADS):
+    """Run stages as a DAG : each stage starts as soon as every stage it depends on is finished,
+    so independent stages run at the same time in a pool of threads.
+    If a stage fails, no other stage is started and the error is raised once the running ones are finished.
+
+    Args:
+        stages (dict): For each stage name, {'run': function without argument, 'deps': names of the stages it needs}.
+        threads (int, optional): Number of stages running at the same time. Defaults to PIPELINE_THREADS.
+    """
+    for name, stage in stages.items():
+        unknown = set(stage['deps']) - set(stages)
+        if unknown:
+            raise ValueError(f"Stage {name} depends on unknown stages {unknown}")
+
+    done = set()
+    waiting = dict(stages)
+    running = {}
+
+    with ThreadPoolExecutor(threads) as executor:
+        while waiting or running:
+            for name, stage in list(waiting.items()):
+                if set(stage['deps']) <= done:
+                    running[executor.submit(stage['run'])] = name
+                    del waiting[name]
+            if not running:
+                raise ValueError(f"Stages {list(waiting)} have circular dependencies")
+
+            finished, _ = wait(running, return_when = FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                if future.exception() is not None:
+                    # Let the running stages end, but don't start new ones
+                    waiting.clear()
+                    wait(running)
+                    raise future.exception()
+                done.add(name)
+
+
+def prefetch(iterable, size = PREFETCH_CHUNKS):
+    """Produce the items of iterable in a background thread, up to size items ahead of the consumer,
+    so that reading and parsing the next chunk overlaps with writing the current one.
+    The thread runs in a copy of the current context, so its measures, CPU time included, go to the current stage of metrics.
+
+    Args:
+        iterable (iterable): Items to produce, ie chunks of a dump.
+        size (int, optional): Number of items produced in advance. Defaults to PREFETCH_CHUNKS.
+
+    Yields:
+        Items of iterable, in the same order
+    """
+    queue = Queue(size)
+    stop = threading.Event()
+    end = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout = 0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce():
+        cpu = time.thread_time()
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            put((end, e))
+            return
+        finally:
+            add_cpu(time.thread_time() - cpu)
+        put((end, None))
+
+    thread = threading.Thread(target = copy_context().run, args = (produce,), daemon = True)
+    thread.start()
+    try:
+        while True:
+            try:
+                item, error = queue.get(timeout = 0.1)
+            except Empty:
+                if not thread.is_alive():
+                    return
+                continue
+            if error is not None:
+                raise error
+            if item is end:
+                return
+            yield item
+    finally:
+        # The consumer stopped early (error or break) : the producer must not wait forever on a full queue
+        stop.set()
+        thread.join()
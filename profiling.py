@@ -0,0 +1,218 @@
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from contextvars import ContextVar
+from collections import deque
+from bisect import bisect_left
+from functools import wraps
+import inspect
+import logging
+import random
+import threading
+import time
+import os
+
+# Share of the requests whose SQL statements and serialization are timed. 0 keeps only the request histogram.
+SAMPLE_RATE = float(os.environ.get('CINEMA_PROFILE_SAMPLE_RATE', 1.0))
+
+# Statements slower than this are logged with their query plan, in milliseconds
+SLOW_QUERY_MS = float(os.environ.get('CINEMA_SLOW_QUERY_MS', 100))
+
+# Number of slow statements kept for /slowQueries
+SLOW_QUERY_LOG_SIZE = 50
+
+# Upper bounds of the histogram buckets, in seconds
+DURATION_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5]
+COUNT_BUCKETS = [0, 1, 2, 3, 5, 10, 25, 50]
+
+slow_query_logger = logging.getLogger('cinema.slow_queries')
+
+
+class Histogram:
+    """Prometheus histogram with one label, safe to update from several threads."""
+
+    def __init__(self, name, documentation, buckets, label = 'path'):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.label = label
+        # For each label value : count of each bucket (not cumulated), sum and count of the observations
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label, value):
+        with self.lock:
+            counts = self.values.setdefault(label, [0] * (len(self.buckets) + 1) + [0.0, 0])
+            counts[bisect_left(self.buckets, value)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def render(self):
+        """Lines of the histogram in the Prometheus text format."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for label, counts in sorted(self.values.items()):
+                cumulated = 0
+                for bound, count in zip(self.buckets + ['+Inf'], counts):
+                    cumulated += count
+                    lines.append(f'{self.name}_bucket{{{self.label}="{label}",le="{bound}"}} {cumulated}')
+                lines.append(f'{self.name}_sum{{{self.label}="{label}"}} {counts[-2]}')
+                lines.append(f'{self.name}_count{{{self.label}="{label}"}} {counts[-1]}')
+        return lines
+
+
+class Request_profile:
+    """Costs of one sampled request, filled by the engine events and the route handler."""
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0
+        self.endpoint_seconds = 0
+        self.handler_seconds = 0
+
+
+REQUEST_DURATION = Histogram('cinema_request_duration_seconds', "Time to answer a request, cache hits included.", DURATION_BUCKETS)
+REQUEST_QUERIES = Histogram('cinema_request_queries', "Number of SQL statements run by a sampled request.", COUNT_BUCKETS)
+QUERY_DURATION = Histogram('cinema_query_duration_seconds', "Time spent by SQLite on each statement of sampled requests.", DURATION_BUCKETS)
+SERIALIZE_DURATION = Histogram('cinema_serialize_duration_seconds',
+                               "Time spent on validation and JSON encoding of the response of sampled requests.", DURATION_BUCKETS)
+HISTOGRAMS = [REQUEST_DURATION, REQUEST_QUERIES, QUERY_DURATION, SERIALIZE_DURATION]
+
+# Profile of the request being served. Worker threads of anyio.to_thread get a copy of the context, so they see it too.
+current_profile = ContextVar('current_profile', default = None)
+current_path = ContextVar('current_path', default = 'other')
+
+slow_queries = deque(maxlen = SLOW_QUERY_LOG_SIZE)
+slow_query_count = 0
+
+
+def query_plan(cursor, statement, parameters):
+    """EXPLAIN QUERY PLAN of a statement, run on a new cursor of the same connection so that the results of cursor are kept."""
+    if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    explain = cursor.connection.cursor()
+    try:
+        return [row[-1] for row in explain.execute(f"EXPLAIN QUERY PLAN {statement}", parameters or ()).fetchall()]
+    except Exception as e:
+        return [f"unavailable : {e}"]
+    finally:
+        explain.close()
+
+
+def instrument_engine(engine):
+    """Time every statement of sampled requests, and log the slow ones with their query plan.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Engine of the API.
+    """
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_query(connection, cursor, statement, parameters, context, executemany):
+        if current_profile.get() is not None:
+            connection.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def end_query(connection, cursor, statement, parameters, context, executemany):
+        global slow_query_count
+        profile = current_profile.get()
+        if profile is None:
+            return
+
+        seconds = time.perf_counter() - connection.info['query_start'].pop()
+        profile.queries += 1
+        profile.query_seconds += seconds
+        QUERY_DURATION.observe(current_path.get(), seconds)
+
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            entry = {'path': current_path.get(), 'ms': round(seconds * 1000, 3), 'statement': statement,
+                     'parameters': list(parameters) if parameters else [], 'plan': query_plan(cursor, statement, parameters)}
+            slow_queries.append(entry)
+            slow_query_count += 1
+            slow_query_logger.warning("Slow query (%.1f ms) on %s : %s | plan : %s", entry['ms'], entry['path'],
+                                      statement, entry['plan'])
+
+
+class Profiled_route(APIRoute):
+    """Route measuring its endpoint alone and its whole handler (dependencies, endpoint, validation and JSON encoding)
+    for sampled requests. The difference is the serialization cost of the response.
+    """
+
+    def __init__(self, path, endpoint, **kwargs):
+        if inspect.iscoroutinefunction(endpoint):
+            @wraps(endpoint)
+            async def timed_endpoint(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await endpoint(*args, **kwargs)
+                finally:
+                    add_endpoint_time(time.perf_counter() - start)
+        else:
+            @wraps(endpoint)
+            def timed_endpoint(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return endpoint(*args, **kwargs)
+                finally:
+                    add_endpoint_time(time.perf_counter() - start)
+        super().__init__(path, timed_endpoint, **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            start = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                profile = current_profile.get()
+                if profile is not None:
+                    profile.handler_seconds += time.perf_counter() - start
+
+        return timed_handler
+
+
+def add_endpoint_time(seconds):
+    profile = current_profile.get()
+    if profile is not None:
+        profile.endpoint_seconds += seconds
+
+
+def profile_requests(app):
+    """Middleware timing every request, and queries and serialization of a sample of them (SAMPLE_RATE).
+    Requests are labelled by their path if it is a route of the app, so that the number of labels stays bounded.
+
+    Args:
+        app (FastAPI): Application, to read its routes.
+    """
+    paths = set()
+
+    async def middleware(request, call_next):
+        if not paths:
+            paths.update(route.path for route in app.routes)
+        path = request.url.path if request.url.path in paths else 'other'
+        profile = Request_profile() if SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE else None
+        profile_token = current_profile.set(profile)
+        path_token = current_path.set(path)
+
+        start = time.perf_counter()
+        try:
+            return await call_next(request)
+        finally:
+            REQUEST_DURATION.observe(path, time.perf_counter() - start)
+            if profile is not None:
+                REQUEST_QUERIES.observe(path, profile.queries)
+                if profile.handler_seconds:
+                    SERIALIZE_DURATION.observe(path, max(profile.handler_seconds - profile.endpoint_seconds, 0))
+            current_profile.reset(profile_token)
+            current_path.reset(path_token)
+
+    return middleware
+
+
+def render_metrics():
+    """Every metric in the Prometheus text format."""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines += histogram.render()
+    lines += ["# HELP cinema_slow_queries_total Statements slower than the slow query threshold.",
+              "# TYPE cinema_slow_queries_total counter",
+              f"cinema_slow_queries_total {slow_query_count}"]
+    return "\n".join(lines) + "\n"
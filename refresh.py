@@ -0,0 +1,242 @@
+from models import Base
+from sqlalchemy import create_engine
+from db_functions import *
+from aggregates import rebuild_aggregates
+from shadow import shadow_copy
+import metrics
+
+import argparse
+import time
+import pandas as pd
+
+# Tables compared row by row, with their key
+KEYED_TABLES = {'movies': 'tconst', 'movie_ratings': 'tconst', 'actors': 'nconst'}
+
+# New content of each table is loaded in a temporary table with this prefix (staged_movies...), then compared in SQL
+STAGING_PREFIX = 'staged_'
+
+
+def create_staging(connection, table, columns = None):
+    """Create an empty temporary table to load the new content of a table, with the same types and primary key.
+    Temporary tables are only seen by this connection and are dropped with it : they never reach the database file.
+
+    Args:
+        connection (sqlalchemy.engine.Connection): Connection to the database.
+        table (str): Name of the table of models.py.
+        columns (dict, optional): Columns with their SQL type, instead of those of the table. Defaults to None.
+
+    Returns:
+        str: Name of the temporary table
+    """
+    staged = STAGING_PREFIX + table
+    if columns is None:
+        definition = Base.metadata.tables[table]
+        columns = {column.name: column.type.compile(connection.dialect) for column in definition.columns}
+        key = [column.name for column in definition.primary_key]
+    else :
+        key = list(columns)
+    connection.exec_driver_sql(f"DROP TABLE IF EXISTS temp.{staged}")
+    connection.exec_driver_sql(f"CREATE TEMP TABLE {staged} ({', '.join(f'{name} {type}' for name, type in columns.items())}, "
+                               f"PRIMARY KEY ({', '.join(key)}))")
+    return staged
+
+
+def stage_new_dumps(connection, test = False, source = None, memory_limit = MEMORY_LIMIT, workers = None):
+    """Load a new set of dumps in temporary tables, cleaned and filtered as the loaders do, one chunk at a time.
+    Like in a build, a row whose key is already staged is dropped, and only ids are kept in memory to filter the links.
+
+    Args:
+        connection (sqlalchemy.engine.Connection): Connection to the database, inside the transaction of the refresh.
+        test (bool, optional): if True, use the test tables of the source directory. Defaults to False.
+        source (str, optional): Local mirror directory or base URL of the dumps. Defaults to None.
+        memory_limit (float, optional): Memory budget in MB for one chunk. Defaults to MEMORY_LIMIT.
+        workers (int, optional): Number of processes filtering title.principals. Defaults to the number of CPUs.
+    """
+    for table in ['movies', 'movie_ratings', 'actors', 'played_in']:
+        create_staging(connection, table)
+    # Genres are staged by name : ids of new genres are only given once they are inserted in genres
+    genre_type = Base.metadata.tables['movie_genre'].c.movie.type.compile(connection.dialect)
+    create_staging(connection, 'movie_genre', {'movie': genre_type, 'name': 'VARCHAR'})
+
+    with closing(prefetch(preprocess_movies(None, test, source, memory_limit))) as chunks:
+        for title_basics in tqdm(timed(chunks, 'read'), desc = 'Movies chunks'):
+            insert_rows(connection, 'staged_movie_genre', explode_genres(title_basics), or_ignore = True)
+            insert_rows(connection, 'staged_movies', title_basics.drop(['genres'], axis = 1), or_ignore = True)
+
+    with step('read ids'):
+        movie_ids = pd.Index(connection.exec_driver_sql("SELECT tconst FROM staged_movies").scalars().all())
+
+    with closing(prefetch(preprocess_ratings(None, test, source, memory_limit))) as chunks:
+        for title_ratings in tqdm(timed(chunks, 'read'), desc = 'Ratings chunks'):
+            known = movie_ids.get_indexer(title_ratings['tconst']) >= 0
+            reject('unknown movie', (~known).sum())
+            insert_rows(connection, 'staged_movie_ratings', title_ratings[known], or_ignore = True)
+
+    # Movies each actor is known for only need the movie ids : the actor is in the same chunk
+    with closing(prefetch(preprocess_actors(None, test, source, memory_limit))) as chunks:
+        for name_basics in tqdm(timed(chunks, 'read'), desc = 'Actors chunks'):
+            pairs, rejected = known_for_edges(name_basics, movie_ids, pd.Index(name_basics['nconst']))
+            insert_rows(connection, 'staged_played_in', pairs, or_ignore = True)
+            insert_rows(connection, 'staged_actors', name_basics.drop(['knownForTitles'], axis = 1), or_ignore = True)
+
+    with step('read ids'):
+        actor_ids = pd.Index(connection.exec_driver_sql("SELECT nconst FROM staged_actors").scalars().all())
+
+    title_principals, cache = played_in_blocks(test, source, memory_limit)
+    read_args = dump_source('title.principals', test, source)[1]
+    read_args.pop('compression', None)
+    # Same union as load_played_in then load_known_for
+    with closing(filter_played_in_parallel(prefetch(title_principals), read_args, movie_ids, actor_ids, workers, cache)) as futures:
+        for future in tqdm(timed(futures, 'wait workers'), desc = 'Played in chunks'):
+            _, nb_rows, chunk, _, rejected, cpu = future.result()
+            metrics.add_cpu(cpu)
+            count_in(nb_rows)
+            for reason, count in rejected.items():
+                reject(reason, count)
+            insert_rows(connection, 'staged_played_in', chunk, or_ignore = True)
+
+
+def apply_rows(connection, table):
+    """Make a table the same as its staged content, comparing rows with the same key : rows missing from the staged table
+    are deleted, rows with another value in any column are updated and new keys are inserted.
+
+    Args:
+        connection (sqlalchemy.engine.Connection): Connection to the database, inside the transaction of the refresh.
+        table (str): Name of the table, key of KEYED_TABLES.
+
+    Returns:
+        dict: Number of inserted, updated and deleted rows
+    """
+    key = KEYED_TABLES[table]
+    staged = STAGING_PREFIX + table
+    columns = [column.name for column in Base.metadata.tables[table].columns]
+    values = [column for column in columns if column != key]
+
+    with step(f'delete {table}'):
+        deleted = connection.exec_driver_sql(
+            f"DELETE FROM {table} WHERE NOT EXISTS (SELECT 1 FROM {staged} s WHERE s.{key} = {table}.{key})").rowcount
+    # IS NOT compares NULL as a value, so that a column becoming NULL or not NULL is an update too
+    with step(f'update {table}'):
+        updated = connection.exec_driver_sql(
+            f"UPDATE {table} SET {', '.join(f'{column} = s.{column}' for column in values)} FROM {staged} s "
+            f"WHERE s.{key} = {table}.{key} AND ({' OR '.join(f's.{column} IS NOT {table}.{column}' for column in values)})").rowcount
+    with step(f'insert {table}'):
+        inserted = connection.exec_driver_sql(
+            f"INSERT INTO {table} ({', '.join(columns)}) SELECT {', '.join(columns)} FROM {staged} s "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE t.{key} = s.{key}) ORDER BY s.rowid").rowcount
+    count_out(table, inserted + updated)
+    return {'inserted': inserted, 'updated': updated, 'deleted': deleted}
+
+
+def apply_pairs(connection, table, new_pairs):
+    """Make an association table the same as a query giving its new rows. The whole row is the key.
+
+    Args:
+        connection (sqlalchemy.engine.Connection): Connection to the database, inside the transaction of the refresh.
+        table (str): Name of the table, ie 'played_in'.
+        new_pairs (str): SELECT giving the new rows, with the columns of the table in their order.
+
+    Returns:
+        dict: Number of inserted and deleted rows
+    """
+    columns = [column.name for column in Base.metadata.tables[table].columns]
+    same = ' AND '.join(f"n.{column} = {table}.{column}" for column in columns)
+    with step(f'delete {table}'):
+        deleted = connection.exec_driver_sql(f"DELETE FROM {table} WHERE NOT EXISTS (SELECT 1 FROM ({new_pairs}) n WHERE {same})").rowcount
+    same = ' AND '.join(f"n.{column} = t.{column}" for column in columns)
+    with step(f'insert {table}'):
+        inserted = connection.exec_driver_sql(
+            f"INSERT INTO {table} ({', '.join(columns)}) SELECT {', '.join(columns)} FROM ({new_pairs}) n "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE {same})").rowcount
+    count_out(table, inserted)
+    return {'inserted': inserted, 'updated': 0, 'deleted': deleted}
+
+
+def refresh(engine, test = False, source = None, memory_limit = MEMORY_LIMIT, workers = None):
+    """Apply a new set of dumps to an existing database : only rows which changed are inserted, updated or deleted.
+    The dumps are streamed chunk by chunk into temporary tables (see stage_new_dumps), and compared with the tables in SQL,
+    so that memory stays bounded whatever the size of the dumps.
+    Everything is done in one transaction, so the database is never seen half refreshed.
+    Genre ids already in the database are kept, and a database built with an older schema is upgraded first (see upgrade_schema).
+    Summary tables are rebuilt at the end.
+
+    Args:
+        engine (sqlalchemy.orm.engine): Engine to connect to database.
+        test (bool, optional): if True, use the test tables of the source directory. Defaults to False.
+        source (str, optional): Local mirror directory or base URL of the dumps. Defaults to None.
+        memory_limit (float, optional): Memory budget in MB for one chunk. Defaults to MEMORY_LIMIT.
+        workers (int, optional): Number of processes filtering title.principals. Defaults to the number of CPUs.
+
+    Returns:
+        dict: Number of inserted, updated and deleted rows for each table
+    """
+    summary = {}
+
+    # A database built before a change of models.py gets the new tables and columns first
+    upgrade_schema(engine)
+
+    # A refresh of a served file (instead of a shadow copy) doesn't block the API readers in WAL mode
+    enable_wal(engine)
+
+    with engine.begin() as connection:
+        with metrics.stage('read dumps'):
+            stage_new_dumps(connection, test, source, memory_limit, workers)
+
+        with metrics.stage('apply'):
+            # Movies, ratings and actors : compare rows with the same key
+            for table in KEYED_TABLES:
+                summary[table] = apply_rows(connection, table)
+
+            # Genres : add new names in order of first appearance, then compare pairs movie-genre with ids
+            new_genres = connection.exec_driver_sql(
+                "INSERT INTO genres (name) SELECT name FROM staged_movie_genre s "
+                "WHERE NOT EXISTS (SELECT 1 FROM genres g WHERE g.name = s.name) GROUP BY name ORDER BY min(s.rowid)").rowcount
+            summary['movie_genre'] = apply_pairs(connection, 'movie_genre',
+                                                 "SELECT s.movie, g.id AS genre FROM staged_movie_genre s JOIN genres g ON g.name = s.name")
+            summary['played_in'] = apply_pairs(connection, 'played_in', "SELECT actor, movie FROM staged_played_in")
+
+            # Genres which are not used anymore
+            unused = connection.exec_driver_sql(
+                "DELETE FROM genres WHERE NOT EXISTS (SELECT 1 FROM movie_genre m WHERE m.genre = genres.id)").rowcount
+            summary['genres'] = {'inserted': new_genres, 'updated': 0, 'deleted': unused}
+
+            for table in ['movies', 'movie_ratings', 'actors', 'played_in', 'movie_genre']:
+                connection.exec_driver_sql(f"DROP TABLE temp.{STAGING_PREFIX + table}")
+
+    for table, counts in summary.items():
+        print(f"{table} : {counts['inserted']} inserted, {counts['updated']} updated, {counts['deleted']} deleted")
+
+    rebuild_aggregates(engine)
+
+    return summary
+
+
+# Worker processes of filter_played_in_parallel import this file again on some platforms
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Update the database with a new set of IMDb dumps, applying only what changed.")
+    parser.add_argument('--database', default = 'database.db',
+                        help = "Database served by the API. A copy of it is refreshed, then swapped in. Defaults to database.db.")
+    parser.add_argument('--source', default = IMDB_URL,
+                        help = "Local directory (mirror) containing the *.tsv.gz dumps, or base URL. Defaults to the IMDb website.")
+    parser.add_argument('--memory-limit', type = float, default = MEMORY_LIMIT,
+                        help = f"Memory budget in MB for one parsed chunk of a dump. Defaults to {MEMORY_LIMIT}.")
+    parser.add_argument('--workers', type = int, default = None,
+                        help = "Number of processes filtering title.principals. Defaults to the number of CPUs.")
+    parser.add_argument('--report-dir', default = metrics.REPORT_DIR,
+                        help = f"Directory of the JSON report of the refresh. Defaults to {metrics.REPORT_DIR}.")
+    args = parser.parse_args()
+
+    metrics.add_sink(metrics.print_sink)
+    metrics.add_sink(metrics.json_sink(args.report_dir))
+
+    start = time.time()
+    metrics.start_run('refresh')
+    # The API keeps serving the current file while its copy is refreshed, then switches to the new one
+    with shadow_copy(args.database) as shadow:
+        engine = create_engine(f"sqlite:///{shadow}")
+        refresh(engine, test = False, source = args.source, memory_limit = args.memory_limit, workers = args.workers)
+        engine.dispose()
+    metrics.finish_run()
+
+    end = time.time()
+    print(f"Total time : {(end-start):.2f} s")
@@ -2,23 +2,142 @@ from models import Base, Movie, Actor, Movie_rating
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import create_engine
 from db_functions import *
+from aggregates import rebuild_aggregates
+from pipeline import run_pipeline, PIPELINE_THREADS
+from shadow import shadow_copy, shadow_path, swap_database
+import metrics
 
+import argparse
 import time
 import pandas as pd
 
-start = time.time()
-path = 'sqlite:///database.db'
+def build_stages(engine, source, memory_limit, workers, bulk):
+    """Stages of a build with the stages they need. Each one is a function taking the rows of its dump already loaded.
+    Ratings only keep known movies, and played_in known movies and actors : movies and actors don't need anything.
+    known_for adds its pairs to played_in without duplicates, once the pairs of title.principals are written.
 
-engine = create_engine(path)
+    Returns:
+        dict: For each stage, {'run': function, 'deps': names of the stages to finish before}
+    """
+    loaders = ['movies', 'ratings', 'actors', 'played_in', 'known_for']
+    stages = {
+        'movies': {'run': lambda offset: load_movies(engine, False, source, memory_limit, offset), 'deps': []},
+        'ratings': {'run': lambda offset: load_ratings(engine, False, source, memory_limit, offset), 'deps': ['movies']},
+        'actors': {'run': lambda offset: load_actors(engine, False, source, memory_limit, offset), 'deps': []},
+        'played_in': {'run': lambda offset: load_played_in(engine, False, source, memory_limit, workers, offset),
+                      'deps': ['movies', 'actors']},
+        'known_for': {'run': lambda offset: load_known_for(engine, False, source, memory_limit, offset),
+                      'deps': ['movies', 'actors', 'played_in']},
+    }
+    if bulk :
+        stages['indexes'] = {'run': lambda offset: create_indexes(engine), 'deps': loaders}
+    stages['aggregates'] = {'run': lambda offset: rebuild_aggregates(engine), 'deps': loaders + (['indexes'] if bulk else [])}
+    return stages
 
-Base.metadata.drop_all(bind = engine)
-Base.metadata.create_all(bind = engine)
 
-load_movies(engine, test = False)
-load_ratings(engine, test = False)
-load_actors(engine, test = False)
-load_played_in(engine, test = False)
+def resumed_stage(engine, stage, run, rows_done):
+    """Function running a stage from its checkpoint, then marking it as done."""
+    def run_stage():
+        run(rows_done)
+        with writing(engine) as connection:
+            save_checkpoint(connection, stage, done = True)
+    return run_stage
 
-end = time.time()
-print(f"Total time : {(end-start):.2f} s")
 
+def build_database(path, source = IMDB_URL, memory_limit = MEMORY_LIMIT, workers = None, bulk = False, fresh = False,
+                   threads = PIPELINE_THREADS, swap_into = None):
+    """Create the database : tables, the loaders, then summary tables.
+    Stages run as soon as the ones they need are finished (see build_stages), so independent loaders read and parse
+    their dumps at the same time. Their writes take turns on the single SQLite file.
+    Progress is saved in build_checkpoints : if a previous build stopped before the end, it is resumed
+    (completed stages are skipped, the others restart after their last committed chunk) instead of starting from scratch.
+
+    Args:
+        path (str): SQLAlchemy URL of the database, ie 'sqlite:///database.db'.
+        source (str, optional): Local mirror directory or base URL of the dumps. Defaults to IMDB_URL.
+        memory_limit (float, optional): Memory budget in MB for one chunk. Defaults to MEMORY_LIMIT.
+        workers (int, optional): Number of processes filtering title.principals. Defaults to the number of CPUs.
+        bulk (bool, optional): Fast PRAGMAs during the load, and indexes built once at the end. Defaults to False.
+        fresh (bool, optional): Start from scratch even if a previous build can be resumed. Defaults to False.
+        threads (int, optional): Number of stages running at the same time, 1 to run them one after another.
+          Defaults to PIPELINE_THREADS.
+        swap_into (str, optional): Path of the served database. If given, path is a shadow file : once built, it is
+          validated and replaces this one (see shadow.swap_database), so the API never sees a partial build. Defaults to None.
+
+    Returns:
+        sqlalchemy.engine.Engine: Engine to connect to database (the served one with swap_into).
+    """
+    metrics.start_run('build')
+    engine = create_bulk_engine(path) if bulk else create_engine(path)
+    stages = build_stages(engine, source, memory_limit, workers, bulk)
+
+    checkpoints = {} if fresh else read_checkpoints(engine)
+    if checkpoints and not all(checkpoints.get(stage, (0, False))[1] for stage in stages):
+        print(f"Resuming the previous build : {', '.join(f'{stage} ({rows} rows)' for stage, (rows, done) in checkpoints.items())}")
+    else :
+        checkpoints = {}
+        Base.metadata.drop_all(bind = engine)
+    create_tables(engine, indexes = not bulk)
+    # A stage can read ids while another one writes only in WAL mode
+    enable_wal(engine)
+
+    pipeline = {}
+    for stage, description in stages.items():
+        rows_done, done = checkpoints.get(stage, (0, False))
+        if done :
+            print(f"{stage} already done")
+            continue
+        pipeline[stage] = {'run': resumed_stage(engine, stage, description['run'], rows_done),
+                           'deps': [dep for dep in description['deps'] if not checkpoints.get(dep, (0, False))[1]]}
+
+    run_pipeline(pipeline, threads)
+
+    if swap_into is not None:
+        engine.dispose()
+        swap_database(engine.url.database, swap_into)
+        engine = create_engine(f"sqlite:///{swap_into}")
+
+    metrics.finish_run()
+    return engine
+
+
+# Worker processes of load_played_in import this file again on some platforms : the build must only run from here
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Create the database from scratch with IMDb dumps.")
+    parser.add_argument('--database', default = 'database.db',
+                        help = "Database served by the API. It is built in a shadow file next to it, then swapped in. Defaults to database.db.")
+    parser.add_argument('--source', default = IMDB_URL,
+                        help = "Local directory (mirror) containing the *.tsv.gz dumps, or base URL. Defaults to the IMDb website.")
+    parser.add_argument('--memory-limit', type = float, default = MEMORY_LIMIT,
+                        help = f"Memory budget in MB for one parsed chunk of a dump. Defaults to {MEMORY_LIMIT}.")
+    parser.add_argument('--workers', type = int, default = None,
+                        help = "Number of processes filtering title.principals. Defaults to the number of CPUs.")
+    parser.add_argument('--threads', type = int, default = PIPELINE_THREADS,
+                        help = f"Number of stages running at the same time, 1 to run them one after another. Defaults to {PIPELINE_THREADS}.")
+    parser.add_argument('--bulk', action = 'store_true',
+                        help = "Bulk-load mode : fast PRAGMAs during the load, and indexes built once at the end.")
+    parser.add_argument('--fresh', action = 'store_true',
+                        help = "Start from scratch, even if the previous build stopped before the end and could be resumed.")
+    parser.add_argument('--replay-rejects', action = 'store_true',
+                        help = f"Only try again to insert the rows of the reject files ({REJECT_DIR} directory).")
+    parser.add_argument('--report-dir', default = metrics.REPORT_DIR,
+                        help = f"Directory of the JSON report of the build. Defaults to {metrics.REPORT_DIR}.")
+    args = parser.parse_args()
+
+    metrics.add_sink(metrics.print_sink)
+    metrics.add_sink(metrics.json_sink(args.report_dir))
+
+    start = time.time()
+    if args.replay_rejects :
+        with shadow_copy(args.database) as shadow:
+            engine = create_engine(f"sqlite:///{shadow}")
+            replay_rejects(engine)
+            rebuild_aggregates(engine)
+            engine.dispose()
+    else :
+        # A stopped build is resumed from its shadow file : the served database is untouched until the end
+        build_database(f"sqlite:///{shadow_path(args.database)}", args.source, args.memory_limit, args.workers, args.bulk,
+                       args.fresh, args.threads, swap_into = args.database)
+
+    end = time.time()
+    print(f"Total time : {(end-start):.2f} s")
@@ -0,0 +1,186 @@
+from models import Base
+from analytics import BACKEND, analytics_path, export_analytics
+from column_store import store_path, write_column_store
+from contextlib import contextmanager, closing
+import metrics
+import sqlite3
+import os
+
+# Files written next to the served database : a build (kept between runs, so that it can be resumed) and a refresh
+BUILD_SUFFIX = '.build'
+REFRESH_SUFFIX = '.refresh'
+
+# Tables which can't be empty in a database ready to be served
+REQUIRED_TABLES = ['movies', 'movie_ratings', 'actors', 'genres', 'movie_genre', 'played_in',
+                   'year_counts', 'genre_counts', 'top_movies', 'actor_scores', 'cube_cells', 'movie_rankings']
+
+# Share of the rows of a required table that a new database may lose compared with the served one.
+# Beyond it, a truncated or empty dump is more likely than a real change of IMDb.
+MAX_SHRINK = 0.5
+
+# How long to wait for the readers of a database in WAL mode, to switch it to DELETE mode before the swap, in seconds
+SWAP_TIMEOUT = 30
+
+
+class Invalid_database(Exception):
+    """The shadow database failed a check : it is not swapped in, and the served one is kept."""
+
+
+def shadow_path(database, suffix = BUILD_SUFFIX):
+    """Path of the shadow file of database. It is in the same directory, so that os.replace is atomic."""
+    return database + suffix
+
+
+def remove_database(path):
+    """Remove a SQLite file with its journal, WAL and shared memory files."""
+    for file in [path, path + '-journal', path + '-wal', path + '-shm']:
+        if os.path.exists(file):
+            os.remove(file)
+
+
+def table_counts(path, tables):
+    """Number of rows of each table of a SQLite file, read-only. Missing tables are left out."""
+    with closing(sqlite3.connect(f"file:{path}?mode=ro", uri = True)) as connection:
+        existing = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        return {table: connection.execute(f"SELECT count(*) FROM {table}").fetchone()[0] for table in tables if table in existing}
+
+
+def validate_database(path, live = None):
+    """Check that a shadow database can be served : file integrity, foreign keys, every table of models.py,
+    a finished build and no required table empty or much smaller than in the served database.
+
+    Args:
+        path (str): Path of the shadow database.
+        live (str, optional): Path of the served database, to compare the number of rows. Defaults to None.
+
+    Returns:
+        dict: Number of rows of each required table
+    """
+    with closing(sqlite3.connect(f"file:{path}?mode=ro", uri = True)) as connection:
+        check = [row[0] for row in connection.execute("PRAGMA quick_check").fetchmany(10)]
+        if check != ['ok']:
+            raise Invalid_database(f"{path} is corrupted : {check}")
+
+        broken = connection.execute("PRAGMA foreign_key_check").fetchmany(10)
+        if broken :
+            raise Invalid_database(f"{path} has rows referring to missing ids, ie {broken}")
+
+        tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        missing = set(Base.metadata.tables) - tables
+        if missing :
+            raise Invalid_database(f"{path} misses the tables {sorted(missing)}")
+
+        unfinished = [row[0] for row in connection.execute("SELECT stage FROM build_checkpoints WHERE NOT done")]
+        if unfinished :
+            raise Invalid_database(f"The build of {path} is not finished : {unfinished}")
+
+    counts = table_counts(path, REQUIRED_TABLES)
+    empty = [table for table, rows in counts.items() if rows == 0]
+    if empty :
+        raise Invalid_database(f"Tables {empty} of {path} are empty")
+
+    if live is not None and os.path.exists(live):
+        for table, rows in table_counts(live, REQUIRED_TABLES).items():
+            if counts[table] < rows * (1 - MAX_SHRINK):
+                raise Invalid_database(f"{table} of {path} has {counts[table]} rows against {rows} in {live}")
+    return counts
+
+
+def fsync(path):
+    """Flush a file or a directory to the disk."""
+    descriptor = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def publish(shadow, database):
+    """Replace database by shadow in one atomic rename. Readers which already opened database keep reading the old file
+    until they close it, new ones open the new file.
+    The new file is switched to DELETE journal mode : it is never written in place once served, so readers don't need
+    the WAL and shared memory files. Its data version is kept above the one of the old file, so that cached responses
+    of the API are invalidated.
+
+    Args:
+        shadow (str): Path of the new database, in the same directory as database.
+        database (str): Path of the served database.
+    """
+    live_version = 0
+    if os.path.exists(database):
+        with closing(sqlite3.connect(database, timeout = SWAP_TIMEOUT)) as connection:
+            live_version = connection.execute("PRAGMA user_version").fetchone()[0]
+            # A WAL left next to database would be applied to the new file by its first reader : empty it first.
+            # Only databases served before shadow builds are in WAL mode.
+            if connection.execute("PRAGMA journal_mode").fetchone()[0] == 'wal':
+                try:
+                    mode = connection.execute("PRAGMA journal_mode = DELETE").fetchone()[0]
+                except sqlite3.OperationalError:
+                    mode = 'wal'
+                if mode != 'delete':
+                    raise Invalid_database(f"{database} is in WAL mode and is still used : stop the API once to swap it")
+
+    with closing(sqlite3.connect(shadow)) as connection:
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version <= live_version:
+            connection.execute(f"PRAGMA user_version = {live_version + 1}")
+        connection.execute("PRAGMA journal_mode = DELETE")
+
+    fsync(shadow)
+    os.replace(shadow, database)
+    # Files derived from the new database follow it : its column store and its DuckDB copy.
+    # Those of the old database which were not written again would be out of date.
+    for derived in [store_path, analytics_path]:
+        if os.path.exists(derived(shadow)):
+            os.replace(derived(shadow), derived(database))
+        elif os.path.exists(derived(database)):
+            os.remove(derived(database))
+    fsync(os.path.dirname(os.path.abspath(database)))
+
+
+def swap_database(shadow, database):
+    """Validate a shadow database, then serve it in place of database (see validate_database and publish).
+    Its column store and, with the duckdb backend, its DuckDB copy are written first and swapped with it.
+
+    Returns:
+        dict: Number of rows of each required table
+    """
+    with metrics.stage('swap'):
+        with metrics.step('validate'):
+            counts = validate_database(shadow, database)
+        with metrics.step('column store'):
+            write_column_store(shadow)
+        if BACKEND == 'duckdb':
+            with metrics.step('analytics'):
+                export_analytics(shadow)
+        with metrics.step('publish'):
+            publish(shadow, database)
+    print(f"{database} swapped : " + ", ".join(f"{rows} {table}" for table, rows in counts.items()))
+    return counts
+
+
+@contextmanager
+def shadow_copy(database, suffix = REFRESH_SUFFIX):
+    """Copy of database to change without touching the served file. Once the block is done,
+    the copy is validated and swapped in (see swap_database). If the block fails, the copy is removed.
+
+    Args:
+        database (str): Path of the served database.
+        suffix (str, optional): Suffix of the copy. Defaults to REFRESH_SUFFIX.
+
+    Yields:
+        str: Path of the copy
+    """
+    shadow = shadow_path(database, suffix)
+    remove_database(shadow)
+    with metrics.stage('copy'):
+        # The backup API gives a consistent copy even if other processes read database
+        with closing(sqlite3.connect(f"file:{database}?mode=ro", uri = True)) as source, closing(sqlite3.connect(shadow)) as copy:
+            source.backup(copy)
+
+    try:
+        yield shadow
+    except BaseException:
+        remove_database(shadow)
+        raise
+    swap_database(shadow, database)
@@ -0,0 +1,55 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Database checked : the small one by default, or the one given as argument (ie a full build, where plans matter)
+os.environ.setdefault('CINEMA_DATABASE', sys.argv[1] if len(sys.argv) > 1 else 'test_small_db/small_db.db')
+
+from sqlalchemy import text
+from analytics import to_sql
+import app
+
+import time
+
+
+def plan(session, query):
+    """Steps of the plan chosen by SQLite for a query of the API."""
+    return [row[3] for row in session.execute(text("EXPLAIN QUERY PLAN " + to_sql(query.statement))).fetchall()]
+
+
+if __name__ == '__main__':
+    start = time.time()
+
+    with app.Session(bind = app.engine.current()) as session:
+        # Each page of the /v2 rankings must be read in order from the index of its filters, without sorting.
+        # The cursor and min_votes add a range on score after the filters.
+        cases = [
+            (app.rating_page_query(session), 'ix_movie_rankings_genre (genre=?'),
+            (app.rating_page_query(session, genre = 'Drama'), 'ix_movie_rankings_genre (genre=?'),
+            (app.rating_page_query(session, is_adult = True), 'ix_movie_rankings_adult (genre=? AND is_adult=?'),
+            (app.rating_page_query(session, genre = 'Drama', is_adult = False, last = (5000.0, 'tt0000001')),
+             'ix_movie_rankings_adult (genre=? AND is_adult=? AND score'),
+            (app.rating_page_query(session, year = 2000), 'ix_movie_rankings_year (genre=? AND start_year=?'),
+            (app.rating_page_query(session, genre = 'Drama', is_adult = False, year = 2000, min_votes = 100),
+             'ix_movie_rankings_adult_year (genre=? AND is_adult=? AND start_year=?'),
+            # Wide ranges of years are checked row by row
+            (app.rating_page_query(session, genre = 'Drama', year_from = 1900, year_to = 2024), 'ix_movie_rankings_genre (genre=?)'),
+        ]
+        for query, index in cases:
+            steps = plan(session, query)
+            assert len(steps) == 1 and steps[0].startswith(f"SEARCH movie_rankings USING INDEX {index}"), steps
+
+        # Short ranges of years : one seek per year, only the pages of the years are sorted
+        steps = plan(session, app.merged_rating_page_query(session, [1999, 2000, 2001], genre = 'Comedy', is_adult = False))
+        assert steps.count("SEARCH movie_rankings USING INDEX ix_movie_rankings_adult_year (genre=? AND is_adult=? AND start_year=?)") == 3, steps
+        assert not any(step.startswith("SCAN movie_rankings") for step in steps), steps
+
+        # Filtered actor rankings read the matching movies from an index, not the whole table
+        for query in [app.actor_page_query(session, year_from = 1990, year_to = 2000, genre = 'Drama'),
+                      app.actor_page_query(session, is_adult = True)]:
+            steps = plan(session, query)
+            assert any(step.startswith("SEARCH movie_rankings USING INDEX") for step in steps), steps
+            assert not any(step.startswith("SCAN movie_rankings") for step in steps), steps
+
+    end = time.time()
+    print(f"Total time : {(end-start):.2f} s")
@@ -0,0 +1,58 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from models import Base
+from sqlalchemy import create_engine
+from db_functions import *
+from aggregates import rebuild_aggregates
+from refresh import refresh
+
+import pandas as pd
+
+import time
+
+# Content of every table, with genre names instead of ids since a refresh keeps the ids it already has
+QUERIES = {
+    'movies': "SELECT * FROM movies ORDER BY tconst",
+    'movie_ratings': "SELECT * FROM movie_ratings ORDER BY tconst",
+    'actors': "SELECT * FROM actors ORDER BY nconst",
+    'genres': "SELECT name FROM genres ORDER BY name",
+    'movie_genre': "SELECT movie, name FROM movie_genre JOIN genres ON genre = id ORDER BY movie, name",
+    'played_in': "SELECT * FROM played_in ORDER BY actor, movie",
+}
+
+
+def build(path, source):
+    engine = create_engine(path)
+
+    Base.metadata.drop_all(bind = engine)
+    Base.metadata.create_all(bind = engine)
+
+    load_movies(engine, test = True, source = source)
+    load_ratings(engine, test = True, source = source)
+    load_actors(engine, test = True, source = source)
+    load_played_in(engine, test = True, source = source)
+    load_known_for(engine, test = True, source = source)
+    rebuild_aggregates(engine)
+    return engine
+
+
+if __name__ == '__main__':
+    start = time.time()
+
+    # Database built with the first version of the files, then refreshed with the second version
+    engine = build('sqlite:///test_small_db/small_db_refresh.db', 'test_small_db')
+    summary = refresh(engine, test = True, source = 'test_small_db/v2')
+
+    # The result must be the same as a database built from scratch with the second version
+    expected = build('sqlite:///test_small_db/small_db_v2.db', 'test_small_db/v2')
+    for table, query in QUERIES.items():
+        pd.testing.assert_frame_equal(pd.read_sql(query, engine), pd.read_sql(query, expected), obj = table)
+
+    # A second refresh with the same files has nothing to do
+    summary = refresh(engine, test = True, source = 'test_small_db/v2')
+    assert all(sum(counts.values()) == 0 for counts in summary.values()), summary
+
+    end = time.time()
+    print(f"Total time : {(end-start):.2f} s")
@@ -6,25 +6,27 @@ from models import Base, Movie, Actor, Movie_rating, Movie_genre
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import create_engine, select, func, desc
 from db_functions import *
+from aggregates import rebuild_aggregates
 
 import pandas as pd
 
 import time
 
-start = time.time()
-path = 'sqlite:///test_small_db/small_db.db'
+if __name__ == '__main__':
+    start = time.time()
+    path = 'sqlite:///test_small_db/small_db.db'
 
-engine = create_engine(path)
+    engine = create_engine(path)
 
-Base.metadata.drop_all(bind = engine)
-Base.metadata.create_all(bind = engine)
-
-load_movies(engine, test = True)
-load_ratings(engine, test = True)
-load_actors(engine, test = True)
-load_played_in(engine, test = True)
-
-end = time.time()
-print(f"Total time : {(end-start):.2f} s") 
+    Base.metadata.drop_all(bind = engine)
+    Base.metadata.create_all(bind = engine)
 
+    load_movies(engine, test = True)
+    load_ratings(engine, test = True)
+    load_actors(engine, test = True)
+    load_played_in(engine, test = True)
+    load_known_for(engine, test = True)
+    rebuild_aggregates(engine)
 
+    end = time.time()
+    print(f"Total time : {(end-start):.2f} s")